@@ -16,6 +16,13 @@ from pymilvus import (
     utility
 )
 
+from milvus_columnar import ColumnBatch, insert_batch
+from milvus_common import collection_search_params, consistency_level, metric_type, prepare_vectors
+from milvus_load_manager import CollectionLoadManager
+from milvus_merchant_search import MERCHANT_NUM_PARTITIONS, merchant_field
+from milvus_readiness import ReadinessGate, print_status
+from milvus_text_featurizer import TextFeaturizer
+
 # Milvus 連線設定
 MILVUS_HOST = "localhost"
 MILVUS_PORT = 19530
@@ -49,7 +56,8 @@ def create_product_vectors_collection():
         FieldSchema(name="category_id", dtype=DataType.INT64),
         FieldSchema(name="price_range", dtype=DataType.INT64),
         FieldSchema(name="brand", dtype=DataType.VARCHAR, max_length=100),
-        FieldSchema(name="created_at", dtype=DataType.INT64)
+        FieldSchema(name="created_at", dtype=DataType.INT64),
+        merchant_field()  # partition key: 商家搜尋只掃描該商家所在分區
     ]
     
     # 建立集合 Schema
@@ -69,12 +77,14 @@ def create_product_vectors_collection():
         name=collection_name,
         schema=schema,
         using='default',
-        shards_num=2
+        shards_num=2,
+        num_partitions=MERCHANT_NUM_PARTITIONS,
+        consistency_level=consistency_level(collection_name)
     )
     
     # 建立索引
     index_params = {
-        "metric_type": "L2",
+        "metric_type": metric_type(collection_name),
         "index_type": "IVF_SQ8",
         "params": {"nlist": 1024}
     }
@@ -118,12 +128,13 @@ def create_user_vectors_collection():
         name=collection_name,
         schema=schema,
         using='default',
-        shards_num=2
+        shards_num=2,
+        consistency_level=consistency_level(collection_name)
     )
     
     # 建立索引
     index_params = {
-        "metric_type": "L2",
+        "metric_type": metric_type(collection_name),
         "index_type": "IVF_SQ8",
         "params": {"nlist": 512}
     }
@@ -168,12 +179,13 @@ def create_search_history_collection():
         name=collection_name,
         schema=schema,
         using='default',
-        shards_num=2
+        shards_num=2,
+        consistency_level=consistency_level(collection_name)
     )
     
     # 建立索引
     index_params = {
-        "metric_type": "L2",
+        "metric_type": metric_type(collection_name),
         "index_type": "IVF_SQ8",
         "params": {"nlist": 512}
     }
@@ -201,19 +213,18 @@ def insert_sample_product_data(collection):
     category_ids = [1, 1, 1, 2, 2]  # 電子產品, 電子產品, 電子產品, 服飾, 服飾
     price_ranges = [3, 4, 2, 1, 1]  # 價格區間編碼
     brands = ["Apple", "Apple", "Apple", "Nike", "Adidas"]
+    merchant_ids = [1, 1, 1, 2, 3]  # 品牌官方商店
     
     # 生成隨機向量 (512 維)
-    embeddings = []
+    embeddings = np.random.random((len(product_ids), 512)).astype(np.float32)
     for i in range(len(product_ids)):
         # 根據類別和品牌生成相似的向量
-        base_vector = np.random.random(512).astype(np.float32)
+        base_vector = embeddings[i]  # 直接修改批次陣列的列
         # 讓同類別的商品向量更相似
         if category_ids[i] == 1:  # 電子產品
             base_vector[:100] += 0.5  # 增加電子產品特徵
         elif category_ids[i] == 2:  # 服飾
             base_vector[100:200] += 0.5  # 增加服飾特徵
-        
-        embeddings.append(base_vector.tolist())
     
     # 準備插入資料
     data = [
@@ -222,11 +233,12 @@ def insert_sample_product_data(collection):
         category_ids,
         price_ranges,
         brands,
-        [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(product_ids)
+        [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(product_ids),
+        merchant_ids
     ]
     
     # 插入資料
-    collection.insert(data)
+    insert_batch(collection, ColumnBatch(collection.schema.fields, data))
     collection.flush()
     
     print(f"✅ 已插入 {len(product_ids)} 筆商品向量資料")
@@ -242,16 +254,14 @@ def insert_sample_user_data(collection):
     genders = ["M", "F", "M"]
     
     # 生成隨機向量 (256 維)
-    embeddings = []
+    embeddings = np.random.random((len(user_ids), 256)).astype(np.float32)
     for i in range(len(user_ids)):
         # 根據偏好生成向量
-        base_vector = np.random.random(256).astype(np.float32)
+        base_vector = embeddings[i]  # 直接修改批次陣列的列
         if preference_categories[i] == 1:  # 偏好電子產品
             base_vector[:50] += 0.3
         elif preference_categories[i] == 2:  # 偏好服飾
             base_vector[50:100] += 0.3
-        
-        embeddings.append(base_vector.tolist())
     
     # 準備插入資料
     data = [
@@ -264,7 +274,7 @@ def insert_sample_user_data(collection):
     ]
     
     # 插入資料
-    collection.insert(data)
+    insert_batch(collection, ColumnBatch(collection.schema.fields, data))
     collection.flush()
     
     print(f"✅ 已插入 {len(user_ids)} 筆用戶向量資料")
@@ -283,17 +293,9 @@ def insert_sample_search_data(collection):
         "藍牙耳機"
     ]
     
-    # 生成查詢向量 (256 維)
-    query_vectors = []
-    for i in range(len(user_ids)):
-        base_vector = np.random.random(256).astype(np.float32)
-        # 根據查詢內容調整向量
-        if "iPhone" in query_texts[i] or "MacBook" in query_texts[i]:
-            base_vector[:50] += 0.4  # 電子產品特徵
-        elif "Nike" in query_texts[i] or "Adidas" in query_texts[i]:
-            base_vector[50:100] += 0.4  # 服飾特徵
-        
-        query_vectors.append(base_vector.tolist())
+    # 由查詢文字生成查詢向量 (256 維)
+    # 不做 fit，使各腳本對相同文字產生相同向量
+    query_vectors = TextFeaturizer(dim=256).transform(query_texts)
     
     results_counts = [5, 3, 8, 12, 6]
     clicked_products = ["1", "2", "4", "5", "3"]
@@ -308,9 +310,8 @@ def insert_sample_search_data(collection):
         [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(user_ids)
     ]
     
-    # 插入資料
-    collection.insert(data)
-    collection.flush()
+    # 插入資料 (集合為 Eventually 一致性，不需 flush)
+    insert_batch(collection, ColumnBatch(collection.schema.fields, data))
     
     print(f"✅ 已插入 {len(user_ids)} 筆搜尋歷史資料")
 
@@ -345,7 +346,8 @@ def create_recommendation_collection():
         name=collection_name,
         schema=schema,
         using='default',
-        shards_num=2
+        shards_num=2,
+        consistency_level=consistency_level(collection_name)
     )
     
     # 建立索引
@@ -391,21 +393,25 @@ def test_vector_search():
     """測試向量搜尋功能"""
     print("測試向量搜尋功能...")
     
-    # 載入集合
-    product_collection = Collection("product_vectors")
-    product_collection.load()
+    # 在記憶體預算內載入集合
+    load_manager = CollectionLoadManager()
+    load_manager.sync_loaded_collections()
+    product_collection = load_manager.acquire("product_vectors")
+    user_collection = load_manager.acquire("user_vectors")
+    search_collection = load_manager.acquire("search_history")
     
-    user_collection = Collection("user_vectors")
-    user_collection.load()
+    # 載入完成後暖機，延遲穩定才視為就緒
+    readiness = ReadinessGate([product_collection, user_collection],
+                              source_collections={"search_history": search_collection})
+    readiness.run()
+    print(f"✅ 集合已就緒 ({readiness.status()['elapsed_s']:.2f}s)")
+    print_status(readiness.status())
     
-    # 生成測試查詢向量
-    query_vector = np.random.random(512).astype(np.float32).tolist()
+    # 生成測試查詢向量 (依集合距離類型正規化)
+    query_vector = prepare_vectors("product_vectors", np.random.random(512))[0].tolist()
     
     # 執行搜尋
-    search_params = {
-        "metric_type": "L2",
-        "params": {"nprobe": 10}
-    }
+    search_params = collection_search_params("product_vectors")
     
     results = product_collection.search(
         data=[query_vector],
@@ -419,6 +425,8 @@ def test_vector_search():
     print(f"搜尋結果數量: {len(results[0])}")
     for hit in results[0]:
         print(f"  - 商品ID: {hit.entity.get('product_id')}, 距離: {hit.distance:.4f}")
+    
+    load_manager.report()
 
 def create_collections_and_insert_data():
     """建立所有集合並插入資料"""
@@ -436,6 +444,9 @@ def create_collections_and_insert_data():
     insert_sample_search_data(search_collection)
     insert_sample_recommendations(rec_collection)
     
+    # 搜尋歷史寫入時不逐批 flush；初始化結束前 flush 一次，num_entities 只計入已 flush 的 segment
+    search_collection.flush()
+    
     print("✅ 所有集合建立和資料插入完成")
 
 def show_collection_info():
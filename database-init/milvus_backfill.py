@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+"""
+可續傳的批次回填 (backfill)
+大量寫入 product_vectors / user_vectors 時，每個批次以 upsert 寫入後才更新 checkpoint
+(來源游標、最後提交的主鍵範圍、累計筆數)，中斷後重新執行會從 checkpoint 繼續，
+不刪除、不重建目標集合；upsert 依主鍵覆寫，重送最後一個批次結果不變
+寫入以每秒筆數的 token bucket 限速，可另外以探測搜尋的 p99 自動降速，避免拖慢線上搜尋
+
+來源:
+  - 快照目錄 (milvus_snapshot.py export 的輸出): 游標為資料列位置
+  - 另一個 Milvus 集合 (--source-host): 游標為已完成的主鍵上界，依主鍵範圍分段掃描
+
+用法:
+    python3 milvus_backfill.py run --snapshot ./snapshots/20240101 --collection product_vectors \\
+        --checkpoint product_vectors.ckpt.json --rows-per-s 5000
+    python3 milvus_backfill.py run --source-host 10.0.0.5 --collection user_vectors \\
+        --checkpoint user_vectors.ckpt.json --max-search-p99-ms 50
+    python3 milvus_backfill.py status --checkpoint product_vectors.ckpt.json
+    python3 milvus_backfill.py bench                                # 本地引擎: 中斷續傳與限速對搜尋延遲的影響
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+from milvus_columnar import ColumnBatch, upsert_batch
+from milvus_common import collection_search_params, prepare_vectors
+from milvus_verify import find_pk_bounds, range_expr
+
+# 回填設定
+CHECKPOINT_FORMAT_VERSION = 1
+DEFAULT_BATCH_SIZE = 5_000
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0
+MAX_RETRY_BACKOFF_SECONDS = 30.0
+BURST_SECONDS = 1.0  # token bucket 容量 = 每秒筆數 × BURST_SECONDS
+
+# 搜尋延遲保護 (AIMD: 超過目標時速率減半，低於目標時每次增加一成，不超過設定上限)
+PROBE_EVERY_BATCHES = 5
+PROBE_QUERIES = 20
+PROBE_LIMIT = 10
+MIN_ROWS_PER_S = 100
+RATE_DECREASE = 0.5
+RATE_INCREASE = 1.1
+
+# 測量設定
+BENCH_ROWS = 50_000
+BENCH_DIM = 512
+BENCH_BATCH_SIZE = 2_000
+BENCH_INTERRUPT_AFTER = 7  # 第一次執行寫入幾個批次後中斷
+BENCH_ROWS_PER_S = 5_000
+BENCH_RATE_BATCHES = 10  # 限速比較時每種設定寫入的批次數
+
+
+# ==============================================
+# Checkpoint
+# ==============================================
+
+class Checkpoint:
+    """回填進度；每個批次提交後以暫存檔取代寫入，中斷時不會留下寫到一半的檔案"""
+
+    def __init__(self, path, source, target, cursor=None, last_pk_range=None, committed_rows=0,
+                 batches=0, retries=0, status="running", error=None, started_at=None, updated_at=None):
+        self.path = path
+        self.source = source
+        self.target = target
+        self.cursor = cursor
+        self.last_pk_range = last_pk_range
+        self.committed_rows = committed_rows
+        self.batches = batches
+        self.retries = retries
+        self.status = status
+        self.error = error
+        self.started_at = started_at or time.time()
+        self.updated_at = updated_at
+
+    def to_dict(self):
+        return {
+            "format_version": CHECKPOINT_FORMAT_VERSION,
+            "source": self.source,
+            "target": self.target,
+            "cursor": self.cursor,
+            "last_pk_range": self.last_pk_range,
+            "committed_rows": self.committed_rows,
+            "batches": self.batches,
+            "retries": self.retries,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+        }
+
+    def save(self):
+        self.updated_at = time.time()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def commit(self, cursor, pk_range, n_rows):
+        """記錄已提交的批次並寫入檔案"""
+        self.cursor = int(cursor)
+        self.last_pk_range = pk_range
+        self.committed_rows += n_rows
+        self.batches += 1
+        self.save()
+
+    @classmethod
+    def open(cls, path, source, target):
+        """讀取既有 checkpoint (來源或目標不同時拒絕續傳)，不存在時建立新的"""
+        if not os.path.exists(path):
+            return cls(path, source, target)
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format_version") != CHECKPOINT_FORMAT_VERSION:
+            raise ValueError(f"不支援的 checkpoint 版本: {data.get('format_version')}")
+        if data["source"] != source or data["target"] != target:
+            raise ValueError(f"checkpoint {path} 屬於其他回填工作 "
+                             f"({data['source']} → {data['target']})，請改用其他 checkpoint 路徑")
+        data.pop("format_version")
+        return cls(path, **data)
+
+
+# ==============================================
+# 來源
+# ==============================================
+
+class SnapshotSource:
+    """milvus_snapshot.py 匯出目錄中的單一集合；游標為已提交的資料列數"""
+
+    def __init__(self, snapshot_dir, collection_name):
+        from milvus_snapshot import MANIFEST_FILE
+
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        entries = [entry for entry in manifest["collections"] if entry["name"] == collection_name]
+        if not entries:
+            raise ValueError(f"快照 {snapshot_dir} 不包含集合 {collection_name}")
+        self.snapshot_dir = snapshot_dir
+        self.entry = entries[0]
+        self.schema = CollectionSchema.construct_from_dict(self.entry["schema"])
+        self.indexes = self.entry["indexes"]
+
+    def describe(self):
+        return {"type": "snapshot", "path": os.path.abspath(self.snapshot_dir), "collection": self.entry["name"],
+                "row_count": self.entry["row_count"]}
+
+    def batches(self, cursor, batch_size):
+        """由游標位置開始產生 (批次, 提交後的游標)；略過游標之前的整個 row group"""
+        import pyarrow.parquet as pq
+
+        offset = cursor or 0
+        vectors = {
+            name: np.load(os.path.join(self.snapshot_dir, filename), mmap_mode="r")
+            for name, filename in self.entry["vector_files"].items()
+        }
+        parquet_file = pq.ParquetFile(os.path.join(self.snapshot_dir, self.entry["scalar_file"]))
+        n_groups = parquet_file.num_row_groups
+        first_group, position = n_groups, 0
+        for group in range(n_groups):
+            n_rows = parquet_file.metadata.row_group(group).num_rows
+            if position + n_rows > offset:
+                first_group = group
+                break
+            position += n_rows
+
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=range(first_group, n_groups)):
+            n_rows, skip = record_batch.num_rows, max(0, offset - position)
+            if skip < n_rows:
+                start = position + skip
+                yield ColumnBatch.from_arrow(self.schema.fields, record_batch.slice(skip), {
+                    name: vectors[name][start:position + n_rows] for name in vectors
+                }), position + n_rows
+            position += n_rows
+
+
+class CollectionSource:
+    """另一個集合 (例如舊叢集)；依主鍵範圍 [lo, hi) 分段掃描，游標為已完成範圍的上界
+
+    範圍寬度依實際筆數調整，使每段約為 batch_size 筆；同一段超過 batch_size 時依主鍵排序分成多個批次，
+    中間批次的游標為該批最大主鍵 + 1
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.schema = collection.schema
+        self.indexes = [{"field_name": index.field_name, "index_name": index.index_name, "params": index.params}
+                        for index in collection.indexes]
+        self.pk_name = next(f.name for f in self.schema.fields if f.is_primary)
+
+    def describe(self):
+        return {"type": "collection", "collection": self.collection.name,
+                "using": getattr(self.collection, "_using", "local")}
+
+    def _scan(self, lo, hi, batch_size):
+        fields = [f.name for f in self.schema.fields]
+        if self.schema.enable_dynamic_field:
+            fields.append("*")  # 一併讀出動態欄位資料
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr=range_expr(self.pk_name, lo, hi),
+                                                  output_fields=fields)
+        rows = []
+        try:
+            while True:
+                page = iterator.next()
+                if not page:
+                    break
+                rows.extend(page)
+        finally:
+            iterator.close()
+        return rows
+
+    def batches(self, cursor, batch_size):
+        bounds = find_pk_bounds(self.collection, self.pk_name)
+        if bounds is None:
+            return
+        pk_min, pk_max = bounds
+        total = self.collection.query(expr="", output_fields=["count(*)"])[0]["count(*)"]
+        width = max(1, (pk_max - pk_min + 1) * batch_size // max(total, 1))
+        lo = pk_min if cursor is None else cursor
+
+        while lo <= pk_max:
+            hi = min(lo + width, pk_max + 1)
+            rows = self._scan(lo, hi, batch_size)
+            rows.sort(key=lambda row: row[self.pk_name])
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start:start + batch_size]
+                last = start + batch_size >= len(rows)
+                yield ColumnBatch.from_rows(self.schema.fields, chunk, self.schema.enable_dynamic_field), \
+                    hi if last else chunk[-1][self.pk_name] + 1
+            if not rows:
+                yield None, hi  # 空範圍也推進游標
+            width = int(np.clip(width * batch_size / max(len(rows), 1), width // 2, width * 2)) or 1
+            lo = hi
+
+
+# ==============================================
+# 限速
+# ==============================================
+
+class RowRateLimiter:
+    """每秒筆數的 token bucket (由空開始累積，閒置後最多累積 burst_seconds 秒)；rows_per_s 為 None 時不限速
+
+    未設定速率時第一次 slow_down 以目前實測的寫入速率為上限開始限速 (只設 --max-search-p99-ms 的情況)
+    """
+
+    def __init__(self, rows_per_s=None, burst_seconds=BURST_SECONDS):
+        self.max_rows_per_s = rows_per_s
+        self.rows_per_s = rows_per_s
+        self.burst_seconds = burst_seconds
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._started = None
+        self._acquired = 0
+        self.waited_s = 0.0
+
+    def measured_rows_per_s(self):
+        """開始寫入以來的平均每秒筆數 (尚未寫入時回傳 None)"""
+        if self._started is None:
+            return None
+        return self._acquired / max(time.monotonic() - self._started, 1e-9)
+
+    def acquire(self, n_rows):
+        """等待到足夠的 token；超過容量的批次先欠款，由之後的等待補回"""
+        if self._started is None:
+            self._started = time.monotonic()
+        self._acquired += n_rows
+        if self.rows_per_s is None:
+            return
+        now = time.monotonic()
+        capacity = self.rows_per_s * self.burst_seconds
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rows_per_s)
+        self._updated = now
+        self._tokens -= n_rows
+        if self._tokens < 0:
+            wait = -self._tokens / self.rows_per_s
+            time.sleep(wait)
+            self.waited_s += wait
+
+    def slow_down(self):
+        if self.rows_per_s is None:
+            measured = self.measured_rows_per_s()
+            if measured is None:
+                return
+            self.max_rows_per_s = self.rows_per_s = max(MIN_ROWS_PER_S, measured)
+            self._tokens, self._updated = 0.0, time.monotonic()
+        self.rows_per_s = max(MIN_ROWS_PER_S, self.rows_per_s * RATE_DECREASE)
+
+    def speed_up(self):
+        if self.rows_per_s is not None:
+            self.rows_per_s = min(self.max_rows_per_s, self.rows_per_s * RATE_INCREASE)
+
+
+class SearchLatencyGuard:
+    """定期以探測查詢測量目標集合的搜尋 p99，超過目標時降低回填速率"""
+
+    def __init__(self, collection, target_p99_ms, queries, anns_field, probe_every=PROBE_EVERY_BATCHES):
+        self.collection = collection
+        self.target_p99_ms = target_p99_ms
+        self.queries = queries.tolist()
+        self.anns_field = anns_field
+        self.probe_every = probe_every
+        self.search_params = collection_search_params(collection.name)
+        self.last_p99_ms = None
+
+    def probe(self):
+        latencies = []
+        for query in self.queries:
+            started = time.perf_counter()
+            self.collection.search(data=[query], anns_field=self.anns_field, param=self.search_params,
+                                   limit=PROBE_LIMIT)
+            latencies.append((time.perf_counter() - started) * 1000)
+        self.last_p99_ms = float(np.percentile(latencies, 99))
+        return self.last_p99_ms
+
+    def observe(self, batches, limiter):
+        if batches % self.probe_every:
+            return
+        if self.probe() > self.target_p99_ms:
+            limiter.slow_down()
+        else:
+            limiter.speed_up()
+
+
+# ==============================================
+# 回填工作
+# ==============================================
+
+class BackfillJob:
+    """由來源逐批 upsert 到目標集合，每批提交後更新 checkpoint"""
+
+    def __init__(self, source, target, checkpoint_path, batch_size=DEFAULT_BATCH_SIZE, limiter=None,
+                 latency_guard=None, max_retries=MAX_RETRIES):
+        pk_field = next(f for f in target.schema.fields if f.is_primary)
+        if pk_field.auto_id:
+            raise ValueError(f"集合 {target.name} 使用 auto_id 主鍵，無法以 upsert 回填")
+        self.source = source
+        self.target = target
+        self.pk_name = pk_field.name
+        self.batch_size = batch_size
+        self.limiter = limiter or RowRateLimiter()
+        self.latency_guard = latency_guard
+        self.max_retries = max_retries
+        self.checkpoint = Checkpoint.open(checkpoint_path, source.describe(), target.name)
+
+    def _upsert(self, batch):
+        """寫入批次，暫時性錯誤以指數退避重試"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return upsert_batch(self.target, batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                backoff = min(MAX_RETRY_BACKOFF_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                print(f"⚠️ 批次寫入失敗 ({e})，{backoff:.1f}s 後重試 ({attempt + 1}/{self.max_retries})")
+                self.checkpoint.retries += 1
+                time.sleep(backoff)
+
+    def run(self, max_batches=None):
+        """執行到來源結束 (或寫入 max_batches 個批次)，回傳本次寫入筆數；失敗時記錄錯誤後拋出"""
+        checkpoint = self.checkpoint
+        if checkpoint.status == "done":
+            print(f"✅ {self.target.name} 已回填完成 ({checkpoint.committed_rows} 筆)，略過")
+            return 0
+        if checkpoint.batches:
+            print(f"↪️ 由 checkpoint 繼續: 游標 {checkpoint.cursor}，已提交 {checkpoint.committed_rows} 筆")
+        checkpoint.status, checkpoint.error = "running", None
+
+        written, batches = 0, 0
+        try:
+            for batch, cursor in self.source.batches(checkpoint.cursor, self.batch_size):
+                if batch is None or not len(batch):
+                    checkpoint.cursor = cursor
+                    continue
+                self.limiter.acquire(len(batch))
+                self._upsert(batch)
+                ids = batch.columns[self.pk_name]
+                checkpoint.commit(cursor, [int(np.min(ids)), int(np.max(ids))], len(batch))
+                written += len(batch)
+                batches += 1
+                if self.latency_guard is not None:
+                    self.latency_guard.observe(checkpoint.batches, self.limiter)
+                if max_batches is not None and batches >= max_batches:
+                    return written
+            checkpoint.status = "done"
+            checkpoint.save()
+            return written
+        except BaseException as e:
+            checkpoint.status, checkpoint.error = "failed", str(e) or type(e).__name__
+            checkpoint.save()
+            raise
+
+
+def ensure_target(source, name):
+    """目標集合不存在時依來源 schema 與索引建立；已存在時直接使用 (不刪除既有資料)"""
+    from pymilvus import Collection, utility
+    from milvus_common import consistency_level
+
+    if utility.has_collection(name):
+        return Collection(name)
+    print(f"建立目標集合 {name}...")
+    collection = Collection(name=name, schema=source.schema, using='default',
+                            consistency_level=consistency_level(name))
+    for index in source.indexes:
+        collection.create_index(field_name=index["field_name"], index_params=index["params"],
+                                index_name=index["index_name"])
+    return collection
+
+
+def print_checkpoint(checkpoint):
+    elapsed = (checkpoint.updated_at or time.time()) - checkpoint.started_at
+    print(f"📋 {checkpoint.target} ← {checkpoint.source}")
+    print(f"  狀態: {checkpoint.status}, 已提交 {checkpoint.committed_rows} 筆 / {checkpoint.batches} 批, "
+          f"重試 {checkpoint.retries} 次, 經過 {elapsed:.0f}s")
+    print(f"  游標: {checkpoint.cursor}, 最後提交主鍵範圍: {checkpoint.last_pk_range}")
+    if checkpoint.error:
+        print(f"  錯誤: {checkpoint.error}")
+
+
+# ==============================================
+# 測量
+# ==============================================
+
+class LockedCollection:
+    """本地引擎不支援同時寫入與搜尋；以鎖序列化，寫入期間的搜尋需等待 (近似寫入對查詢的資源競爭)"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def search(self, *args, **kwargs):
+        with self._lock:
+            return self._collection.search(*args, **kwargs)
+
+    def upsert(self, data, **kwargs):
+        with self._lock:
+            return self._collection.upsert(data, **kwargs)
+
+
+class FlakyCollection:
+    """於指定的 upsert 次數拋出一次錯誤 (模擬暫時性連線錯誤)"""
+
+    def __init__(self, collection, fail_at):
+        self._collection = collection
+        self._fail_at = set(fail_at)
+        self._calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def upsert(self, data, **kwargs):
+        self._calls += 1
+        if self._calls in self._fail_at:
+            self._fail_at.discard(self._calls)
+            raise ConnectionError("模擬的連線中斷")
+        return self._collection.upsert(data, **kwargs)
+
+
+def bench_schema(dim):
+    return CollectionSchema(fields=[
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+    ], description="回填測量")
+
+
+def search_load(collection, queries, stop, latencies):
+    """模擬線上搜尋流量"""
+    search_params = collection_search_params(collection.name)
+    position = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        collection.search(data=[queries[position % len(queries)]], anns_field="embedding",
+                          param=search_params, limit=PROBE_LIMIT)
+        latencies.append((time.perf_counter() - started) * 1000)
+        position += 1
+
+
+def run_bench(args):
+    from milvus_local_engine import LocalMilvus
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        source_client = LocalMilvus(os.path.join(data_dir, "source"))
+        source = source_client.collection("product_vectors", bench_schema(args.dim))
+        ids = rng.permutation(args.rows * 3)[:args.rows]  # 不連續的主鍵
+        for start in range(0, args.rows, 10_000):
+            block = ids[start:start + 10_000]
+            source.insert([block, prepare_vectors("product_vectors",
+                                                  rng.random((len(block), args.dim), dtype=np.float32)),
+                           rng.integers(1, 11, len(block))])
+        source.flush()
+        queries = prepare_vectors("product_vectors", rng.random((PROBE_QUERIES, args.dim), dtype=np.float32))
+
+        print(f"🧪 中斷與續傳 ({args.rows} 筆, 每批 {args.batch_size} 筆)")
+        target_client = LocalMilvus(os.path.join(data_dir, "target"))
+        target = target_client.collection("product_vectors", bench_schema(args.dim))
+        checkpoint_path = os.path.join(data_dir, "product_vectors.ckpt.json")
+        flaky = FlakyCollection(target, fail_at=[3])
+        job = BackfillJob(CollectionSource(source), flaky, checkpoint_path, args.batch_size, max_retries=2)
+        first = job.run(max_batches=BENCH_INTERRUPT_AFTER)
+        print(f"  第一次執行: 寫入 {first} 筆後中斷, 重試 {job.checkpoint.retries} 次")
+        print_checkpoint(job.checkpoint)
+
+        resumed = BackfillJob(CollectionSource(source), target, checkpoint_path, args.batch_size)
+        second = resumed.run()
+        stored = target.query(expr="", output_fields=["count(*)"])[0]["count(*)"]
+        stored_ids = np.array([row["product_id"] for row in target.query(expr="", output_fields=["product_id"])])
+        print(f"  續傳: 寫入 {second} 筆; 合計 {first + second} 筆, 目標集合 {stored} 筆 "
+              f"(來源 {args.rows} 筆, 主鍵一致: {np.array_equal(np.sort(stored_ids), np.sort(ids))})")
+        again = BackfillJob(CollectionSource(source), target, checkpoint_path, args.batch_size).run()
+        print(f"  完成後再次執行: 寫入 {again} 筆")
+
+        print("\n🧪 限速對線上搜尋的影響 (背景搜尋執行緒)")
+        target.create_index("embedding", {"metric_type": "IP", "index_type": "IVF_FLAT", "params": {"nlist": 128}})
+        target.load()
+        target = LockedCollection(target)
+        stop, idle_latencies = threading.Event(), []
+        thread = threading.Thread(target=search_load, args=(target, queries.tolist(), stop, idle_latencies))
+        thread.start()
+        time.sleep(1.0)
+        stop.set()
+        thread.join()
+
+        # 目標已有全部資料，再次回填即以 upsert 覆寫相同的資料列
+        rows = []
+        for label, rows_per_s in (("不限速", None), (f"{args.rows_per_s:.0f} 筆/秒", args.rows_per_s)):
+            checkpoint_path = os.path.join(data_dir, f"rate_{rows_per_s}.ckpt.json")
+            stop, latencies = threading.Event(), []
+            thread = threading.Thread(target=search_load, args=(target, queries.tolist(), stop, latencies))
+            thread.start()
+            started = time.perf_counter()
+            job = BackfillJob(CollectionSource(source), target, checkpoint_path, args.batch_size,
+                              limiter=RowRateLimiter(rows_per_s))
+            written = job.run(max_batches=BENCH_RATE_BATCHES)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            thread.join()
+            rows.append((label, written / elapsed, *np.percentile(latencies, [50, 99])))
+
+        idle_p50, idle_p99 = np.percentile(idle_latencies, [50, 99])
+        print(f"{'設定':<14}{'回填 筆/秒':>12}{'搜尋 p50 ms':>14}{'搜尋 p99 ms':>14}")
+        print(f"{'無回填':<14}{'-':>12}{idle_p50:>14.2f}{idle_p99:>14.2f}")
+        for label, throughput, p50, p99 in rows:
+            print(f"{label:<14}{throughput:>12.0f}{p50:>14.2f}{p99:>14.2f}")
+        source_client.close()
+        target_client.close()
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="可續傳的批次回填")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="執行或續傳回填")
+    source = run.add_mutually_exclusive_group(required=True)
+    source.add_argument("--snapshot", help="milvus_snapshot.py 匯出目錄")
+    source.add_argument("--source-host", help="來源 Milvus 主機")
+    run.add_argument("--source-port", type=int, default=19530)
+    run.add_argument("--collection", required=True)
+    run.add_argument("--target", default=None, help="目標集合名稱 (預設與來源相同)")
+    run.add_argument("--checkpoint", required=True)
+    run.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    run.add_argument("--rows-per-s", type=float, default=None, help="寫入速率上限")
+    run.add_argument("--max-search-p99-ms", type=float, default=None,
+                     help="目標集合搜尋 p99 超過時自動降速 (未設 --rows-per-s 時以實測速率為起點)")
+    run.add_argument("--merchant-map", default=None,
+                     help="[{product_id, merchant_id}, ...] JSON，為沒有 merchant_id 的舊資料補上商家")
+
+    status = subparsers.add_parser("status", help="顯示 checkpoint")
+    status.add_argument("--checkpoint", required=True)
+
+    bench = subparsers.add_parser("bench", help="本地引擎測量")
+    bench.add_argument("--rows", type=int, default=BENCH_ROWS)
+    bench.add_argument("--dim", type=int, default=BENCH_DIM)
+    bench.add_argument("--batch-size", type=int, default=BENCH_BATCH_SIZE)
+    bench.add_argument("--rows-per-s", type=float, default=BENCH_ROWS_PER_S)
+    bench.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        if not os.path.exists(args.checkpoint):
+            print(f"❌ 找不到 checkpoint: {args.checkpoint}")
+            sys.exit(1)
+        with open(args.checkpoint, encoding="utf-8") as f:
+            data = json.load(f)
+        data.pop("format_version")
+        print_checkpoint(Checkpoint(args.checkpoint, **data))
+        return
+    if args.command == "bench":
+        run_bench(args)
+        return
+
+    from pymilvus import Collection, connections
+    from milvus_common import connect_to_milvus
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        if args.snapshot:
+            source = SnapshotSource(args.snapshot, args.collection)
+        else:
+            connections.connect(alias="backfill_source", host=args.source_host, port=args.source_port)
+            source = CollectionSource(Collection(args.collection, using="backfill_source"))
+        if args.merchant_map:
+            from milvus_merchant_search import MerchantMapSource, load_merchant_map
+
+            source = MerchantMapSource(source, load_merchant_map(args.merchant_map), args.merchant_map)
+        target = ensure_target(source, args.target or args.collection)
+        target.load()
+
+        latency_guard = None
+        if args.max_search_p99_ms is not None:
+            anns_field = next(f for f in target.schema.fields if f.dtype == DataType.FLOAT_VECTOR)
+            queries = prepare_vectors(target.name, np.random.default_rng(0).random(
+                (PROBE_QUERIES, anns_field.params["dim"]), dtype=np.float32))
+            latency_guard = SearchLatencyGuard(target, args.max_search_p99_ms, queries, anns_field.name)
+
+        job = BackfillJob(source, target, args.checkpoint, args.batch_size,
+                          limiter=RowRateLimiter(args.rows_per_s), latency_guard=latency_guard)
+        started = time.time()
+        written = job.run()
+        elapsed = time.time() - started
+        print(f"✅ 回填完成: 本次寫入 {written} 筆, {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f} 筆/秒)")
+        print_checkpoint(job.checkpoint)
+    except Exception as e:
+        print(f"❌ 回填中斷: {e} (重新執行相同指令會由 checkpoint 繼續)")
+        sys.exit(1)
+    finally:
+        connections.disconnect("default")
+        if args.source_host:
+            connections.disconnect("backfill_source")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
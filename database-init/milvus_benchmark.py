@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+基準測試紀錄與回歸比較
+以與初始化腳本相同的維度、距離類型與索引參數，對 product_vectors / user_vectors 測量:
+  - ingest: 欄位式批次寫入吞吐量
+  - index_build: 建立索引耗時
+  - search / filtered_search: 逐筆搜尋 p50 / p99 與 QPS (重複數輪取中位數，並記錄各輪的最小 / 最大值)
+  - recall: recall@k (相對精確搜尋)
+結果連同環境資訊 (筆數、維度、索引參數、CPU 數、套件版本、git commit) 寫入帶版本的 JSON 檔，
+並可與指定的基準檔比較，變化同時超過容許範圍與兩次執行各輪的離散程度時才標記回歸 / 改善
+
+用法:
+    python3 milvus_benchmark.py run --label baseline                     # 本地引擎，寫入 benchmark-results/
+    python3 milvus_benchmark.py run --label ivf-sq8 --baseline benchmark-results/baseline-20240101-120000.json
+    python3 milvus_benchmark.py run --milvus --rows 100000
+    python3 milvus_benchmark.py compare benchmark-results/new.json benchmark-results/baseline.json
+    python3 milvus_benchmark.py list
+結束碼: 有回歸時為 2 (可用於 CI)，否則為 0
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+from milvus_columnar import ColumnBatch, insert_batch
+from milvus_common import collection_search_params, metric_type, prepare_vectors
+from milvus_local_engine import LocalMilvus, brute_force_search
+from milvus_metric_bench import COLLECTION_SPECS, generate_vectors, recall
+
+# 基準測試設定
+RESULT_FORMAT_VERSION = 1
+DEFAULT_OUTPUT_DIR = "benchmark-results"
+DEFAULT_ROWS = 20_000
+DEFAULT_QUERIES = 200
+DEFAULT_LIMIT = 10
+DEFAULT_REPEAT = 3
+INGEST_BATCH_SIZE = 5_000
+BENCH_COLLECTION_PREFIX = "benchmark_"
+
+# 與 milvus-init.py 相同的索引參數
+BENCH_INDEXES = {
+    "product_vectors": {"index_type": "IVF_SQ8", "params": {"nlist": 1024}},
+    "user_vectors": {"index_type": "IVF_SQ8", "params": {"nlist": 512}},
+}
+
+# 容許範圍: 時間 / 吞吐量為相對變化，recall 為絕對變化
+DEFAULT_TOLERANCE = 0.10
+DEFAULT_RECALL_TOLERANCE = 0.01
+LOWER_IS_BETTER, HIGHER_IS_BETTER = "lower", "higher"
+METRICS = {
+    "ingest": (("rows_per_s", HIGHER_IS_BETTER),),
+    "index_build": (("seconds", LOWER_IS_BETTER),),
+    "search": (("p50_ms", LOWER_IS_BETTER), ("p99_ms", LOWER_IS_BETTER), ("qps", HIGHER_IS_BETTER)),
+    "filtered_search": (("p50_ms", LOWER_IS_BETTER), ("p99_ms", LOWER_IS_BETTER), ("qps", HIGHER_IS_BETTER)),
+    "recall": (("recall_at_k", HIGHER_IS_BETTER),),
+}
+ABSOLUTE_TOLERANCE_METRICS = ("recall_at_k",)
+# 這些設定不同時結果不可直接比較
+COMPARABLE_KEYS = ("rows", "dim", "metric_type", "index", "search_params", "limit", "queries")
+
+
+# ==============================================
+# 環境資訊
+# ==============================================
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(engine):
+    import pymilvus
+
+    env = {
+        "engine": engine,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pymilvus": pymilvus.__version__,
+        "git_commit": git_commit(),
+    }
+    if engine == "milvus":
+        from pymilvus import utility
+
+        env["milvus_server"] = utility.get_server_version()
+    return env
+
+
+# ==============================================
+# 測量
+# ==============================================
+
+def bench_schema(dim):
+    return CollectionSchema(fields=[
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+    ], description="基準測試")
+
+
+def create_collection(client, name, dim):
+    """建立測試集合 (client 為 LocalMilvus 時使用本地引擎，否則使用 Milvus)"""
+    if client is not None:
+        return client.collection(name, bench_schema(dim))
+
+    from pymilvus import Collection, utility
+
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    return Collection(name=name, schema=bench_schema(dim), using='default', shards_num=1)
+
+
+def timed_searches(collection, queries, search_params, limit, expr=None):
+    """逐筆搜尋，回傳 (每筆延遲 ms, 結果 id)"""
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = collection.search(data=[query.tolist()], anns_field="embedding", param=search_params,
+                                 limit=limit, expr=expr)[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([hit.id for hit in hits])
+    return latencies, results
+
+
+def search_stats(rounds):
+    """每輪的 p50 / p99 / QPS 取中位數；spread 記錄各指標在各輪間的最小 / 最大值 (執行間的雜訊)"""
+    per_round = {
+        "p50_ms": [np.percentile(latencies, 50) for latencies in rounds],
+        "p99_ms": [np.percentile(latencies, 99) for latencies in rounds],
+        "qps": [len(latencies) / (sum(latencies) / 1000) for latencies in rounds],
+    }
+    stats = {metric: float(np.median(values)) for metric, values in per_round.items()}
+    stats["spread"] = {metric: {"min": float(min(values)), "max": float(max(values))}
+                       for metric, values in per_round.items()}
+    return stats
+
+
+def bench_collection(client, name, args, rng):
+    """測量單一集合，回傳 {設定..., "operations": {...}}"""
+    spec = COLLECTION_SPECS[name]
+    metric = metric_type(name)
+    index = {"metric_type": metric, **BENCH_INDEXES[name]}
+    if args.nlist:
+        index["params"] = {"nlist": args.nlist}
+    search_params = collection_search_params(name, nprobe=args.nprobe) if args.nprobe else collection_search_params(name)
+
+    vectors, categories = generate_vectors(args.rows, spec, rng)
+    vectors = prepare_vectors(name, vectors)
+    queries = prepare_vectors(name, generate_vectors(args.queries, spec, rng)[0])
+    truth, _ = brute_force_search(queries, vectors, args.limit, metric)
+
+    collection = create_collection(client, f"{BENCH_COLLECTION_PREFIX}{name}", spec["dim"])
+    try:
+        started = time.perf_counter()
+        for start in range(0, args.rows, INGEST_BATCH_SIZE):
+            stop = min(start + INGEST_BATCH_SIZE, args.rows)
+            insert_batch(collection, ColumnBatch(collection.schema.fields, [
+                np.arange(start, stop), vectors[start:stop], categories[start:stop],
+            ]))
+        collection.flush()
+        ingest_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        collection.create_index("embedding", index)
+        collection.load()
+        if client is None:
+            from pymilvus import utility
+
+            utility.wait_for_index_building_complete(collection.name)
+        index_s = time.perf_counter() - started
+
+        timed_searches(collection, queries[:min(20, len(queries))], search_params, args.limit)  # 暖機
+        rounds, filtered_rounds, results = [], [], None
+        for _ in range(args.repeat):
+            latencies, results = timed_searches(collection, queries, search_params, args.limit)
+            rounds.append(latencies)
+            filtered_rounds.append(timed_searches(collection, queries, search_params, args.limit,
+                                                  expr="category_id == 1")[0])
+        found = np.array([ids + [-1] * (args.limit - len(ids)) for ids in results])
+    finally:
+        collection.release()
+        if client is None:
+            from pymilvus import utility
+
+            utility.drop_collection(collection.name)
+
+    return {
+        "rows": args.rows,
+        "dim": spec["dim"],
+        "metric_type": metric,
+        "index": index,
+        "search_params": search_params,
+        "limit": args.limit,
+        "queries": args.queries,
+        "operations": {
+            "ingest": {"rows_per_s": args.rows / ingest_s},
+            "index_build": {"seconds": index_s},
+            "search": search_stats(rounds),
+            "filtered_search": search_stats(filtered_rounds),
+            "recall": {"recall_at_k": recall(found, truth)},
+        },
+    }
+
+
+def run_suite(client, args, engine):
+    rng = np.random.default_rng(args.seed)
+    result = {
+        "format_version": RESULT_FORMAT_VERSION,
+        "label": args.label,
+        "created_at": int(time.time()),
+        "environment": environment(engine),
+        "settings": {"rows": args.rows, "queries": args.queries, "limit": args.limit, "repeat": args.repeat,
+                     "seed": args.seed},
+        "collections": {},
+    }
+    for name in args.collections:
+        print(f"⏱️ 測量 {name} ({args.rows} 筆)...")
+        result["collections"][name] = bench_collection(client, name, args, rng)
+    return result
+
+
+# ==============================================
+# 結果檔
+# ==============================================
+
+def save_result(result, output_dir):
+    """寫入 <label>-<時間>.json，回傳路徑"""
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(result["created_at"]))
+    path = os.path.join(output_dir, f"{result['label']}-{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def load_result(path):
+    with open(path, encoding="utf-8") as f:
+        result = json.load(f)
+    if result.get("format_version") != RESULT_FORMAT_VERSION:
+        raise ValueError(f"{path}: 不支援的結果版本 {result.get('format_version')}")
+    return result
+
+
+# ==============================================
+# 比較
+# ==============================================
+
+def relative_spread(operation, metric):
+    """各輪最大與最小值的差相對於中位數的比例；只測一輪或舊版結果檔沒有 spread 時為 0"""
+    spread = operation.get("spread", {}).get(metric)
+    if not spread or not operation[metric]:
+        return 0.0
+    return (spread["max"] - spread["min"]) / abs(operation[metric])
+
+
+def classify(metric, direction, baseline, current, tolerance, recall_tolerance, noise=0.0):
+    """回傳 (變化, 狀態)；變化為相對比例 (recall 為絕對差)
+
+    noise 為兩次執行觀察到的相對離散程度，變化需同時超過容許範圍與 noise 才視為回歸 / 改善
+    """
+    if metric in ABSOLUTE_TOLERANCE_METRICS:
+        change, band = current - baseline, recall_tolerance
+    else:
+        change, band = (current - baseline) / baseline if baseline else 0.0, max(tolerance, noise)
+    better = change < 0 if direction == LOWER_IS_BETTER else change > 0
+    if abs(change) <= band:
+        return change, "ok"
+    return change, "improvement" if better else "regression"
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE, recall_tolerance=DEFAULT_RECALL_TOLERANCE):
+    """回傳 (比較列, 不可比較的差異說明)"""
+    rows, warnings = [], []
+    for key in ("engine", "cpu_count", "machine", "milvus_server"):
+        if current["environment"].get(key) != baseline["environment"].get(key):
+            warnings.append(f"環境 {key}: {baseline['environment'].get(key)} → {current['environment'].get(key)}")
+
+    for name, collection in current["collections"].items():
+        base = baseline["collections"].get(name)
+        if base is None:
+            warnings.append(f"{name}: 基準檔沒有此集合")
+            continue
+        for key in COMPARABLE_KEYS:
+            if collection.get(key) != base.get(key):
+                warnings.append(f"{name} {key}: {base.get(key)} → {collection.get(key)}")
+        for operation, metrics in METRICS.items():
+            for metric, direction in metrics:
+                try:
+                    old_operation = base["operations"][operation]
+                    new_operation = collection["operations"][operation]
+                    old, new = old_operation[metric], new_operation[metric]
+                except KeyError:
+                    continue
+                noise = max(relative_spread(old_operation, metric), relative_spread(new_operation, metric))
+                change, status = classify(metric, direction, old, new, tolerance, recall_tolerance, noise)
+                rows.append({"collection": name, "operation": operation, "metric": metric,
+                             "baseline": old, "current": new, "change": change, "noise": noise,
+                             "status": status})
+    return rows, warnings
+
+
+STATUS_LABELS = {"ok": "  持平", "improvement": "✅ 改善", "regression": "❌ 回歸"}
+
+
+def print_comparison(rows, warnings, current, baseline):
+    print(f"\n📊 {current['label']} ({current['environment'].get('git_commit')}) vs "
+          f"基準 {baseline['label']} ({baseline['environment'].get('git_commit')})")
+    for warning in warnings:
+        print(f"⚠️ 設定不同，比較僅供參考: {warning}")
+    print(f"\n{'集合':<16}{'操作':<17}{'指標':<13}{'基準':>12}{'本次':>12}{'變化':>10}{'雜訊':>9}  狀態")
+    for row in rows:
+        change = (f"{row['change']:+.3f}" if row["metric"] in ABSOLUTE_TOLERANCE_METRICS
+                  else f"{row['change']:+.1%}")
+        noise = f"±{row['noise']:.1%}" if row["noise"] else "-"
+        print(f"{row['collection']:<16}{row['operation']:<17}{row['metric']:<13}{row['baseline']:>12.3f}"
+              f"{row['current']:>12.3f}{change:>10}{noise:>9}  {STATUS_LABELS[row['status']]}")
+    regressions = sum(row["status"] == "regression" for row in rows)
+    improvements = sum(row["status"] == "improvement" for row in rows)
+    print(f"\n回歸 {regressions} 項, 改善 {improvements} 項, 持平 {len(rows) - regressions - improvements} 項")
+    return regressions
+
+
+def print_result(result):
+    print(f"\n{'集合':<16}{'操作':<17}{'指標':<13}{'數值':>12}")
+    for name, collection in result["collections"].items():
+        for operation, metrics in METRICS.items():
+            for metric, _ in metrics:
+                print(f"{name:<16}{operation:<17}{metric:<13}{collection['operations'][operation][metric]:>12.3f}")
+
+
+def list_results(output_dir):
+    if not os.path.isdir(output_dir):
+        print(f"📭 {output_dir} 沒有結果檔")
+        return
+    for filename in sorted(os.listdir(output_dir)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            result = load_result(os.path.join(output_dir, filename))
+        except (ValueError, json.JSONDecodeError) as e:
+            print(f"  ⚠️ {filename}: {e}")
+            continue
+        env = result["environment"]
+        print(f"  - {filename}: {result['label']}, {env['engine']}, commit {env.get('git_commit')}, "
+              f"{env['cpu_count']} CPU, {', '.join(result['collections'])}")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="基準測試紀錄與回歸比較")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="執行基準測試並寫入結果檔")
+    run.add_argument("--label", default="run")
+    run.add_argument("--collections", nargs="*", default=list(BENCH_INDEXES), choices=BENCH_INDEXES)
+    run.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    run.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    run.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="搜尋測量輪數 (取中位數)")
+    run.add_argument("--nlist", type=int, default=None, help="覆寫索引 nlist")
+    run.add_argument("--nprobe", type=int, default=None, help="覆寫搜尋 nprobe")
+    run.add_argument("--milvus", action="store_true", help="使用 Milvus 而非本地引擎")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    run.add_argument("--baseline", default=None, help="與此結果檔比較")
+
+    compare = subparsers.add_parser("compare", help="比較兩個結果檔")
+    compare.add_argument("current")
+    compare.add_argument("baseline")
+
+    for subparser in (run, compare):
+        subparser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="時間 / 吞吐量相對容許變化")
+        subparser.add_argument("--recall-tolerance", type=float, default=DEFAULT_RECALL_TOLERANCE)
+
+    listing = subparsers.add_parser("list", help="列出結果檔")
+    listing.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_results(args.output_dir)
+        return
+
+    if args.command == "compare":
+        current, baseline = load_result(args.current), load_result(args.baseline)
+    else:
+        baseline = load_result(args.baseline) if args.baseline else None
+        if args.milvus:
+            from pymilvus import connections
+            from milvus_common import connect_to_milvus
+
+            if not connect_to_milvus():
+                sys.exit(1)
+            try:
+                current = run_suite(None, args, "milvus")
+            except Exception as e:
+                print(f"❌ 測量失敗: {e}")
+                sys.exit(1)
+            finally:
+                connections.disconnect("default")
+                print("🔌 Milvus 連線已關閉")
+        else:
+            with tempfile.TemporaryDirectory() as data_dir:
+                client = LocalMilvus(data_dir)
+                current = run_suite(client, args, "local")
+                client.close()
+        path = save_result(current, args.output_dir)
+        print(f"💾 結果已寫入 {path}")
+        if baseline is None:
+            print_result(current)
+            return
+
+    rows, warnings = compare_results(current, baseline, args.tolerance, args.recall_tolerance)
+    regressions = print_comparison(rows, warnings, current, baseline)
+    sys.exit(2 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+"""
+檔案式大量匯入 (bulk insert)
+初次載入數千萬筆向量時，逐批由客戶端 insert 需經過 proxy 編碼與 WAL；
+此模式將產生的資料或快照匯出資料寫成 Milvus bulk insert 檔案
+(NumPy: 每個欄位一個 <欄位>.npy；Parquet: 每個分段一個檔案)，上傳到 Milvus 使用的 MinIO bucket，
+每個分段提交一個 bulk_insert 工作並輪詢至完成，最後與客戶端 insert 路徑比較每秒筆數
+
+目標集合需先存在 (milvus-init.py 建立 schema 與索引)；docker-compose 的 milvus-minio 對外埠為 9020
+bulk_insert 不去除重複主鍵: 產生的資料由既有最大主鍵之後編號，快照資料只匯入空集合
+啟用動態欄位的集合 (電商集合皆是) 另寫入 $meta 欄位 (每列 JSON 字串)，快照的動態欄位資料不會遺失
+
+用法:
+    python3 milvus_bulk_import.py load --collections product_vectors user_vectors --rows 5000000
+    python3 milvus_bulk_import.py load --collections product_vectors --snapshot ./snapshots/20240101 --format parquet
+    python3 milvus_bulk_import.py bench                 # 本地引擎: 以暫存目錄代替 MinIO，驗證檔案格式與流程
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+from milvus_columnar import DYNAMIC_FIELD, ColumnBatch, insert_batch
+from milvus_metric_bench import COLLECTION_SPECS, generate_vectors
+
+# MinIO 設定 (docker-compose 的 milvus-minio，Milvus 預設 bucket)
+MINIO_ENDPOINT = "localhost:9020"
+MINIO_ACCESS_KEY = "minioadmin"
+MINIO_SECRET_KEY = "minioadmin"
+MINIO_BUCKET = "a-bucket"
+OBJECT_PREFIX = "bulk_import"
+
+# 匯入設定
+FILE_FORMATS = ("numpy", "parquet")
+DEFAULT_ROWS = 1_000_000
+ROWS_PER_FILE = 1_000_000  # 每個 bulk_insert 工作的筆數
+SOURCE_BATCH_SIZE = 50_000
+POLL_INTERVAL_SECONDS = 2
+IMPORT_TIMEOUT_SECONDS = 6 * 3600
+COMPARE_INSERT_ROWS = 100_000  # 客戶端 insert 路徑的取樣筆數
+INSERT_BATCH_SIZE = 10_000
+
+# 測量設定
+BENCH_ROWS = 200_000
+BENCH_ROWS_PER_FILE = 50_000
+
+SUPPORTED_SCALARS = {
+    DataType.BOOL: np.bool_,
+    DataType.INT8: np.int8,
+    DataType.INT16: np.int16,
+    DataType.INT32: np.int32,
+    DataType.INT64: np.int64,
+    DataType.FLOAT: np.float32,
+    DataType.DOUBLE: np.float64,
+}
+
+
+def import_fields(schema):
+    """需要寫入檔案的欄位 (略過自動主鍵)；不支援的型別直接拒絕"""
+    fields = [f for f in schema.fields if not (f.is_primary and f.auto_id)]
+    for field in fields:
+        if field.dtype not in SUPPORTED_SCALARS and field.dtype not in (DataType.FLOAT_VECTOR, DataType.VARCHAR):
+            raise ValueError(f"欄位 {field.name} 的型別 {field.dtype.name} 不支援檔案匯入")
+    return fields
+
+
+# ==============================================
+# 資料來源
+# ==============================================
+
+def generated_batches(collection_name, schema, n_rows, batch_size=SOURCE_BATCH_SIZE, seed=0, pk_start=1):
+    """依 schema 產生資料: 向量與初始化腳本相同 (隨機值 + 類別區段偏移)，純量為小範圍整數 / 代號字串
+
+    主鍵由 pk_start 開始連續編號 (bulk_insert 不去除重複主鍵，寫入非空集合時需由既有最大主鍵之後開始)
+    """
+    rng = np.random.default_rng(seed)
+    spec = COLLECTION_SPECS.get(collection_name)
+    fields = import_fields(schema)
+    for start in range(0, n_rows, batch_size):
+        size = min(batch_size, n_rows - start)
+        columns = {}
+        for field in fields:
+            if field.is_primary:
+                columns[field.name] = np.arange(pk_start + start, pk_start + start + size, dtype=np.int64)
+            elif field.dtype == DataType.FLOAT_VECTOR:
+                dim = field.params["dim"]
+                if spec is not None and spec["dim"] == dim:
+                    columns[field.name] = generate_vectors(size, spec, rng)[0]
+                else:
+                    columns[field.name] = rng.random((size, dim), dtype=np.float32)
+            elif field.dtype == DataType.VARCHAR:
+                columns[field.name] = [f"{field.name}_{i}" for i in rng.integers(0, 100, size)]
+            elif field.dtype in (DataType.FLOAT, DataType.DOUBLE):
+                columns[field.name] = rng.random(size)
+            elif field.dtype == DataType.BOOL:
+                columns[field.name] = rng.random(size) < 0.5
+            else:
+                columns[field.name] = rng.integers(1, 11, size)
+        yield ColumnBatch(fields, columns)
+
+
+def snapshot_batches(snapshot_dir, collection_name, batch_size=SOURCE_BATCH_SIZE, merchant_map=None):
+    """milvus_snapshot.py 匯出的資料；merchant_map 為 {product_id: merchant_id} 時補上 merchant_id (舊快照遷移)"""
+    from milvus_backfill import SnapshotSource
+
+    source = SnapshotSource(snapshot_dir, collection_name)
+    if merchant_map is not None:
+        from milvus_merchant_search import MerchantMapSource
+
+        source = MerchantMapSource(source, merchant_map)
+    for batch, _ in source.batches(None, batch_size):
+        yield batch
+
+
+# ==============================================
+# 檔案寫入
+# ==============================================
+
+class BulkFileWriter:
+    """將批次依 rows_per_file 切成分段寫入 stage_dir/<集合>/；close() 回傳每個分段的檔案清單 (相對路徑)
+
+    numpy: <集合>/part-00000/<欄位>.npy (數值與向量以記憶體映射串流寫入，VARCHAR 於分段結束時寫出)
+    parquet: <集合>/part-00000.parquet (向量欄位為 list<float>)
+    schema 啟用動態欄位時每列的動態欄位資料以 JSON 字串寫入 $meta.npy / Parquet 的 $meta 欄 (沒有時為 "{}")
+    """
+
+    def __init__(self, stage_dir, collection_name, schema, total_rows, rows_per_file=ROWS_PER_FILE, fmt="numpy"):
+        if fmt not in FILE_FORMATS:
+            raise ValueError(f"不支援的檔案格式: {fmt}")
+        self.stage_dir = stage_dir
+        self.collection_name = collection_name
+        self.fields = import_fields(schema)
+        self.dynamic_field = schema.enable_dynamic_field
+        self.total_rows = total_rows
+        self.rows_per_file = rows_per_file
+        self.format = fmt
+        self.groups = []
+        self.rows_written = 0
+        self._part = None
+
+    def _open_part(self):
+        index = len(self.groups)
+        size = min(self.rows_per_file, self.total_rows - self.rows_written)
+        name = f"part-{index:05d}"
+        part = {"size": size, "offset": 0}
+        if self.format == "numpy":
+            directory = os.path.join(self.collection_name, name)
+            os.makedirs(os.path.join(self.stage_dir, directory), exist_ok=True)
+            part["files"] = [os.path.join(directory, f"{f.name}.npy") for f in self.fields]
+            part["arrays"], part["strings"] = {}, {}
+            if self.dynamic_field:
+                part["files"].append(os.path.join(directory, f"{DYNAMIC_FIELD}.npy"))
+                part["strings"][DYNAMIC_FIELD] = []
+            for field, path in zip(self.fields, part["files"]):
+                full_path = os.path.join(self.stage_dir, path)
+                if field.dtype == DataType.FLOAT_VECTOR:
+                    part["arrays"][field.name] = open_memmap(full_path, mode="w+", dtype=np.float32,
+                                                             shape=(size, field.params["dim"]))
+                elif field.dtype == DataType.VARCHAR:
+                    part["strings"][field.name] = []
+                else:
+                    part["arrays"][field.name] = open_memmap(full_path, mode="w+",
+                                                             dtype=SUPPORTED_SCALARS[field.dtype], shape=(size,))
+        else:
+            import pyarrow.parquet as pq
+
+            os.makedirs(os.path.join(self.stage_dir, self.collection_name), exist_ok=True)
+            path = os.path.join(self.collection_name, f"{name}.parquet")
+            part["files"] = [path]
+            part["writer"] = pq.ParquetWriter(os.path.join(self.stage_dir, path), self._arrow_schema())
+        self._part = part
+
+    def _arrow_schema(self):
+        import pyarrow as pa
+
+        types = {DataType.VARCHAR: pa.string(), DataType.FLOAT_VECTOR: pa.list_(pa.float32())}
+        types.update({dtype: pa.from_numpy_dtype(np_type) for dtype, np_type in SUPPORTED_SCALARS.items()})
+        columns = [(f.name, types[f.dtype]) for f in self.fields]
+        if self.dynamic_field:
+            columns.append((DYNAMIC_FIELD, pa.string()))
+        return pa.schema(columns)
+
+    def _dynamic_column(self, batch):
+        """每列動態欄位資料的 JSON 字串"""
+        if batch.dynamic is None:
+            return ["{}"] * len(batch)
+        return [json.dumps(extra, ensure_ascii=False) for extra in batch.dynamic]
+
+    def _write_part(self, batch):
+        part = self._part
+        offset, size = part["offset"], len(batch)
+        if self.format == "numpy":
+            for field in self.fields:
+                column = batch.columns[field.name]
+                if field.dtype == DataType.VARCHAR:
+                    part["strings"][field.name].extend(column)
+                else:
+                    part["arrays"][field.name][offset:offset + size] = column
+            if self.dynamic_field:
+                part["strings"][DYNAMIC_FIELD].extend(self._dynamic_column(batch))
+        else:
+            import pyarrow as pa
+
+            arrays = []
+            for field in self.fields:
+                column = batch.columns[field.name]
+                if field.dtype == DataType.FLOAT_VECTOR:
+                    dim = field.params["dim"]
+                    offsets = pa.array(np.arange(0, (size + 1) * dim, dim, dtype=np.int32))
+                    arrays.append(pa.ListArray.from_arrays(offsets, pa.array(np.ascontiguousarray(column).ravel())))
+                else:
+                    arrays.append(pa.array(column))
+            if self.dynamic_field:
+                arrays.append(pa.array(self._dynamic_column(batch), type=pa.string()))
+            part["writer"].write_table(pa.Table.from_arrays(arrays, schema=self._arrow_schema()))
+        part["offset"] += size
+        self.rows_written += size
+
+    def _close_part(self):
+        part = self._part
+        if self.format == "numpy":
+            for array in part["arrays"].values():
+                array.flush()
+            for path in part["files"]:
+                name = os.path.splitext(os.path.basename(path))[0]
+                if name in part["strings"]:
+                    np.save(os.path.join(self.stage_dir, path), np.array(part["strings"][name], dtype=str))
+        else:
+            part["writer"].close()
+        self.groups.append(part["files"])
+        self._part = None
+
+    def write(self, batch):
+        """寫入批次 (跨分段時切開)"""
+        batch = batch.prepared(self.collection_name)
+        start = 0
+        while start < len(batch):
+            if self._part is None:
+                if self.rows_written >= self.total_rows:
+                    raise ValueError(f"資料超過預期筆數 {self.total_rows}")
+                self._open_part()
+            take = min(len(batch) - start, self._part["size"] - self._part["offset"])
+            self._write_part(batch.slice(start, start + take))
+            start += take
+            if self._part["offset"] == self._part["size"]:
+                self._close_part()
+
+    def close(self):
+        if self._part is not None:
+            raise ValueError(f"資料少於預期筆數: {self.rows_written} / {self.total_rows}")
+        return self.groups
+
+
+def stage_files(batches, stage_dir, collection_name, schema, total_rows, rows_per_file, fmt):
+    """寫入匯入檔案，回傳 (分段檔案清單, 耗時, 位元組數)"""
+    started = time.perf_counter()
+    writer = BulkFileWriter(stage_dir, collection_name, schema, total_rows, rows_per_file, fmt)
+    for batch in batches:
+        writer.write(batch)
+    groups = writer.close()
+    size = sum(os.path.getsize(os.path.join(stage_dir, path)) for group in groups for path in group)
+    return groups, time.perf_counter() - started, size
+
+
+# ==============================================
+# 上傳與匯入
+# ==============================================
+
+class MinioStorage:
+    """上傳到 Milvus 使用的 MinIO bucket；bulk_insert 的檔案路徑為 bucket 內的物件名稱"""
+
+    def __init__(self, endpoint=MINIO_ENDPOINT, access_key=MINIO_ACCESS_KEY, secret_key=MINIO_SECRET_KEY,
+                 bucket=MINIO_BUCKET, secure=False):
+        try:
+            from minio import Minio
+        except ImportError:
+            print("❌ 請安裝 minio: pip3 install minio")
+            sys.exit(1)
+        self.client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
+        self.bucket = bucket
+        if not self.client.bucket_exists(bucket):
+            raise ValueError(f"bucket {bucket} 不存在 (需與 Milvus 設定的 minio.bucketName 相同)")
+
+    def upload(self, stage_dir, groups, prefix=OBJECT_PREFIX):
+        """上傳所有分段，回傳以物件名稱表示的分段清單"""
+        uploaded = []
+        for group in groups:
+            keys = []
+            for path in group:
+                key = "/".join([prefix, *path.split(os.sep)])
+                self.client.fput_object(self.bucket, key, os.path.join(stage_dir, path))
+                keys.append(key)
+            uploaded.append(keys)
+        return uploaded
+
+    def remove(self, groups):
+        for group in groups:
+            for key in group:
+                self.client.remove_object(self.bucket, key)
+
+
+def submit_imports(collection_name, groups):
+    """每個分段提交一個 bulk_insert 工作，回傳工作 ID"""
+    from pymilvus import utility
+
+    return [utility.do_bulk_insert(collection_name=collection_name, files=group) for group in groups]
+
+
+def wait_for_imports(task_ids, poll_interval=POLL_INTERVAL_SECONDS, timeout=IMPORT_TIMEOUT_SECONDS):
+    """輪詢至所有工作完成 (資料已持久化且索引建立完成)，回傳匯入筆數；任一工作失敗即拋出"""
+    from pymilvus import BulkInsertState, utility
+
+    started = time.time()
+    pending, rows = set(task_ids), 0
+    while pending:
+        for task_id in sorted(pending):
+            state = utility.get_bulk_insert_state(task_id=task_id)
+            if state.state in (BulkInsertState.ImportFailed, BulkInsertState.ImportFailedAndCleaned):
+                raise RuntimeError(f"bulk_insert 工作 {task_id} 失敗: {state.failed_reason} ({state.files})")
+            if state.state == BulkInsertState.ImportCompleted:
+                pending.discard(task_id)
+                rows += state.row_count
+        if pending:
+            if time.time() - started > timeout:
+                raise TimeoutError(f"bulk_insert 逾時 ({timeout}s)，未完成工作: {sorted(pending)}")
+            print(f"  ⏳ {len(task_ids) - len(pending)}/{len(task_ids)} 個工作完成")
+            time.sleep(poll_interval)
+    return rows
+
+
+def local_import(collection, stage_dir, groups, fmt):
+    """本地引擎的匯入: 依 Milvus 的檔案格式讀回分段並寫入 (用於驗證檔案內容與流程)"""
+    fields = import_fields(collection.schema)
+    rows = 0
+    for group in groups:
+        if fmt == "numpy":
+            columns = {f.name: np.load(os.path.join(stage_dir, path), mmap_mode="r")
+                       for f, path in zip(fields, group)}
+            dynamic = None
+            if len(group) > len(fields):  # $meta.npy
+                dynamic = [json.loads(value) for value in np.load(os.path.join(stage_dir, group[-1])).tolist()]
+            batch = ColumnBatch(fields, {name: column.tolist() if column.dtype.kind == "U" else column
+                                         for name, column in columns.items()}, dynamic)
+        else:
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(os.path.join(stage_dir, group[0]))
+            vectors = {f.name: np.array(table.column(f.name).combine_chunks().flatten(), dtype=np.float32)
+                       .reshape(len(table), f.params["dim"]) for f in fields if f.dtype == DataType.FLOAT_VECTOR}
+            batch = ColumnBatch.from_arrow(fields, table, vectors)
+        collection.insert(batch.rows() if batch.dynamic is not None else batch.column_list())
+        rows += len(batch)
+    collection.flush()
+    return rows
+
+
+def measure_insert(collection, batches, n_rows):
+    """客戶端 insert 路徑 (欄位式批次) 寫入前 n_rows 筆，回傳每秒筆數"""
+    written, started = 0, time.perf_counter()
+    for batch in batches:
+        batch = batch.slice(0, min(len(batch), n_rows - written))
+        for start in range(0, len(batch), INSERT_BATCH_SIZE):
+            insert_batch(collection, batch.slice(start, start + INSERT_BATCH_SIZE))
+        written += len(batch)
+        if written >= n_rows:
+            break
+    collection.flush()
+    return written / (time.perf_counter() - started)
+
+
+def print_report(name, rows, stage_s, size, upload_s, import_s, insert_rows_per_s):
+    total_s = stage_s + upload_s + import_s
+    print(f"\n📊 {name}: {rows:,} 筆, 檔案 {size / 1024 ** 2:.1f} MB")
+    print(f"  寫檔 {stage_s:.1f}s, 上傳 {upload_s:.1f}s, 匯入 {import_s:.1f}s")
+    print(f"  bulk insert: {rows / max(upload_s + import_s, 1e-9):,.0f} 筆/秒 (上傳 + 匯入), "
+          f"{rows / max(total_s, 1e-9):,.0f} 筆/秒 (含寫檔)")
+    if insert_rows_per_s:
+        print(f"  客戶端 insert: {insert_rows_per_s:,.0f} 筆/秒 → bulk insert 為 "
+              f"{rows / max(total_s, 1e-9) / insert_rows_per_s:.1f}× (含寫檔)")
+
+
+# ==============================================
+# 執行
+# ==============================================
+
+def first_free_pk(collection, reject_existing=False):
+    """產生資料的起始主鍵: 既有最大主鍵 + 1 (auto_id 或空集合為 1)
+
+    bulk_insert 不去除重複主鍵；reject_existing 時 (快照資料的主鍵固定) 集合已有資料即拒絕匯入
+    """
+    from milvus_verify import find_pk_bounds
+
+    pk_field = next(f for f in collection.schema.fields if f.is_primary)
+    if pk_field.auto_id or pk_field.dtype != DataType.INT64:
+        return 1
+    collection.load()
+    bounds = find_pk_bounds(collection, pk_field.name)
+    if bounds is None:
+        return 1
+    if reject_existing:
+        raise ValueError(f"集合 {collection.name} 已有資料 (主鍵 {bounds[0]} ~ {bounds[1]})，"
+                         f"bulk_insert 不會去除重複主鍵，快照請匯入空集合")
+    print(f"ℹ️ {collection.name} 已有主鍵 {bounds[0]} ~ {bounds[1]}，產生的資料由 {bounds[1] + 1} 開始編號")
+    return bounds[1] + 1
+
+
+def load_collection(name, args, storage):
+    """寫檔、上傳、提交並等待單一集合的匯入，與客戶端 insert 取樣比較"""
+    from pymilvus import Collection, utility
+
+    if not utility.has_collection(name):
+        raise ValueError(f"集合 {name} 不存在，請先執行 milvus-init.py 建立 schema 與索引")
+    collection = Collection(name)
+    schema = collection.schema
+    pk_start = first_free_pk(collection, reject_existing=bool(args.snapshot))
+    if args.snapshot:
+        from milvus_backfill import SnapshotSource
+
+        total_rows = SnapshotSource(args.snapshot, name).entry["row_count"]
+    else:
+        total_rows = args.rows
+
+    merchant_map = None
+    if args.merchant_map:
+        from milvus_merchant_search import load_merchant_map
+
+        merchant_map = load_merchant_map(args.merchant_map)
+
+    def make_batches():
+        if args.snapshot:
+            return snapshot_batches(args.snapshot, name, merchant_map=merchant_map)
+        return generated_batches(name, schema, total_rows, seed=args.seed, pk_start=pk_start)
+
+    print(f"📝 {name}: 寫入 {args.format} 匯入檔案 ({total_rows:,} 筆)...")
+    groups, stage_s, size = stage_files(make_batches(), args.stage_dir, name, schema, total_rows,
+                                        args.rows_per_file, args.format)
+    print(f"⬆️ 上傳 {sum(len(g) for g in groups)} 個檔案到 {storage.bucket}...")
+    started = time.perf_counter()
+    keys = storage.upload(args.stage_dir, groups)
+    upload_s = time.perf_counter() - started
+
+    print(f"🚚 提交 {len(keys)} 個 bulk_insert 工作...")
+    started = time.perf_counter()
+    rows = wait_for_imports(submit_imports(name, keys))
+    import_s = time.perf_counter() - started
+    if not args.keep_files:
+        storage.remove(keys)
+
+    insert_rows_per_s = None
+    if args.compare_insert_rows:
+        compare_name = f"{name}_insert_compare"
+        if utility.has_collection(compare_name):
+            utility.drop_collection(compare_name)
+        compare = Collection(compare_name, CollectionSchema(fields=schema.fields, description=schema.description))
+        try:
+            insert_rows_per_s = measure_insert(compare, make_batches(), min(args.compare_insert_rows, total_rows))
+        finally:
+            utility.drop_collection(compare_name)
+    print_report(name, rows, stage_s, size, upload_s, import_s, insert_rows_per_s)
+
+
+def bench_schema(name):
+    spec = COLLECTION_SPECS[name]
+    pk = "product_id" if name == "product_vectors" else "user_id"
+    return CollectionSchema(fields=[
+        FieldSchema(name=pk, dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=spec["dim"]),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+        FieldSchema(name="brand", dtype=DataType.VARCHAR, max_length=100),
+    ], description="bulk insert 測量")
+
+
+def run_bench(args):
+    """本地引擎: 暫存目錄代替 MinIO，比較檔案匯入與客戶端 insert，並檢查匯入內容與來源一致"""
+    from milvus_local_engine import LocalMilvus
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = LocalMilvus(os.path.join(data_dir, "engine"))
+        for name in args.collections:
+            schema = bench_schema(name)
+            for fmt in FILE_FORMATS:
+                stage_dir = os.path.join(data_dir, f"stage_{fmt}")
+                groups, stage_s, size = stage_files(generated_batches(name, schema, args.rows, seed=args.seed),
+                                                    stage_dir, name, schema, args.rows, args.rows_per_file, fmt)
+                collection = client.collection(f"{name}_{fmt}", schema)
+                started = time.perf_counter()
+                rows = local_import(collection, stage_dir, groups, fmt)
+                import_s = time.perf_counter() - started
+
+                expected = next(generated_batches(name, schema, args.rows, seed=args.seed)).prepared(name)
+                pk = schema.fields[0].name
+                sample = collection.query(expr=f"{pk} <= 3", output_fields=[f.name for f in schema.fields])
+                matches = all(np.allclose(row["embedding"], expected.columns["embedding"][row[pk] - 1], atol=1e-6)
+                              and row["brand"] == expected.columns["brand"][row[pk] - 1] for row in sample)
+                insert_collection = client.collection(f"{name}_{fmt}_insert", schema)
+                insert_rows_per_s = measure_insert(insert_collection,
+                                                   generated_batches(name, schema, args.rows, seed=args.seed),
+                                                   args.rows)
+                print_report(f"{name} ({fmt}, 本地引擎)", rows, stage_s, size, 0.0, import_s, insert_rows_per_s)
+                print(f"  檔案內容與來源一致: {matches}, {len(groups)} 個分段")
+                shutil.rmtree(stage_dir)
+        client.close()
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="檔案式大量匯入 (bulk insert)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser("load", help="寫檔、上傳到 MinIO 並提交 bulk_insert")
+    load.add_argument("--collections", nargs="*", default=["product_vectors", "user_vectors"])
+    load.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="產生的筆數 (未指定 --snapshot 時)")
+    load.add_argument("--snapshot", default=None, help="改用 milvus_snapshot.py 匯出目錄的資料")
+    load.add_argument("--merchant-map", default=None,
+                      help="[{product_id, merchant_id}, ...] JSON，為沒有 merchant_id 的舊快照補上商家")
+    load.add_argument("--format", choices=FILE_FORMATS, default="numpy")
+    load.add_argument("--rows-per-file", type=int, default=ROWS_PER_FILE)
+    load.add_argument("--stage-dir", default=None, help="匯入檔案暫存目錄 (預設為暫時目錄)")
+    load.add_argument("--minio-endpoint", default=MINIO_ENDPOINT)
+    load.add_argument("--minio-access-key", default=MINIO_ACCESS_KEY)
+    load.add_argument("--minio-secret-key", default=MINIO_SECRET_KEY)
+    load.add_argument("--bucket", default=MINIO_BUCKET)
+    load.add_argument("--keep-files", action="store_true", help="匯入後保留 bucket 中的檔案")
+    load.add_argument("--compare-insert-rows", type=int, default=COMPARE_INSERT_ROWS,
+                      help="客戶端 insert 取樣筆數 (0 表示不比較)")
+    load.add_argument("--seed", type=int, default=0)
+
+    bench = subparsers.add_parser("bench", help="本地引擎測量")
+    bench.add_argument("--collections", nargs="*", default=["product_vectors", "user_vectors"],
+                       choices=COLLECTION_SPECS)
+    bench.add_argument("--rows", type=int, default=BENCH_ROWS)
+    bench.add_argument("--rows-per-file", type=int, default=BENCH_ROWS_PER_FILE)
+    bench.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_bench(args)
+        return
+
+    from pymilvus import connections
+    from milvus_common import connect_to_milvus
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    temporary_stage = args.stage_dir is None
+    args.stage_dir = args.stage_dir or tempfile.mkdtemp(prefix="milvus_bulk_")
+    try:
+        storage = MinioStorage(args.minio_endpoint, args.minio_access_key, args.minio_secret_key, args.bucket)
+        for name in args.collections:
+            load_collection(name, args, storage)
+    except Exception as e:
+        print(f"❌ 匯入失敗: {e}")
+        sys.exit(1)
+    finally:
+        if temporary_stage:
+            shutil.rmtree(args.stage_dir, ignore_errors=True)
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
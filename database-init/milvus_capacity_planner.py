@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+集合容量規劃
+依宣告的 schema (維度、純量欄位、VARCHAR max_length)、索引類型與參數、預估筆數與目標 QPS，
+估算載入記憶體、物件儲存磁碟用量，並建議分片數、副本數與查詢節點數；
+validate 以實際載入的 segment 記憶體校正估算值
+
+規格檔 (JSON) 的 schema 與 indexes 格式與 milvus_snapshot.py 的 manifest 相同:
+    {"query_node_memory_bytes": 4294967296,
+     "collections": [{"name": "product_vectors", "schema": {...}, "indexes": [...],
+                      "rows": 10000000, "qps": 500, "insert_rows_per_s": 2000}]}
+
+用法:
+    python3 milvus_capacity_planner.py template plan.json        # 由線上集合產生規格檔
+    python3 milvus_capacity_planner.py plan plan.json
+    python3 milvus_capacity_planner.py quick --dim 512 --index IVF_SQ8 --rows 10000000 --qps 500
+    python3 milvus_capacity_planner.py validate [--update plan.json]
+"""
+
+import argparse
+import json
+import math
+import sys
+
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+from milvus_load_manager import (
+    MEMORY_BUDGET_BYTES,
+    estimate_collection_memory,
+    scalar_bytes_per_row,
+    vector_bytes_per_row,
+)
+
+# 磁碟估算
+DISK_OVERHEAD_RATIO = 1.1  # binlog 中繼資料、統計檔等
+INDEX_ID_BYTES = 8
+
+# 分片建議
+INSERT_ROWS_PER_SHARD_PER_S = 5_000
+ROWS_PER_SHARD = 50_000_000
+MAX_SHARDS = 16
+
+# 副本建議: 各索引類型在 REFERENCE_ROWS 筆、nq=1、單副本下的參考 QPS
+REFERENCE_ROWS = 1_000_000
+REFERENCE_QPS_PER_REPLICA = {
+    "FLAT": 50,
+    "IVF_FLAT": 800,
+    "IVF_SQ8": 1_200,
+    "IVF_PQ": 1_500,
+    "HNSW": 3_000,
+    "DISKANN": 600,
+}
+MIN_REPLICAS = 1
+NODE_MEMORY_HEADROOM = 0.8  # 查詢節點只規劃 80% 記憶體給集合
+
+
+def _schema_fields(schema):
+    if isinstance(schema, CollectionSchema):
+        return schema.fields
+    return CollectionSchema.construct_from_dict(schema).fields
+
+
+def _vector_index(fields, index_params_by_field):
+    """回傳第一個向量欄位的索引參數"""
+    for field in fields:
+        if field.dtype in (DataType.FLOAT_VECTOR, DataType.BINARY_VECTOR):
+            return index_params_by_field.get(field.name) or {"index_type": "FLAT"}
+    return {"index_type": "FLAT"}
+
+
+def estimate_disk_bytes(fields, index_params_by_field, row_count):
+    """物件儲存用量: 原始 binlog + 索引檔"""
+    per_row = 0.0
+    for field in fields:
+        if field.dtype == DataType.FLOAT_VECTOR:
+            dim = field.params["dim"]
+            per_row += dim * 4 + vector_bytes_per_row(dim, index_params_by_field.get(field.name)) + INDEX_ID_BYTES
+        elif field.dtype == DataType.BINARY_VECTOR:
+            per_row += field.params["dim"] / 8 * 2 + INDEX_ID_BYTES
+        else:
+            per_row += scalar_bytes_per_row(field)
+    return int(per_row * row_count * DISK_OVERHEAD_RATIO)
+
+
+def estimate_qps_per_replica(index_params, row_count):
+    """依索引類型與筆數估算單副本 QPS；IVF 與 FLAT 成本隨筆數線性增加，HNSW 約為對數"""
+    index_type = index_params.get("index_type", "FLAT")
+    reference = REFERENCE_QPS_PER_REPLICA.get(index_type, REFERENCE_QPS_PER_REPLICA["FLAT"])
+    rows = max(row_count, 1)
+    if index_type == "HNSW":
+        return reference * math.log2(REFERENCE_ROWS) / math.log2(max(rows, 2))
+    if index_type.startswith("IVF_"):
+        # 固定 nprobe 下掃描的資料量與 rows / nlist 成正比
+        nlist = index_params.get("params", {}).get("nlist", 1024)
+        return reference * (REFERENCE_ROWS / 1024) / (rows / nlist)
+    return reference * REFERENCE_ROWS / rows
+
+
+def plan_collection(entry, calibration=1.0):
+    """規劃單一集合，回傳估算與建議"""
+    fields = _schema_fields(entry["schema"])
+    index_params_by_field = {index["field_name"]: index["params"] for index in entry.get("indexes", [])}
+    rows = int(entry["rows"])
+    qps = float(entry.get("qps", 0))
+    insert_rate = float(entry.get("insert_rows_per_s", 0))
+    index_params = _vector_index(fields, index_params_by_field)
+
+    memory = estimate_collection_memory(fields, index_params_by_field, rows) * calibration
+    qps_per_replica = entry.get("qps_per_replica") or estimate_qps_per_replica(index_params, rows)
+    replicas = max(MIN_REPLICAS, math.ceil(qps / qps_per_replica) if qps else MIN_REPLICAS)
+    shards = min(MAX_SHARDS, max(1, math.ceil(insert_rate / INSERT_ROWS_PER_SHARD_PER_S),
+                                 math.ceil(rows / ROWS_PER_SHARD)))
+
+    return {
+        "name": entry["name"],
+        "rows": rows,
+        "index_type": index_params.get("index_type", "FLAT"),
+        "memory_bytes": int(memory),
+        "memory_with_replicas_bytes": int(memory * replicas),
+        "disk_bytes": estimate_disk_bytes(fields, index_params_by_field, rows),
+        "qps": qps,
+        "qps_per_replica": qps_per_replica,
+        "replicas": replicas,
+        "shards": shards,
+        "calibration": calibration,
+    }
+
+
+def plan(spec):
+    """規劃規格檔中的所有集合，回傳 (各集合結果, 總計)"""
+    calibration = spec.get("calibration", {})
+    results = [plan_collection(entry, calibration.get(entry["name"], 1.0)) for entry in spec["collections"]]
+    node_memory = spec.get("query_node_memory_bytes", MEMORY_BUDGET_BYTES) * NODE_MEMORY_HEADROOM
+    total_memory = sum(result["memory_with_replicas_bytes"] for result in results)
+    # 每個副本需放在不同查詢節點
+    max_replicas = max((result["replicas"] for result in results), default=1)
+    totals = {
+        "memory_bytes": total_memory,
+        "disk_bytes": sum(result["disk_bytes"] for result in results),
+        "query_nodes": max(max_replicas, math.ceil(total_memory / node_memory)),
+    }
+    return results, totals
+
+
+def format_bytes(n_bytes):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n_bytes < 1024 or unit == "TB":
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+
+
+def print_plan(results, totals):
+    """顯示規劃結果"""
+    for result in results:
+        print(f"{result['name']} ({result['index_type']}, {result['rows']:,} 筆):")
+        print(f"  記憶體 {format_bytes(result['memory_bytes'])} / 副本, "
+              f"共 {format_bytes(result['memory_with_replicas_bytes'])} ({result['replicas']} 副本)")
+        print(f"  磁碟 {format_bytes(result['disk_bytes'])}, 建議分片 {result['shards']}")
+        if result["qps"]:
+            print(f"  目標 {result['qps']:.0f} QPS, 單副本約 {result['qps_per_replica']:.0f} QPS")
+        if result["calibration"] != 1.0:
+            print(f"  (已套用實測校正 x{result['calibration']:.2f})")
+    print(f"\n總計: 記憶體 {format_bytes(totals['memory_bytes'])}, 磁碟 {format_bytes(totals['disk_bytes'])}, "
+          f"建議查詢節點 {totals['query_nodes']} 台")
+
+
+# ==============================================
+# 線上集合
+# ==============================================
+
+def spec_from_milvus(collection_names, qps=0):
+    """以線上集合的 schema、索引與目前筆數產生規格"""
+    from pymilvus import Collection
+    entries = []
+    for name in collection_names:
+        collection = Collection(name)
+        entries.append({
+            "name": name,
+            "schema": collection.schema.to_dict(),
+            "indexes": [{"field_name": index.field_name, "params": index.params} for index in collection.indexes],
+            "rows": collection.num_entities,
+            "qps": qps,
+            "insert_rows_per_s": 0,
+        })
+    return {"query_node_memory_bytes": MEMORY_BUDGET_BYTES, "collections": entries}
+
+
+def validate(collection_names):
+    """比較已載入集合的估算記憶體與 segment 實測記憶體，回傳 {集合: 實測 / 估算}"""
+    from pymilvus import Collection, utility
+    from pymilvus.client.types import LoadState
+    from milvus_load_manager import estimate_loaded_memory
+
+    ratios = {}
+    for name in collection_names:
+        if utility.load_state(name) != LoadState.Loaded:
+            print(f"⚠️ {name}: 未載入，略過")
+            continue
+        segments = {s.segmentID: s for s in utility.get_query_segment_info(name)}.values()
+        measured = sum(segment.mem_size for segment in segments)
+        estimated = estimate_loaded_memory(Collection(name))
+        if not measured or not estimated:
+            print(f"⚠️ {name}: 無資料，略過")
+            continue
+        ratios[name] = measured / estimated
+        print(f"{name}: 估算 {format_bytes(estimated)}, 實測 {format_bytes(measured)}, "
+              f"實測/估算 {ratios[name]:.2f}")
+    return ratios
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Milvus 集合容量規劃")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="依規格檔規劃")
+    plan_parser.add_argument("spec")
+
+    quick_parser = subparsers.add_parser("quick", help="單一向量欄位快速估算")
+    quick_parser.add_argument("--dim", type=int, required=True)
+    quick_parser.add_argument("--index", default="IVF_SQ8")
+    quick_parser.add_argument("--nlist", type=int, default=1024)
+    quick_parser.add_argument("--rows", type=int, required=True)
+    quick_parser.add_argument("--qps", type=float, default=0)
+    quick_parser.add_argument("--insert-rows-per-s", type=float, default=0)
+    quick_parser.add_argument("--scalar-bytes", type=int, default=0, help="每筆純量欄位總位元組")
+
+    template_parser = subparsers.add_parser("template", help="由線上集合產生規格檔")
+    template_parser.add_argument("spec")
+    template_parser.add_argument("--collections", nargs="*")
+    template_parser.add_argument("--qps", type=float, default=0)
+
+    validate_parser = subparsers.add_parser("validate", help="以實際載入的集合校正估算")
+    validate_parser.add_argument("--collections", nargs="*")
+    validate_parser.add_argument("--update", help="將校正係數寫入此規格檔")
+
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        with open(args.spec, encoding="utf-8") as f:
+            print_plan(*plan(json.load(f)))
+        return
+
+    if args.command == "quick":
+        fields = [
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=args.dim),
+        ]
+        if args.scalar_bytes:
+            fields.append(FieldSchema(name="scalars", dtype=DataType.VARCHAR, max_length=args.scalar_bytes * 2))
+        entry = {
+            "name": f"{args.dim}d {args.index}",
+            "schema": CollectionSchema(fields),
+            "indexes": [{"field_name": "embedding",
+                         "params": {"index_type": args.index, "metric_type": "L2",
+                                    "params": {"nlist": args.nlist}}}],
+            "rows": args.rows,
+            "qps": args.qps,
+            "insert_rows_per_s": args.insert_rows_per_s,
+        }
+        print_plan(*plan({"collections": [entry]}))
+        return
+
+    from pymilvus import connections, utility
+    from milvus_common import ECOMMERCE_COLLECTIONS, connect_to_milvus
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        names = args.collections or [name for name in ECOMMERCE_COLLECTIONS if utility.has_collection(name)]
+        if args.command == "template":
+            with open(args.spec, "w", encoding="utf-8") as f:
+                json.dump(spec_from_milvus(names, args.qps), f, ensure_ascii=False, indent=2)
+            print(f"✅ 已寫入規格檔 {args.spec}，請修改 rows / qps / insert_rows_per_s 為預估值")
+        else:
+            ratios = validate(names)
+            if args.update and ratios:
+                with open(args.update, encoding="utf-8") as f:
+                    spec = json.load(f)
+                spec.setdefault("calibration", {}).update(ratios)
+                with open(args.update, "w", encoding="utf-8") as f:
+                    json.dump(spec, f, ensure_ascii=False, indent=2)
+                print(f"✅ 已更新 {args.update} 的校正係數")
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+冷啟動分類質心
+新註冊用戶在 user_vectors / recommendations 中沒有資料，但已知其偏好分類 (preference_category)
+或正在瀏覽的分類。本模組以串流方式累加 product_vectors 每個 category_id 的向量和，
+得到分類質心，並以 mini-batch k-means 維護每個分類的數個子質心 (涵蓋分類內不同風格的商品)，
+作為冷啟動用戶的查詢向量。
+
+結果保存在記憶體並可寫入 .npz 檔；記錄已處理的最大 product_id，
+之後只需掃描新增的商品即可增量更新 (商品刪除或向量更新請定期以 build 全量重算)
+
+用法:
+    python3 milvus_category_centroids.py build --output centroids.npz
+    python3 milvus_category_centroids.py refresh --path centroids.npz   # 只處理新增商品
+    python3 milvus_category_centroids.py show --path centroids.npz
+    python3 milvus_category_centroids.py bench                          # 本地引擎測量
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from milvus_common import collection_search_params, metric_type, prepare_vectors
+from milvus_deactivation import ExclusionBitset, search_live
+
+# 質心設定
+DEFAULT_SUBCENTROIDS = 4
+MIN_SUBCENTROID_COUNT = 20  # 成員數不足的子質心不作為查詢向量
+SCAN_BATCH_SIZE = 10_000
+PRODUCT_COLLECTION = "product_vectors"
+PRODUCT_DIM = 512
+
+
+class CategoryCentroids:
+    """每個分類的向量和 / 筆數 (質心) 與 mini-batch k-means 子質心
+
+    所有更新皆為增量：向量和與筆數直接累加 (分批與一次處理的質心相同)，
+    子質心以各自累計成員數為學習率移動 (Sculley 2010 mini-batch k-means)
+    """
+
+    def __init__(self, dim, n_subcentroids=DEFAULT_SUBCENTROIDS, seed=0):
+        self.dim = dim
+        self.n_subcentroids = n_subcentroids
+        self.watermark = 0  # 已處理的最大 product_id
+        self.updated_at = 0.0
+        self._rows = {}  # category_id → 陣列列號
+        self._sums = np.zeros((0, dim), dtype=np.float64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._sub = np.zeros((0, n_subcentroids, dim), dtype=np.float32)
+        self._sub_counts = np.zeros((0, n_subcentroids), dtype=np.int64)
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def categories(self):
+        return sorted(self._rows)
+
+    def _row(self, category_id):
+        """取得分類列號，不存在時擴充陣列"""
+        row = self._rows.get(category_id)
+        if row is None:
+            row = len(self._rows)
+            self._rows[category_id] = row
+            self._sums = np.vstack([self._sums, np.zeros((1, self.dim))])
+            self._counts = np.append(self._counts, 0)
+            self._sub = np.concatenate([self._sub, np.zeros((1, self.n_subcentroids, self.dim), np.float32)])
+            self._sub_counts = np.vstack([self._sub_counts, np.zeros((1, self.n_subcentroids), np.int64)])
+        return row
+
+    def update(self, category_ids, embeddings, product_ids=None):
+        """累加一批商品 (category_id 陣列與 2-D 向量)"""
+        category_ids = np.asarray(category_ids, dtype=np.int64)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(category_ids), self.dim)
+        if not len(category_ids):
+            return
+
+        order = np.argsort(category_ids, kind="stable")
+        categories, starts = np.unique(category_ids[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        with self._lock:
+            for category_id, start, stop in zip(categories.tolist(), bounds[:-1], bounds[1:]):
+                vectors = embeddings[order[start:stop]]
+                row = self._row(category_id)
+                self._sums[row] += vectors.sum(axis=0, dtype=np.float64)
+                self._counts[row] += len(vectors)
+                if self.n_subcentroids:
+                    self._update_subcentroids(row, vectors)
+            if product_ids is not None and len(product_ids):
+                self.watermark = max(self.watermark, int(np.max(product_ids)))
+            self.updated_at = time.time()
+
+    def _update_subcentroids(self, row, vectors):
+        """mini-batch k-means 一步: 指派到最近子質心後以累計成員數為學習率移動"""
+        centers = self._sub[row]
+        counts = self._sub_counts[row]
+
+        # 尚未初始化的子質心以本批隨機向量填入
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            chosen = self._rng.choice(len(vectors), min(len(empty), len(vectors)), replace=False)
+            centers[empty[:len(chosen)]] = vectors[chosen]
+            counts[empty[:len(chosen)]] = 1
+            vectors = np.delete(vectors, chosen, axis=0)
+            if not len(vectors):
+                return
+
+        active = counts > 0
+        distances = np.einsum("ij,ij->i", centers, centers)[None, :] - 2 * vectors @ centers.T
+        distances[:, ~active] = np.inf
+        assign = np.argmin(distances, axis=1)
+
+        batch_counts = np.bincount(assign, minlength=self.n_subcentroids)
+        batch_sums = np.zeros_like(centers)
+        np.add.at(batch_sums, assign, vectors)
+        moved = batch_counts > 0
+        counts[moved] += batch_counts[moved]
+        centers[moved] += (batch_sums[moved] - batch_counts[moved, None] * centers[moved]) / counts[moved, None]
+
+    def centroid(self, category_id):
+        """分類質心 (平均向量)；分類不存在時回傳 None"""
+        row = self._rows.get(category_id)
+        if row is None or not self._counts[row]:
+            return None
+        return (self._sums[row] / self._counts[row]).astype(np.float32)
+
+    def query_vectors(self, category_id, include_subcentroids=True):
+        """冷啟動查詢向量: 質心 + 成員數足夠的子質心 (2-D)；分類不存在時回傳 None"""
+        with self._lock:
+            centroid = self.centroid(category_id)
+            if centroid is None:
+                return None
+            vectors = [centroid[None, :]]
+            if include_subcentroids and self.n_subcentroids:
+                row = self._rows[category_id]
+                vectors.append(self._sub[row][self._sub_counts[row] >= MIN_SUBCENTROID_COUNT])
+            return np.concatenate(vectors)
+
+    def summary(self):
+        """每個分類的商品數與有效子質心數"""
+        with self._lock:
+            return [
+                {
+                    "category_id": category_id,
+                    "products": int(self._counts[row]),
+                    "subcentroids": int((self._sub_counts[row] >= MIN_SUBCENTROID_COUNT).sum()),
+                    "subcentroid_sizes": self._sub_counts[row].tolist(),
+                }
+                for category_id, row in sorted(self._rows.items())
+            ]
+
+    # ==============================================
+    # 串流掃描
+    # ==============================================
+
+    def refresh(self, collection, batch_size=SCAN_BATCH_SIZE):
+        """以分頁迭代器掃描 product_id 大於 watermark 的商品並累加，回傳處理筆數"""
+        iterator = collection.query_iterator(
+            batch_size=batch_size, expr=f"product_id > {self.watermark}",
+            output_fields=["category_id", "embedding"],
+        )
+        processed = 0
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                self.update(
+                    [row["category_id"] for row in rows],
+                    np.array([row["embedding"] for row in rows], dtype=np.float32),
+                    product_ids=[row["product_id"] for row in rows],
+                )
+                processed += len(rows)
+        finally:
+            iterator.close()
+        return processed
+
+    @classmethod
+    def from_collection(cls, collection, n_subcentroids=DEFAULT_SUBCENTROIDS, batch_size=SCAN_BATCH_SIZE):
+        """全量掃描集合建立質心"""
+        dim = next(field.params["dim"] for field in collection.schema.fields if field.name == "embedding")
+        centroids = cls(dim, n_subcentroids)
+        centroids.refresh(collection, batch_size)
+        return centroids
+
+    # ==============================================
+    # 磁碟快取
+    # ==============================================
+
+    def save(self, path):
+        """寫入 .npz (先寫暫存檔再取代，讀取端不會看到寫到一半的檔案)"""
+        with self._lock:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    categories=np.array(sorted(self._rows, key=self._rows.get), dtype=np.int64),
+                    sums=self._sums, counts=self._counts,
+                    sub=self._sub, sub_counts=self._sub_counts,
+                    meta=np.array([self.watermark, self.updated_at], dtype=np.float64),
+                )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            centroids = cls(data["sums"].shape[1], data["sub"].shape[1])
+            centroids._rows = {int(c): row for row, c in enumerate(data["categories"])}
+            centroids._sums = data["sums"]
+            centroids._counts = data["counts"]
+            centroids._sub = data["sub"]
+            centroids._sub_counts = data["sub_counts"]
+            centroids.watermark = int(data["meta"][0])
+            centroids.updated_at = float(data["meta"][1])
+        return centroids
+
+
+def cold_start_search(collection, centroids, category_ids, limit, search_params=None, exclusions=None):
+    """以每個分類的查詢向量一次搜尋 (nq = 所有分類查詢向量數)，
+    各查詢向量的結果依排名輪流合併去重；回傳每個分類的 [(product_id, 分數)]，不存在的分類為空清單
+
+    exclusions 為下架商品位元表時經 search_live 搜尋 (多取並對不足 limit 的查詢向量加倍重搜)，
+    排除後每個分類仍盡量補滿 limit 筆
+    """
+    search_params = search_params or collection_search_params(collection.name)
+    blocks = [centroids.query_vectors(category_id) for category_id in category_ids]
+    present = [block for block in blocks if block is not None]
+    if not present:
+        return [[] for _ in category_ids]
+
+    data = prepare_vectors(collection.name, np.concatenate(present)).tolist()
+    if exclusions is not None:
+        results = iter(search_live(collection, data, limit, exclusions, param=search_params))
+    else:
+        results = iter(collection.search(data=data, anns_field="embedding", param=search_params, limit=limit))
+    merged = []
+    for block in blocks:
+        if block is None:
+            merged.append([])
+            continue
+        per_vector = [next(results) for _ in range(len(block))]
+        seen, scored = set(), []
+        for rank in range(limit):
+            for hits in per_vector:
+                if rank < len(hits) and hits[rank].id not in seen:
+                    seen.add(hits[rank].id)
+                    scored.append((hits[rank].id, float(hits[rank].distance)))
+        merged.append(scored[:limit])
+    return merged
+
+
+def print_summary(centroids):
+    print(f"📊 {len(centroids)} 個分類, watermark product_id={centroids.watermark}, "
+          f"更新時間 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(centroids.updated_at))}")
+    for item in centroids.summary():
+        print(f"  - 分類 {item['category_id']}: {item['products']} 筆商品, "
+              f"子質心 {item['subcentroids']} 個 {item['subcentroid_sizes']}")
+
+
+# ==============================================
+# 本地測量
+# ==============================================
+
+def run_benchmark(n_products, n_categories, new_share, limit, seed=0):
+    """本地引擎: 全量建立 vs 增量更新耗時，以及冷啟動結果屬於該分類的比例"""
+    from pymilvus import CollectionSchema, DataType, FieldSchema
+    from milvus_local_engine import LocalMilvus
+
+    rng = np.random.default_rng(seed)
+    categories = rng.integers(1, n_categories + 1, n_products)
+    # 與 milvus-init.py 相同: 隨機值 + 分類區段偏移
+    vectors = rng.random((n_products, PRODUCT_DIM), dtype=np.float32)
+    block = PRODUCT_DIM // n_categories
+    columns = (categories[:, None] - 1) * block + np.arange(block)
+    vectors[np.arange(n_products)[:, None], columns] += 0.6
+    vectors = prepare_vectors(PRODUCT_COLLECTION, vectors)
+    n_initial = int(n_products * (1 - new_share))
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = LocalMilvus(data_dir)
+        collection = client.collection(PRODUCT_COLLECTION, CollectionSchema(fields=[
+            FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=PRODUCT_DIM),
+            FieldSchema(name="category_id", dtype=DataType.INT64),
+        ]))
+        product_ids = np.arange(1, n_products + 1)
+        collection.insert([product_ids[:n_initial], vectors[:n_initial], categories[:n_initial]])
+        collection.create_index("embedding", {"index_type": "FLAT", "metric_type": metric_type(PRODUCT_COLLECTION)})
+        collection.load()
+
+        started = time.perf_counter()
+        centroids = CategoryCentroids.from_collection(collection)
+        build_s = time.perf_counter() - started
+
+        collection.insert([product_ids[n_initial:], vectors[n_initial:], categories[n_initial:]])
+        started = time.perf_counter()
+        added = centroids.refresh(collection)
+        refresh_s = time.perf_counter() - started
+
+        full = CategoryCentroids.from_collection(collection)
+        drift = max(float(np.abs(centroids.centroid(c) - full.centroid(c)).max()) for c in full.categories)
+
+        category_of = dict(zip(product_ids.tolist(), categories.tolist()))
+        wanted = full.categories
+        started = time.perf_counter()
+        results = cold_start_search(collection, centroids, wanted, limit)
+        search_ms = (time.perf_counter() - started) * 1000
+        precision = np.mean([
+            np.mean([category_of[product_id] == category_id for product_id, _ in scored])
+            for category_id, scored in zip(wanted, results)
+        ])
+
+        # 下架每個分類結果的前半，排除後仍應補滿 limit 筆且不含下架商品
+        exclusions = ExclusionBitset([product_id for scored in results for product_id, _ in scored[:limit // 2]])
+        live = cold_start_search(collection, centroids, wanted, limit, exclusions=exclusions)
+        live_full = np.mean([len(scored) == limit for scored in live])
+        live_leaked = sum(exclusions.contains([product_id for product_id, _ in scored]).sum() for scored in live)
+        client.close()
+
+    print(f"全量建立: {n_initial} 筆 {build_s:.2f}s ({n_initial / build_s:,.0f} 筆/s)")
+    print(f"增量更新: {added} 筆新增商品 {refresh_s:.3f}s, 與全量重算的質心最大差 {drift:.2e}")
+    print(f"冷啟動搜尋: {len(wanted)} 個分類一次搜尋 {search_ms:.1f} ms, 結果屬於該分類比例 {precision:.1%}")
+    print(f"排除 {len(exclusions)} 筆下架商品: 補滿 {limit} 筆的分類比例 {live_full:.1%}, 結果含下架商品 {live_leaked} 筆")
+    print_summary(centroids)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="冷啟動分類質心")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="全量掃描 product_vectors 建立質心")
+    build_parser.add_argument("--output", required=True)
+    build_parser.add_argument("--subcentroids", type=int, default=DEFAULT_SUBCENTROIDS)
+
+    refresh_parser = subparsers.add_parser("refresh", help="只掃描新增商品並更新質心檔")
+    refresh_parser.add_argument("--path", required=True)
+
+    show_parser = subparsers.add_parser("show", help="顯示質心檔內容")
+    show_parser.add_argument("--path", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="以本地引擎測量")
+    bench_parser.add_argument("--products", type=int, default=50_000)
+    bench_parser.add_argument("--categories", type=int, default=5)
+    bench_parser.add_argument("--new-share", type=float, default=0.02)
+    bench_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print_summary(CategoryCentroids.load(args.path))
+        return
+    if args.command == "bench":
+        run_benchmark(args.products, args.categories, args.new_share, args.limit)
+        return
+
+    from pymilvus import Collection, connections
+    from milvus_common import connect_to_milvus
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        collection = Collection(PRODUCT_COLLECTION)
+        started = time.time()
+        if args.command == "build":
+            centroids = CategoryCentroids.from_collection(collection, args.subcentroids)
+            centroids.save(args.output)
+            print(f"✅ 已建立 {len(centroids)} 個分類質心 ({time.time() - started:.1f}s): {args.output}")
+        else:
+            centroids = CategoryCentroids.load(args.path)
+            added = centroids.refresh(collection)
+            centroids.save(args.path)
+            print(f"✅ 已處理 {added} 筆新增商品 ({time.time() - started:.1f}s): {args.path}")
+        print_summary(centroids)
+    except Exception as e:
+        print(f"❌ 質心計算失敗: {e}")
+        sys.exit(1)
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
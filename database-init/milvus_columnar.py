@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+欄位式批次格式
+向量以連續的 2-D float32 (二元向量為 uint8) 陣列、數值純量以 NumPy 型別陣列保存，
+從產生器 / 快照 / 同步來源一路傳到寫入，不再逐元素轉成 Python list
+
+pymilvus 2.3 寫入時會把每個向量展開成 Python float 再逐一放進 protobuf，
+insert_batch 改為直接以向量的位元組組成 packed 欄位，交給 Collection.insert 的 insert_param 送出；
+本地引擎 (milvus_local_engine) 則直接接收陣列
+啟用動態欄位的集合，schema 以外的鍵以每列 dict 隨批次攜帶 (dynamic)，含動態資料的批次改以逐列 dict 寫入
+
+用法:
+    python3 milvus_columnar.py --rows 200000 --dim 512           # 比較 list 與欄位式批次 (只編碼請求)
+    python3 milvus_columnar.py --rows 200000 --dim 512 --milvus  # 實際寫入 Milvus 測試集合
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema
+from pymilvus.client import entity_helper
+from pymilvus.grpc_gen import milvus_pb2, schema_pb2
+
+from milvus_common import prepare_vectors
+
+# 測量設定
+DEFAULT_ROWS = 200_000
+DEFAULT_DIM = 512
+DEFAULT_BATCH_SIZE = 10_000
+BENCH_COLLECTION = "columnar_bench"
+BENCH_MODES = ("list", "columnar")
+DYNAMIC_FIELD = "$meta"  # 快照 / 匯入檔案中動態欄位 (JSON 字串) 的欄名
+
+NUMPY_SCALAR_TYPES = {
+    DataType.BOOL: np.bool_,
+    DataType.INT8: np.int8,
+    DataType.INT16: np.int16,
+    DataType.INT32: np.int32,
+    DataType.INT64: np.int64,
+    DataType.FLOAT: np.float32,
+    DataType.DOUBLE: np.float64,
+}
+
+# 可直接以原始位元組表示的 packed 欄位 (固定寬度，或每個值恰為一個 varint 位元組的 bool)
+PACKED_SCALARS = {
+    DataType.BOOL: ("bool_data", np.uint8),
+    DataType.FLOAT: ("float_data", "<f4"),
+    DataType.DOUBLE: ("double_data", "<f8"),
+}
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _merge_packed(message, array, dtype):
+    """以陣列的原始位元組填入 message 的 packed data 欄位 (wire type 2)"""
+    payload = np.ascontiguousarray(array, dtype=dtype).tobytes()
+    number = message.DESCRIPTOR.fields_by_name["data"].number
+    message.MergeFromString(_varint(number << 3 | 2) + _varint(len(payload)) + payload)
+
+
+def as_column(field, values):
+    """依欄位型別轉成批次內的儲存形式"""
+    if field.dtype == DataType.FLOAT_VECTOR:
+        block = np.ascontiguousarray(values, dtype=np.float32)
+        return block.reshape(-1, field.params["dim"])
+    if field.dtype == DataType.BINARY_VECTOR:
+        if len(values) and isinstance(values[0], bytes):
+            values = np.frombuffer(b"".join(values), dtype=np.uint8)
+        return np.ascontiguousarray(values, dtype=np.uint8).reshape(-1, field.params["dim"] // 8)
+    if field.dtype in NUMPY_SCALAR_TYPES:
+        return np.asarray(values, dtype=NUMPY_SCALAR_TYPES[field.dtype])
+    if field.dtype in (DataType.VARCHAR, DataType.JSON):
+        return values if isinstance(values, list) else list(values)
+    raise ValueError(f"欄位 {field.name} 的型別 {field.dtype} 不支援欄位式批次")
+
+
+class ColumnBatch:
+    """集合寫入欄位 (略過自動主鍵) 的欄位式批次
+
+    columns 可為欄位名稱 → 值的字典，或與 collection.insert 相同順序的欄位清單；
+    dynamic 為每列動態欄位的 dict 清單 (沒有動態資料時為 None)
+    """
+
+    def __init__(self, fields, columns, dynamic=None):
+        self.fields = [f for f in fields if not (f.is_primary and f.auto_id)]
+        if not isinstance(columns, dict):
+            if len(columns) != len(self.fields):
+                raise ValueError(f"需要 {len(self.fields)} 個欄位，收到 {len(columns)} 個")
+            columns = dict(zip((f.name for f in self.fields), columns))
+        self.columns = {f.name: as_column(f, columns[f.name]) for f in self.fields}
+        lengths = {name: len(column) for name, column in self.columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError(f"欄位筆數不一致: {lengths}")
+        self.num_rows = next(iter(lengths.values()), 0)
+        if dynamic is not None and len(dynamic) != self.num_rows:
+            raise ValueError(f"動態欄位筆數 {len(dynamic)} 與批次筆數 {self.num_rows} 不一致")
+        self.dynamic = dynamic if dynamic is not None and any(dynamic) else None
+
+    @classmethod
+    def from_arrow(cls, fields, record_batch, vectors=None):
+        """由 Arrow RecordBatch (純量，可含 $meta 動態欄位) 與向量陣列 (欄位名稱 → 2-D 陣列) 建立"""
+        vectors = vectors or {}
+        columns = {}
+        for field in fields:
+            if field.name in vectors:
+                columns[field.name] = vectors[field.name]
+            elif field.name in record_batch.schema.names:
+                column = record_batch.column(field.name)
+                if field.dtype in NUMPY_SCALAR_TYPES:
+                    columns[field.name] = column.to_numpy(zero_copy_only=False)
+                elif field.dtype == DataType.JSON:
+                    columns[field.name] = [json.loads(value) for value in column.to_pylist()]
+                else:
+                    columns[field.name] = column.to_pylist()
+        dynamic = None
+        if DYNAMIC_FIELD in record_batch.schema.names:
+            dynamic = [json.loads(value) if value else {}
+                       for value in record_batch.column(DYNAMIC_FIELD).to_pylist()]
+        return cls(fields, columns, dynamic)
+
+    @classmethod
+    def from_rows(cls, fields, rows, dynamic_field=False):
+        """由查詢結果 (每列 dict) 建立；dynamic_field 時 schema 以外的鍵收進 dynamic"""
+        names = {f.name for f in fields}
+        dynamic = [{key: value for key, value in row.items() if key not in names} for row in rows] \
+            if dynamic_field else None
+        return cls(fields, {f.name: [row[f.name] for row in rows] for f in fields}, dynamic)
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def nbytes(self):
+        """陣列欄位佔用的位元組數 (不含字串與 JSON)"""
+        return sum(column.nbytes for column in self.columns.values() if isinstance(column, np.ndarray))
+
+    def _select(self, selector):
+        columns = {}
+        for name, column in self.columns.items():
+            if isinstance(column, np.ndarray):
+                columns[name] = column[selector]
+            elif isinstance(selector, slice):
+                columns[name] = column[selector]
+            else:
+                columns[name] = [column[row] for row in selector]
+        dynamic = None
+        if self.dynamic is not None:
+            dynamic = self.dynamic[selector] if isinstance(selector, slice) \
+                else [self.dynamic[row] for row in selector]
+        return ColumnBatch(self.fields, columns, dynamic)
+
+    def slice(self, start, stop):
+        """回傳 [start, stop) 的批次 (陣列欄位為 view)"""
+        return self._select(slice(start, stop))
+
+    def take(self, rows):
+        """回傳指定列的批次"""
+        return self._select(np.asarray(rows, dtype=np.int64))
+
+    def prepared(self, collection_name):
+        """回傳依集合距離類型處理向量欄位後的批次 (IP / COSINE 正規化)"""
+        return ColumnBatch(self.fields, {
+            f.name: prepare_vectors(collection_name, self.columns[f.name]) if f.dtype == DataType.FLOAT_VECTOR
+            else self.columns[f.name]
+            for f in self.fields
+        }, self.dynamic)
+
+    def column_list(self):
+        """依 schema 欄位順序回傳欄位 (collection.insert 的 list-of-columns 格式)"""
+        return [self.columns[f.name] for f in self.fields]
+
+    def to_lists(self):
+        """轉成逐元素的 Python list 欄位 (需要動態欄位等 list 寫入路徑時使用)"""
+        data = []
+        for field in self.fields:
+            column = self.columns[field.name]
+            if field.dtype == DataType.BINARY_VECTOR:
+                data.append([row.tobytes() for row in column])
+            else:
+                data.append(column.tolist() if isinstance(column, np.ndarray) else list(column))
+        return data
+
+    def rows(self):
+        """逐列 dict (含動態欄位的鍵)，供 collection.insert / upsert 的逐列寫入"""
+        names = [f.name for f in self.fields]
+        dynamic = self.dynamic or [{}] * self.num_rows
+        return [{**extra, **dict(zip(names, values))}
+                for extra, values in zip(dynamic, zip(*self.to_lists()))]
+
+    def to_insert_request(self, collection_name, partition_name=None, request_type=milvus_pb2.InsertRequest):
+        """組成 InsertRequest (或 UpsertRequest)；向量與固定寬度純量直接以位元組填入"""
+        request = request_type(
+            collection_name=collection_name,
+            partition_name=partition_name or "",
+            num_rows=self.num_rows,
+        )
+        for field in self.fields:
+            column = self.columns[field.name]
+            if field.dtype == DataType.FLOAT_VECTOR:
+                field_data = schema_pb2.FieldData(field_name=field.name, type=field.dtype)
+                field_data.vectors.dim = field.params["dim"]
+                _merge_packed(field_data.vectors.float_vector, column, "<f4")
+            elif field.dtype == DataType.BINARY_VECTOR:
+                field_data = schema_pb2.FieldData(field_name=field.name, type=field.dtype)
+                field_data.vectors.dim = field.params["dim"]
+                field_data.vectors.binary_vector = column.tobytes()
+            elif field.dtype in PACKED_SCALARS:
+                attribute, dtype = PACKED_SCALARS[field.dtype]
+                field_data = schema_pb2.FieldData(field_name=field.name, type=field.dtype)
+                _merge_packed(getattr(field_data.scalars, attribute), column, dtype)
+            else:
+                values = column.tolist() if isinstance(column, np.ndarray) else column
+                field_data = entity_helper.entity_to_field_data(
+                    {"name": field.name, "type": field.dtype, "values": values}, field.to_dict()
+                )
+            request.fields_data.append(field_data)
+        return request
+
+
+def _placeholder_columns(batch):
+    """指定 insert_param / upsert_param 時 data 只用於欄位檢查 (ndarray 仍會被整欄 tolist)，只傳每欄第一列"""
+    return [
+        [row.tobytes() for row in batch.columns[f.name][:1]] if f.dtype == DataType.BINARY_VECTOR
+        else batch.columns[f.name][:1]
+        for f in batch.fields
+    ]
+
+
+def insert_batch(collection, batch, partition_name=None, timeout=None):
+    """寫入欄位式批次 (IP / COSINE 集合先正規化向量)，回傳 MutationResult
+
+    含動態欄位資料的批次以逐列 dict 寫入 (欄位式請求不帶動態欄位)
+    """
+    batch = batch.prepared(collection.name)
+    if batch.dynamic is not None:
+        return collection.insert(batch.rows(), partition_name=partition_name, timeout=timeout)
+    if not isinstance(collection, Collection):  # 本地引擎直接接收陣列
+        return collection.insert(batch.column_list())
+    request = batch.to_insert_request(collection.name, partition_name)
+    return collection.insert(_placeholder_columns(batch), partition_name, timeout, insert_param=request)
+
+
+def upsert_batch(collection, batch, partition_name=None, timeout=None):
+    """依主鍵覆寫欄位式批次 (重送同一批次結果不變)，回傳 MutationResult；動態欄位資料同 insert_batch"""
+    batch = batch.prepared(collection.name)
+    if batch.dynamic is not None:
+        return collection.upsert(batch.rows(), partition_name=partition_name, timeout=timeout)
+    if not isinstance(collection, Collection):
+        return collection.upsert(batch.column_list())
+    request = batch.to_insert_request(collection.name, partition_name, milvus_pb2.UpsertRequest)
+    return collection.upsert(_placeholder_columns(batch), partition_name, timeout, upsert_param=request)
+
+
+# ==============================================
+# 測量: list 寫入路徑 vs 欄位式批次
+# ==============================================
+
+def bench_schema(dim):
+    return CollectionSchema(fields=[
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+        FieldSchema(name="price", dtype=DataType.FLOAT),
+        FieldSchema(name="brand", dtype=DataType.VARCHAR, max_length=100),
+    ], description="欄位式批次測量")
+
+
+def generate_batches(rows, dim, batch_size, seed=0):
+    """依批次產生 (ids, 2-D 向量, 分類, 價格, 品牌)"""
+    rng = np.random.default_rng(seed)
+    brands = np.array([f"brand_{i}" for i in range(100)], dtype=object)
+    for start in range(0, rows, batch_size):
+        n = min(batch_size, rows - start)
+        yield (
+            np.arange(start, start + n, dtype=np.int64),
+            rng.random((n, dim), dtype=np.float32),
+            rng.integers(1, 11, n),
+            rng.random(n, dtype=np.float32) * 1000,
+            brands[rng.integers(0, len(brands), n)],
+        )
+
+
+def run_mode(mode, rows, dim, batch_size, use_milvus):
+    """在獨立程序中執行單一寫入路徑，回傳吞吐量與峰值 RSS"""
+    from pymilvus.client.prepare import Prepare as ClientPrepare
+    from pymilvus.orm.prepare import Prepare as OrmPrepare
+
+    schema = bench_schema(dim)
+    collection = Collection(BENCH_COLLECTION) if use_milvus else None
+    fields_info = [f.to_dict() for f in schema.fields]
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    request_bytes = 0
+    for ids, vectors, categories, prices, brands in generate_batches(rows, dim, batch_size):
+        if mode == "list":
+            # 原有寫法: 每個向量 tolist() 後組成 list-of-lists
+            data = [ids.tolist(), [vector.tolist() for vector in vectors], categories.tolist(),
+                    prices.tolist(), brands.tolist()]
+            if use_milvus:
+                collection.insert(data)
+                continue
+            request = ClientPrepare.batch_insert_param(
+                BENCH_COLLECTION, OrmPrepare.prepare_insert_data(data, schema), "", fields_info
+            )
+        else:
+            batch = ColumnBatch(schema.fields, [ids, vectors, categories, prices, brands])
+            if use_milvus:
+                insert_batch(collection, batch)
+                continue
+            request = batch.to_insert_request(BENCH_COLLECTION)
+        request_bytes += len(request.SerializeToString())
+    elapsed = time.perf_counter() - started
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "rows_per_s": rows / elapsed,
+        "elapsed_s": elapsed,
+        "peak_rss_mb": peak_kb / 1024,
+        "peak_rss_delta_mb": (peak_kb - baseline_kb) / 1024,
+        "request_mb": request_bytes / 1024 ** 2,
+    }
+
+
+def run_benchmark(rows, dim, batch_size, use_milvus=False):
+    """各路徑以獨立程序執行 (峰值 RSS 互不影響)，回傳結果清單"""
+    if use_milvus:
+        from pymilvus import connections, utility
+        from milvus_common import connect_to_milvus
+
+        if not connect_to_milvus():
+            sys.exit(1)
+        try:
+            if utility.has_collection(BENCH_COLLECTION):
+                utility.drop_collection(BENCH_COLLECTION)
+            Collection(BENCH_COLLECTION, bench_schema(dim))
+        finally:
+            connections.disconnect("default")
+
+    results = []
+    for mode in BENCH_MODES:
+        command = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--rows", str(rows),
+                   "--dim", str(dim), "--batch-size", str(batch_size)]
+        if use_milvus:
+            command.append("--milvus")
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="欄位式批次與 list 寫入路徑的吞吐量 / 峰值記憶體比較")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--milvus", action="store_true", help="實際寫入 Milvus 測試集合 (預設只編碼請求)")
+    parser.add_argument("--mode", choices=BENCH_MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        if args.milvus:
+            from pymilvus import connections
+            from milvus_common import connect_to_milvus
+
+            if not connect_to_milvus():
+                sys.exit(1)
+            try:
+                result = run_mode(args.mode, args.rows, args.dim, args.batch_size, True)
+            finally:
+                connections.disconnect("default")
+        else:
+            result = run_mode(args.mode, args.rows, args.dim, args.batch_size, False)
+        print(json.dumps(result))
+        return
+
+    target = "寫入 Milvus" if args.milvus else "編碼 InsertRequest"
+    print(f"📊 {args.rows} 筆 × {args.dim} 維, 每批 {args.batch_size} 筆 ({target})")
+    results = run_benchmark(args.rows, args.dim, args.batch_size, args.milvus)
+    for result in results:
+        print(f"  {result['mode']:>8}: {result['rows_per_s']:>10.0f} 筆/秒, "
+              f"峰值 RSS {result['peak_rss_mb']:.0f} MB (+{result['peak_rss_delta_mb']:.0f} MB)")
+    baseline, columnar = results
+    print(f"✅ 欄位式批次: 吞吐量 {columnar['rows_per_s'] / baseline['rows_per_s']:.1f}x, "
+          f"峰值 RSS 增量 {baseline['peak_rss_delta_mb']:.0f} → {columnar['peak_rss_delta_mb']:.0f} MB")
+
+    if args.milvus:
+        from pymilvus import connections, utility
+        from milvus_common import connect_to_milvus
+
+        if connect_to_milvus():
+            utility.drop_collection(BENCH_COLLECTION)
+            connections.disconnect("default")
+            print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
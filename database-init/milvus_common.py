@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Milvus 工具模組共用設定
+連線資訊、電商集合清單、各集合的一致性等級與距離類型
+"""
+
+import numpy as np
+from pymilvus import connections
+
+# Milvus 連線設定
+MILVUS_HOST = "localhost"
+MILVUS_PORT = 19530
+MILVUS_USER = "root"
+MILVUS_PASSWORD = "Milvus"
+
+# milvus-init.py 與 milvus-test-data.py 建立的集合
+ECOMMERCE_COLLECTIONS = [
+    "product_vectors",
+    "user_vectors",
+    "search_history",
+    "recommendations",
+    "user_behavior",
+    "product_similarity",
+]
+
+# 一致性等級: 寫入後可見性由等級保證，不必每次寫入都 flush
+# 取捨依 milvus_consistency_bench.py 的寫入吞吐量、搜尋延遲與可見延遲測量結果
+CONSISTENCY_LEVELS = ("Strong", "Bounded", "Session", "Eventually")
+DEFAULT_CONSISTENCY_LEVEL = "Bounded"
+COLLECTION_CONSISTENCY = {
+    "product_vectors": "Bounded",
+    "user_vectors": "Bounded",
+    "search_history": "Eventually",  # 僅追加的搜尋紀錄，分析用途可容忍延遲
+    "recommendations": "Bounded",
+    "user_behavior": "Session",  # 寫入端需立即讀到自己寫入的行為
+    "product_similarity": "Bounded",
+}
+
+
+def consistency_level(collection_name):
+    """集合建立與搜尋使用的一致性等級"""
+    level = COLLECTION_CONSISTENCY.get(collection_name, DEFAULT_CONSISTENCY_LEVEL)
+    if level not in CONSISTENCY_LEVELS:
+        raise ValueError(f"不支援的一致性等級: {level}")
+    return level
+
+
+# 距離類型: IP / COSINE 集合在寫入與查詢時先做 L2 正規化，IP 在單位向量上即為 cosine
+# 未正規化的 L2 會讓長度較大的向量主導結果；取捨依 milvus_metric_bench.py 的延遲與 recall 測量結果
+METRIC_TYPES = ("L2", "IP", "COSINE")
+NORMALIZED_METRICS = ("IP", "COSINE")
+DEFAULT_METRIC_TYPE = "L2"
+DEFAULT_NPROBE = 10
+NORM_TOLERANCE = 1e-4  # 長度與 1 相差在此範圍內的列視為已正規化，保留原始位元 (快照還原 / 回填後 checksum 不變)
+COLLECTION_METRICS = {
+    "product_vectors": "IP",
+    "user_vectors": "IP",
+    "search_history": "L2",
+    "user_behavior": "L2",
+}
+
+
+def metric_type(collection_name):
+    """集合索引與搜尋使用的距離類型"""
+    metric = COLLECTION_METRICS.get(collection_name, DEFAULT_METRIC_TYPE)
+    if metric not in METRIC_TYPES:
+        raise ValueError(f"不支援的距離類型: {metric}")
+    return metric
+
+
+def collection_search_params(collection_name, **params):
+    """集合的搜尋參數 (預設 nprobe)"""
+    return {"metric_type": metric_type(collection_name), "params": params or {"nprobe": DEFAULT_NPROBE}}
+
+
+def normalize_vectors(vectors):
+    """逐列 L2 正規化，回傳新的 float32 2-D 陣列 (零向量維持為零，已是單位長度的列不重新計算)"""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))[:, None]
+    rescale = (norms > 0) & (np.abs(norms - 1) > NORM_TOLERANCE)
+    return np.divide(vectors, norms, out=vectors, where=rescale)
+
+
+def prepare_vectors(collection_name, vectors):
+    """寫入或查詢前依集合距離類型處理向量 (IP / COSINE 正規化)，回傳 float32 2-D 陣列"""
+    if metric_type(collection_name) in NORMALIZED_METRICS:
+        return normalize_vectors(vectors)
+    return np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+
+
+def connect_to_milvus(alias="default"):
+    """連接到 Milvus 伺服器"""
+    try:
+        connections.connect(
+            alias=alias,
+            host=MILVUS_HOST,
+            port=MILVUS_PORT,
+            user=MILVUS_USER,
+            password=MILVUS_PASSWORD
+        )
+        print("✅ Milvus 連線成功！")
+        return True
+    except Exception as e:
+        print(f"❌ Milvus 連線失敗: {e}")
+        return False
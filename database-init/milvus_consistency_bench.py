@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+一致性等級測量
+對 Strong / Bounded / Session / Eventually 各建立一個測試集合，測量:
+  - 寫入吞吐量 (不 flush；--with-flush 另測每批 flush 的舊做法)
+  - 搜尋延遲 (以該等級搜尋)
+  - 可見延遲: 寫入一筆後，另一個連線 (以及 Session 的同一連線) 查到該筆所需時間
+用於決定 search_history、user_behavior 等集合在 milvus_common.COLLECTION_CONSISTENCY 的設定
+
+用法:
+    python3 milvus_consistency_bench.py --rows 20000 --searches 200 --probes 20
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+from milvus_common import CONSISTENCY_LEVELS, connect_to_milvus
+
+# 測量設定
+BENCH_COLLECTION_PREFIX = "consistency_bench_"
+READER_ALIAS = "consistency_reader"
+DIM = 128  # 與 user_behavior 相同
+DEFAULT_ROWS = 20_000
+DEFAULT_BATCH_SIZE = 1_000
+DEFAULT_SEARCHES = 200
+DEFAULT_PROBES = 20
+VISIBILITY_POLL_SECONDS = 0.005
+VISIBILITY_TIMEOUT_SECONDS = 30
+
+SEARCH_PARAMS = {
+    "metric_type": "L2",
+    "params": {"nprobe": 10}
+}
+
+
+def create_bench_collection(level):
+    """建立指定一致性等級的測試集合並載入"""
+    collection_name = f"{BENCH_COLLECTION_PREFIX}{level.lower()}"
+    if utility.has_collection(collection_name):
+        utility.drop_collection(collection_name)
+
+    schema = CollectionSchema(fields=[
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=DIM),
+        FieldSchema(name="created_at", dtype=DataType.INT64),
+    ], description=f"一致性測量 ({level})")
+    collection = Collection(
+        name=collection_name,
+        schema=schema,
+        using='default',
+        shards_num=2,
+        consistency_level=level
+    )
+    collection.create_index(
+        field_name="vector",
+        index_params={"metric_type": "L2", "index_type": "IVF_FLAT", "params": {"nlist": 128}}
+    )
+    collection.load()
+    return collection
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def measure_ingest(collection, rows, batch_size, rng, first_id=0, flush=False):
+    """批次寫入 rows 筆，回傳每秒筆數"""
+    start_time = time.perf_counter()
+    for start in range(0, rows, batch_size):
+        n = min(batch_size, rows - start)
+        collection.insert([
+            list(range(first_id + start, first_id + start + n)),
+            rng.random((n, DIM), dtype=np.float32),
+            [int(time.time())] * n,
+        ])
+        if flush:
+            collection.flush()
+    return rows / (time.perf_counter() - start_time)
+
+
+def measure_search(collection, level, n_searches, rng):
+    """以指定等級執行單向量搜尋，回傳延遲分位數 (ms)"""
+    latencies = []
+    for _ in range(n_searches):
+        began = time.perf_counter()
+        collection.search(
+            data=[rng.random(DIM, dtype=np.float32).tolist()], anns_field="vector",
+            param=SEARCH_PARAMS, limit=10, consistency_level=level,
+        )
+        latencies.append((time.perf_counter() - began) * 1000)
+    return percentiles(latencies)
+
+
+def measure_visibility(writer, reader, level, n_probes, rng, first_id):
+    """寫入一筆後輪詢 reader 直到查得，回傳 (延遲分位數 ms, 逾時次數)"""
+    latencies = []
+    timeouts = 0
+    for probe in range(n_probes):
+        pk = first_id + probe
+        writer.insert([[pk], rng.random((1, DIM), dtype=np.float32), [int(time.time())]])
+        began = time.perf_counter()
+        while True:
+            if reader.query(expr=f"id == {pk}", output_fields=["id"], consistency_level=level):
+                latencies.append((time.perf_counter() - began) * 1000)
+                break
+            if time.perf_counter() - began > VISIBILITY_TIMEOUT_SECONDS:
+                timeouts += 1
+                break
+            time.sleep(VISIBILITY_POLL_SECONDS)
+    return (percentiles(latencies) if latencies else None), timeouts
+
+
+def run_level(level, args, rng):
+    """測量單一一致性等級"""
+    collection = create_bench_collection(level)
+    reader = Collection(collection.name, using=READER_ALIAS)
+    try:
+        result = {"level": level}
+        result["ingest_rows_per_s"] = measure_ingest(collection, args.rows, args.batch_size, rng)
+        if args.with_flush:
+            result["ingest_flush_rows_per_s"] = measure_ingest(
+                collection, args.rows, args.batch_size, rng, first_id=args.rows, flush=True
+            )
+        result["search_ms"] = measure_search(collection, level, args.searches, rng)
+
+        probe_base = 10 * args.rows
+        result["visibility_ms"], result["visibility_timeouts"] = measure_visibility(
+            collection, reader, level, args.probes, rng, probe_base
+        )
+        # Session 只保證同一連線讀到自己的寫入，另測同連線
+        result["same_client_visibility_ms"], _ = measure_visibility(
+            collection, collection, level, args.probes, rng, probe_base + args.probes
+        )
+        return result
+    finally:
+        collection.release()
+        utility.drop_collection(collection.name)
+
+
+def print_result(result):
+    """顯示單一等級的測量結果"""
+    print(f"\n[{result['level']}]")
+    line = f"  寫入: {result['ingest_rows_per_s']:.0f} 筆/秒"
+    if "ingest_flush_rows_per_s" in result:
+        line += f" (每批 flush: {result['ingest_flush_rows_per_s']:.0f} 筆/秒)"
+    print(line)
+    search = result["search_ms"]
+    print(f"  搜尋: p50 {search['p50']:.2f} / p95 {search['p95']:.2f} / p99 {search['p99']:.2f} ms")
+    for label, key in (("可見 (其他連線)", "visibility_ms"), ("可見 (同一連線)", "same_client_visibility_ms")):
+        stats = result[key]
+        if stats is None:
+            print(f"  {label}: 逾時")
+        else:
+            print(f"  {label}: p50 {stats['p50']:.1f} / p95 {stats['p95']:.1f} / p99 {stats['p99']:.1f} ms")
+    if result["visibility_timeouts"]:
+        print(f"  ⚠️ {result['visibility_timeouts']} 次超過 {VISIBILITY_TIMEOUT_SECONDS}s 仍不可見")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Milvus 一致性等級測量")
+    parser.add_argument("--levels", nargs="*", default=list(CONSISTENCY_LEVELS), choices=CONSISTENCY_LEVELS)
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--searches", type=int, default=DEFAULT_SEARCHES)
+    parser.add_argument("--probes", type=int, default=DEFAULT_PROBES)
+    parser.add_argument("--with-flush", action="store_true", help="另測每批寫入後 flush 的吞吐量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not connect_to_milvus() or not connect_to_milvus(alias=READER_ALIAS):
+        sys.exit(1)
+
+    rng = np.random.default_rng(args.seed)
+    try:
+        for level in args.levels:
+            print_result(run_level(level, args, rng))
+    except Exception as e:
+        print(f"❌ 測量失敗: {e}")
+        sys.exit(1)
+    finally:
+        connections.disconnect(READER_ALIAS)
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
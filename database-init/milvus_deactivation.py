@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+下架商品同步與搜尋排除
+原本的流程在 Milvus 搜尋後才以 PostgreSQL `status = 'active'` 過濾，下架商品仍佔用 top-k 名額，
+結果筆數不足。本模組:
+  - sync: 依商品狀態將 inactive 商品以大批次 `in` 表達式從 product_vectors、product_similarity、
+    recommendations 刪除；out_of_stock 商品保留向量但記為 tombstone (補貨後恢復)
+  - ExclusionBitset: 以 product_id 為索引的程序內位元表，在刪除尚未 compaction 前 (或 tombstone 期間)
+    從搜尋結果排除，search_live 視需要加大 limit，讓每個查詢都回傳完整 k 筆有效商品
+
+狀態檔 (.npz) 記錄 tombstone 與待確認刪除的 product_id；待確認刪除在 Strong 查詢已看不到，
+且 milvus_maintenance.py 紀錄檔中有晚於刪除時間的 product_vectors compaction 後才移出排除表
+
+商品狀態來源為 JSON (與 milvus_recommend_service.py --products-json 相同格式)，例如:
+    psql -At -c "SELECT json_agg(json_build_object('product_id', product_id, 'status', status)) FROM products"
+
+用法:
+    python3 milvus_deactivation.py sync --products-json products.json --state exclusions.npz
+    python3 milvus_deactivation.py sync --delete-ids 12 13 14 --state exclusions.npz
+    python3 milvus_deactivation.py confirm --state exclusions.npz --maintenance-history milvus_maintenance.jsonl
+    python3 milvus_deactivation.py bench   # 本地引擎比較搜尋後過濾與排除表
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from milvus_common import collection_search_params, prepare_vectors
+
+# 刪除設定
+DELETE_BATCH_SIZE = 4096  # 每個刪除表達式的 product_id 數
+CONFIRM_BATCH_SIZE = 4096
+MAX_SEARCH_LIMIT = 16384  # Milvus topk 上限
+
+# 各集合的刪除表達式
+DELETE_EXPRESSIONS = {
+    "product_vectors": "product_id in {ids}",
+    "product_similarity": "product_id_1 in {ids} or product_id_2 in {ids}",
+    "recommendations": "product_id in {ids}",
+}
+
+DELETED_STATUSES = ("inactive",)
+TOMBSTONED_STATUSES = ("out_of_stock",)
+
+
+class ExclusionBitset:
+    """以 product_id 為索引的排除位元表，查詢為向量化的陣列索引"""
+
+    def __init__(self, ids=()):
+        self._bits = np.zeros(0, dtype=bool)
+        self._size = 0
+        self.add(ids)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if not len(ids):
+            return
+        if ids.max() >= len(self._bits):
+            bits = np.zeros(max(int(ids.max()) + 1, 2 * len(self._bits)), dtype=bool)
+            bits[:len(self._bits)] = self._bits
+            self._bits = bits
+        self._bits[ids] = True
+        self._size = int(np.count_nonzero(self._bits))
+
+    def discard(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        ids = ids[(ids >= 0) & (ids < len(self._bits))]
+        self._bits[ids] = False
+        self._size = int(np.count_nonzero(self._bits))
+
+    def contains(self, ids):
+        """回傳布林遮罩"""
+        ids = np.asarray(ids, dtype=np.int64)
+        mask = np.zeros(ids.shape, dtype=bool)
+        inside = (ids >= 0) & (ids < len(self._bits))
+        mask[inside] = self._bits[ids[inside]]
+        return mask
+
+    def ids(self):
+        return np.flatnonzero(self._bits)
+
+
+class ExclusionState:
+    """tombstone 與待確認刪除的 product_id，保存為 .npz"""
+
+    def __init__(self, tombstoned=(), pending_ids=(), pending_at=()):
+        self.tombstoned = np.unique(np.asarray(tombstoned, dtype=np.int64))
+        self.pending_ids = np.asarray(pending_ids, dtype=np.int64)
+        self.pending_at = np.asarray(pending_at, dtype=np.int64)
+
+    def bitset(self):
+        return ExclusionBitset(np.concatenate([self.tombstoned, self.pending_ids]))
+
+    def add_pending(self, ids, deleted_at):
+        ids = np.setdiff1d(np.asarray(ids, dtype=np.int64), self.pending_ids)
+        self.pending_ids = np.concatenate([self.pending_ids, ids])
+        self.pending_at = np.concatenate([self.pending_at, np.full(len(ids), deleted_at, dtype=np.int64)])
+
+    def release_pending(self, ids):
+        keep = ~np.isin(self.pending_ids, ids)
+        self.pending_ids, self.pending_at = self.pending_ids[keep], self.pending_at[keep]
+
+    def save(self, path):
+        """先寫暫存檔再取代，服務端重新載入時不會讀到寫到一半的檔案"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, tombstoned=self.tombstoned, pending_ids=self.pending_ids, pending_at=self.pending_at)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            return cls(data["tombstoned"], data["pending_ids"], data["pending_at"])
+
+
+def chunked(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def search_live(collection, data, limit, exclusions, anns_field="embedding", param=None,
+                expr=None, output_fields=None):
+    """搜尋並排除位元表中的商品；先多取排除表大小 (最多 limit) 的筆數，
+    仍不足 limit 且結果被排除項目截斷的查詢，加倍 limit 重新搜尋"""
+    param = param or collection_search_params(collection.name)
+    results = [None] * len(data)
+    pending = list(range(len(data)))
+    fetch = limit + min(len(exclusions), limit)
+    while pending:
+        fetch = min(fetch, MAX_SEARCH_LIMIT)
+        batch = collection.search(data=[data[i] for i in pending], anns_field=anns_field, param=param,
+                                  limit=fetch, expr=expr, output_fields=output_fields or [])
+        retry = []
+        for i, hits in zip(pending, batch):
+            hits = list(hits)
+            excluded = exclusions.contains([hit.id for hit in hits])
+            live = [hit for hit, skip in zip(hits, excluded) if not skip]
+            results[i] = live[:limit]
+            if len(live) < limit and len(hits) == fetch and fetch < MAX_SEARCH_LIMIT:
+                retry.append(i)
+        pending = retry
+        fetch *= 2
+    return results
+
+
+# ==============================================
+# 同步
+# ==============================================
+
+def load_statuses(path):
+    """讀取 [{product_id, status}, ...]，回傳 {status: product_id 陣列}"""
+    with open(path, encoding="utf-8") as f:
+        products = json.load(f)
+    by_status = {}
+    for product in products:
+        by_status.setdefault(product.get("status", "active"), []).append(int(product["product_id"]))
+    return {status: np.unique(np.array(ids, dtype=np.int64)) for status, ids in by_status.items()}
+
+
+def propagate_deletes(collections, product_ids, batch_size=DELETE_BATCH_SIZE):
+    """以每批 batch_size 個 product_id 的表達式刪除各集合資料，回傳各集合統計"""
+    stats = {}
+    for name, collection in collections.items():
+        started = time.time()
+        deleted, batches = 0, 0
+        for ids in chunked(product_ids.tolist(), batch_size):
+            result = collection.delete(DELETE_EXPRESSIONS[name].format(ids=ids))
+            deleted += result.delete_count
+            batches += 1
+        stats[name] = {"batches": batches, "deleted": deleted, "seconds": time.time() - started}
+    return stats
+
+
+def last_compaction(history_file, collection_name="product_vectors"):
+    """milvus_maintenance.py 紀錄檔中該集合最近一次 compaction 的時間 (無紀錄回傳 None)"""
+    if not history_file or not os.path.exists(history_file):
+        return None
+    latest = None
+    with open(history_file, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("collection") == collection_name and record.get("compacted"):
+                latest = max(latest or 0, record["timestamp"])
+    return latest
+
+
+def confirm_deletes(collection, state, history_file=None):
+    """移出已不可見 (Strong 查詢) 且之後已 compaction 的待確認刪除，回傳移出筆數"""
+    candidates = state.pending_ids
+    if history_file:
+        compacted_at = last_compaction(history_file, collection.name)
+        if compacted_at is None:
+            return 0
+        candidates = candidates[state.pending_at < compacted_at]
+
+    visible = []
+    for ids in chunked(candidates.tolist(), CONFIRM_BATCH_SIZE):
+        rows = collection.query(expr=f"product_id in {ids}", output_fields=["product_id"],
+                                consistency_level="Strong")
+        visible.extend(row["product_id"] for row in rows)
+    released = np.setdiff1d(candidates, visible)
+    state.release_pending(released)
+    return len(released)
+
+
+def sync_statuses(collections, state, by_status, batch_size=DELETE_BATCH_SIZE, full_export=True):
+    """依商品狀態刪除 / tombstone，回傳刪除統計
+
+    full_export 為 False 時 by_status 只是部分狀態 (例如 --delete-ids)，保留既有 tombstone，僅移除被刪除的商品
+    """
+    deleted_ids = np.concatenate([by_status.get(s, np.zeros(0, np.int64)) for s in DELETED_STATUSES])
+    tombstoned = np.concatenate([by_status.get(s, np.zeros(0, np.int64)) for s in TOMBSTONED_STATUSES])
+    active = by_status.get("active", np.zeros(0, np.int64))
+
+    restored = np.intersect1d(state.tombstoned, active)
+    if len(restored):
+        print(f"♻️ {len(restored)} 個 tombstone 商品恢復上架")
+    reactivated = np.intersect1d(state.pending_ids, active)
+    if len(reactivated):
+        print(f"⚠️ {len(reactivated)} 個已刪除向量的商品重新上架，需重新產生向量寫入")
+    if full_export:
+        state.tombstoned = np.setdiff1d(tombstoned, deleted_ids)
+    else:
+        state.tombstoned = np.setdiff1d(np.union1d(state.tombstoned, tombstoned), np.union1d(deleted_ids, restored))
+    state.release_pending(reactivated)
+
+    # 已刪除過的商品不重複刪除
+    new_ids = np.setdiff1d(deleted_ids, state.pending_ids)
+    stats = propagate_deletes(collections, new_ids, batch_size) if len(new_ids) else {}
+    state.add_pending(new_ids, int(time.time()))
+    return stats
+
+
+def print_state(state):
+    print(f"📊 排除表: tombstone {len(state.tombstoned)} 筆, 待確認刪除 {len(state.pending_ids)} 筆")
+
+
+# ==============================================
+# 本地測量
+# ==============================================
+
+def run_benchmark(n_products, inactive_share, n_queries, limit, seed=0):
+    """本地引擎: 搜尋後才過濾 (原流程) vs 排除位元表 + 加大 limit"""
+    from pymilvus import CollectionSchema, DataType, FieldSchema
+    from milvus_local_engine import LocalMilvus
+
+    rng = np.random.default_rng(seed)
+    dim = 128
+    vectors = prepare_vectors("product_vectors", rng.random((n_products, dim), dtype=np.float32))
+    product_ids = np.arange(1, n_products + 1)
+    # 下架商品集中在熱門區域 (靠近查詢分布)，最能反映結果不足的情況
+    queries = prepare_vectors("product_vectors", rng.random((n_queries, dim), dtype=np.float32))
+    popularity = vectors @ queries.mean(axis=0)
+    n_inactive = int(n_products * inactive_share)
+    inactive = product_ids[np.argsort(-popularity)[:n_inactive * 2]]
+    inactive = rng.choice(inactive, n_inactive, replace=False)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = LocalMilvus(data_dir)
+        collection = client.collection("product_vectors", CollectionSchema(fields=[
+            FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        ]))
+        collection.insert([product_ids, vectors])
+        collection.create_index("embedding", {"index_type": "FLAT", "metric_type": "IP"})
+        collection.load()
+        data = queries.tolist()
+        inactive_set = set(inactive.tolist())
+
+        started = time.perf_counter()
+        post_filtered = [[hit.id for hit in hits if hit.id not in inactive_set]
+                         for hits in collection.search(data=data, anns_field="embedding",
+                                                       param=collection_search_params("product_vectors"),
+                                                       limit=limit)]
+        post_ms = (time.perf_counter() - started) * 1000
+
+        exclusions = ExclusionBitset(inactive)
+        started = time.perf_counter()
+        live = search_live(collection, data, limit, exclusions)
+        live_ms = (time.perf_counter() - started) * 1000
+        leaked = sum(hit.id in inactive_set for hits in live for hit in hits)
+
+        started = time.perf_counter()
+        stats = propagate_deletes({"product_vectors": collection}, np.sort(inactive))
+        client.close()
+
+    print(f"{n_products} 筆商品, {n_inactive} 筆下架 ({inactive_share:.0%}, 集中於熱門區域), "
+          f"{n_queries} 個查詢 top-{limit}")
+    print(f"搜尋後過濾: 平均 {np.mean([len(r) for r in post_filtered]):.2f} 筆, "
+          f"不足 {limit} 筆的查詢 {np.mean([len(r) < limit for r in post_filtered]):.1%}, {post_ms:.1f} ms")
+    print(f"排除位元表: 平均 {np.mean([len(r) for r in live]):.2f} 筆, "
+          f"不足 {limit} 筆的查詢 {np.mean([len(r) < limit for r in live]):.1%}, "
+          f"含下架商品 {leaked} 筆, {live_ms:.1f} ms")
+    item = stats["product_vectors"]
+    print(f"批次刪除: {item['deleted']} 筆 / {item['batches']} 個表達式, {item['seconds'] * 1000:.1f} ms")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="下架商品刪除同步與搜尋排除表")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="依商品狀態刪除 / tombstone 並更新狀態檔")
+    source = sync_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--products-json", help="[{product_id, status}, ...]")
+    source.add_argument("--delete-ids", type=int, nargs="+", help="直接刪除指定 product_id")
+    sync_parser.add_argument("--state", required=True)
+    sync_parser.add_argument("--batch-size", type=int, default=DELETE_BATCH_SIZE)
+
+    confirm_parser = subparsers.add_parser("confirm", help="移出已完成刪除的 product_id")
+    confirm_parser.add_argument("--state", required=True)
+    confirm_parser.add_argument("--maintenance-history", help="milvus_maintenance.py 紀錄檔，省略則只確認不可見")
+
+    bench_parser = subparsers.add_parser("bench", help="以本地引擎測量")
+    bench_parser.add_argument("--products", type=int, default=50_000)
+    bench_parser.add_argument("--inactive-share", type=float, default=0.05)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_benchmark(args.products, args.inactive_share, args.queries, args.limit)
+        return
+
+    from pymilvus import Collection, connections, utility
+    from milvus_common import connect_to_milvus
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        state = ExclusionState.load(args.state)
+        if args.command == "sync":
+            collections = {name: Collection(name) for name in DELETE_EXPRESSIONS if utility.has_collection(name)}
+            if args.products_json:
+                by_status = load_statuses(args.products_json)
+            else:
+                by_status = {"inactive": np.unique(np.array(args.delete_ids, dtype=np.int64))}
+            stats = sync_statuses(collections, state, by_status, args.batch_size,
+                                  full_export=bool(args.products_json))
+            for name, item in stats.items():
+                print(f"🗑️ {name}: 刪除 {item['deleted']} 筆 ({item['batches']} 個表達式, {item['seconds']:.1f}s)")
+        else:
+            released = confirm_deletes(Collection("product_vectors"), state, args.maintenance_history)
+            print(f"✅ {released} 筆刪除已確認，移出排除表")
+        state.save(args.state)
+        print_state(state)
+    except Exception as e:
+        print(f"❌ 同步失敗: {e}")
+        sys.exit(1)
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+入庫時的近重複商品偵測
+每個寫入 product_vectors 的批次先以一次 nq = 批次筆數的 range search 比對既有資料，再以分塊精確距離檢查批次內部，
+距離門檻內的資料列合併為重複群組，可選擇略過 (merge) 或加上 duplicate_of 動態欄位 (flag) 後寫入
+
+用法:
+    python3 milvus_dedup.py  # 以本地引擎測量去重入庫吞吐量，並與不去重的直接寫入比較
+"""
+
+import tempfile
+import time
+
+import numpy as np
+
+from milvus_columnar import ColumnBatch, insert_batch
+from milvus_common import NORMALIZED_METRICS, collection_search_params, metric_type, normalize_vectors
+from milvus_local_engine import pairwise_distances
+from milvus_range_search import range_search
+
+# 去重設定
+DEFAULT_DISTANCE_THRESHOLD = 1.0  # L2 平方距離 (未正規化向量)
+NORMALIZED_DISTANCE_THRESHOLD = 0.01  # 正規化向量的 L2 平方距離 (cosine ≥ 0.995)
+DEFAULT_BLOCK_SIZE = 2048
+DUPLICATE_FIELD = "duplicate_of"
+EXISTING_CHECK_MAX_NQ = 16384  # Milvus 單次搜尋的 nq 上限；批次不超過此筆數時既有資料比對只需一次搜尋
+
+
+def intra_batch_pairs(embeddings, distance_threshold, block_size=DEFAULT_BLOCK_SIZE):
+    """批次內距離小於門檻的 (i, j) 配對 (i < j)，只計算上三角區塊"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    pairs_i, pairs_j = [], []
+    for start in range(0, len(embeddings), block_size):
+        block = embeddings[start:start + block_size]
+        distances = pairwise_distances(block, embeddings[start:], "L2")
+        i, j = np.nonzero(distances < distance_threshold)
+        upper = j > i
+        pairs_i.append(i[upper] + start)
+        pairs_j.append(j[upper] + start)
+    if not pairs_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def connected_components(n_nodes, pairs_i, pairs_j):
+    """以最小標籤傳遞 + 指標跳躍求連通元件，回傳每個節點的元件標籤 (元件內最小節點)"""
+    labels = np.arange(n_nodes)
+    if not len(pairs_i):
+        return labels
+    while True:
+        low = np.minimum(labels[pairs_i], labels[pairs_j])
+        updated = labels.copy()
+        np.minimum.at(updated, pairs_i, low)
+        np.minimum.at(updated, pairs_j, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+class DuplicateDetector:
+    """比對既有資料與批次內部，產生重複群組並在寫入前處理"""
+
+    def __init__(self, collection, distance_threshold=None, id_field="product_id",
+                 anns_field="embedding", search_params=None, block_size=DEFAULT_BLOCK_SIZE):
+        self.collection = collection
+        self.search_params = search_params or collection_search_params(collection.name)
+        # IP / COSINE 集合以正規化後的向量比較，門檻仍以 L2 平方距離表示
+        self.normalized = self.search_params["metric_type"] in NORMALIZED_METRICS
+        if distance_threshold is None:
+            distance_threshold = NORMALIZED_DISTANCE_THRESHOLD if self.normalized else DEFAULT_DISTANCE_THRESHOLD
+        self.distance_threshold = distance_threshold
+        self.id_field = id_field
+        self.anns_field = anns_field
+        self.block_size = block_size
+        self.insert_fields = [f.name for f in collection.schema.fields if not (f.is_primary and f.auto_id)]
+        self.totals = {"batches": 0, "rows": 0, "inserted": 0, "duplicates": 0, "clusters": 0,
+                       "existing_check_s": 0.0, "intra_check_s": 0.0, "elapsed_s": 0.0}
+
+    def find_duplicates(self, ids, embeddings):
+        """回傳 {"keep": 布林遮罩, "duplicate_of": 每列的代表 ID 或 None, "clusters": 重複群組, "timings": 各階段秒數}
+
+        與既有資料重複的列以既有 ID 為代表；僅批次內重複者以群組中第一列為代表
+        """
+        ids = ids.tolist() if isinstance(ids, np.ndarray) else list(ids)
+        if self.normalized:
+            embeddings = normalize_vectors(embeddings)
+            radius = 1 - self.distance_threshold / 2  # 單位向量: ||a - b||² = 2 - 2 a·b
+        else:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            radius = self.distance_threshold
+        n_rows = len(ids)
+
+        # 既有資料: 整個批次一次 nq > 1 range search，每列取最近兩筆以排除同 ID (重新寫入) 的情況
+        stage = time.perf_counter()
+        virtual_index = {}
+        existing_of = np.full(n_rows, -1, dtype=np.int64)
+        for row, hits in enumerate(range_search(
+            self.collection, embeddings, radius, max_neighbors=2,
+            batch_size=min(max(n_rows, 1), EXISTING_CHECK_MAX_NQ),
+            anns_field=self.anns_field, search_params=self.search_params,
+        )):
+            for hit in hits:
+                if hit.id != ids[row]:
+                    existing_of[row] = virtual_index.setdefault(hit.id, len(virtual_index))
+                    break
+        existing_ids = list(virtual_index)
+        existing_check_s = time.perf_counter() - stage
+
+        # 既有 ID 以虛擬節點表示，與批次內配對一起求連通元件
+        stage = time.perf_counter()
+        pairs_i, pairs_j = intra_batch_pairs(embeddings, self.distance_threshold, self.block_size)
+        matched = np.flatnonzero(existing_of >= 0)
+        labels = connected_components(
+            n_rows + len(existing_ids),
+            np.concatenate([pairs_i, matched]),
+            np.concatenate([pairs_j, n_rows + existing_of[matched]]),
+        )
+
+        # 只處理成員數 ≥ 2 的元件，依標籤排序後切成群組
+        nodes = np.flatnonzero(np.bincount(labels, minlength=len(labels))[labels] >= 2)
+        nodes = nodes[np.argsort(labels[nodes], kind="stable")]
+        groups = np.split(nodes, np.flatnonzero(np.diff(labels[nodes])) + 1) if len(nodes) else []
+
+        keep = np.ones(n_rows, dtype=bool)
+        duplicate_of = [None] * n_rows
+        clusters = []
+        for group in groups:
+            members = group[group < n_rows]
+            virtual = group[group >= n_rows] - n_rows
+            if len(virtual):
+                canonical, duplicates = existing_ids[virtual[0]], members
+            else:
+                canonical, duplicates = ids[members[0]], members[1:]
+            keep[duplicates] = False
+            for row in duplicates:
+                duplicate_of[row] = canonical
+            clusters.append({
+                "canonical": canonical,
+                "existing": bool(len(virtual)),
+                "members": [ids[row] for row in members],
+            })
+        timings = {"existing_check_s": existing_check_s, "intra_check_s": time.perf_counter() - stage}
+        return {"keep": keep, "duplicate_of": duplicate_of, "clusters": clusters, "timings": timings}
+
+    def ingest(self, data, on_duplicate="merge"):
+        """寫入一個批次 (欄位順序同 collection.insert 或 ColumnBatch)，回傳重複偵測結果
+
+        merge: 只寫入每個群組的代表列；flag: 全部寫入，重複列加上 duplicate_of 動態欄位
+        """
+        if on_duplicate not in ("merge", "flag"):
+            raise ValueError(f"不支援的重複處理方式: {on_duplicate}")
+        start_time = time.time()
+        batch = data if isinstance(data, ColumnBatch) else ColumnBatch(self.collection.schema.fields, data)
+        result = self.find_duplicates(batch.columns[self.id_field], batch.columns[self.anns_field])
+        keep = result["keep"]
+
+        if on_duplicate == "merge":
+            rows = np.flatnonzero(keep)
+            inserted = len(rows)
+            if inserted:
+                insert_batch(self.collection, batch.take(rows))
+        else:
+            # 動態欄位需逐列寫入
+            columns = dict(zip(self.insert_fields, batch.prepared(self.collection.name).to_lists()))
+            insert_data = []
+            for row, duplicate_of in enumerate(result["duplicate_of"]):
+                record = {name: columns[name][row] for name in self.insert_fields}
+                if duplicate_of is not None:
+                    record[DUPLICATE_FIELD] = duplicate_of
+                insert_data.append(record)
+            inserted = len(insert_data)
+            if inserted:
+                self.collection.insert(insert_data)
+
+        elapsed = time.time() - start_time
+        self.totals["batches"] += 1
+        self.totals["rows"] += len(keep)
+        self.totals["inserted"] += inserted
+        self.totals["duplicates"] += int((~keep).sum())
+        self.totals["clusters"] += len(result["clusters"])
+        self.totals["elapsed_s"] += elapsed
+        for name, seconds in result["timings"].items():
+            self.totals[name] += seconds
+        return result
+
+    def report(self):
+        """顯示累計的去重統計"""
+        totals = self.totals
+        print(f"去重入庫: {totals['batches']} 批, {totals['rows']} 筆, 寫入 {totals['inserted']} 筆, "
+              f"重複 {totals['duplicates']} 筆 / {totals['clusters']} 群, "
+              f"{totals['rows'] / max(totals['elapsed_s'], 1e-9):.0f} 筆/秒")
+        print(f"  既有資料比對 {totals['existing_check_s']:.2f}s "
+              f"({totals['rows'] / max(totals['existing_check_s'], 1e-9):.0f} 筆/秒), "
+              f"批次內比對與分群 {totals['intra_check_s']:.2f}s "
+              f"({totals['rows'] / max(totals['intra_check_s'], 1e-9):.0f} 筆/秒)")
+
+
+def print_clusters(result, limit=5):
+    """顯示重複群組"""
+    for cluster in result["clusters"][:limit]:
+        source = "既有" if cluster["existing"] else "批次內"
+        print(f"  - 代表 {cluster['canonical']} ({source}): {cluster['members']}")
+    if len(result["clusters"]) > limit:
+        print(f"  ... 另有 {len(result['clusters']) - limit} 群")
+
+
+def main():
+    """以本地引擎測量去重入庫吞吐量 (含 2% 既有重複與 2% 批次內重複)，並以相同批次測量不去重的直接寫入"""
+    from pymilvus import CollectionSchema, DataType, FieldSchema
+    from milvus_local_engine import LocalMilvus
+
+    dim, n_batches, batch_size = 512, 10, 5000
+    rng = np.random.default_rng(0)
+    schema = CollectionSchema(fields=[
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+    ], enable_dynamic_field=True)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = LocalMilvus(data_dir)
+        collection = client.collection("product_vectors", schema)
+        collection.create_index("embedding", {"index_type": "FLAT", "metric_type": metric_type(collection.name)})
+        collection.load()
+        detector = DuplicateDetector(collection)
+
+        existing = np.empty((0, dim), dtype=np.float32)
+        next_id = 1
+        batches = []
+        for batch in range(n_batches):
+            embeddings = rng.random((batch_size, dim), dtype=np.float32)
+            n_dup = batch_size // 50
+            if len(existing):
+                embeddings[:n_dup] = existing[rng.integers(0, len(existing), n_dup)] + 0.01
+            embeddings[n_dup:2 * n_dup] = embeddings[-n_dup:] + 0.01
+            ids = list(range(next_id, next_id + batch_size))
+            next_id += batch_size
+
+            data = [ids, embeddings, rng.integers(1, 11, batch_size).tolist()]
+            batches.append(data)
+            result = detector.ingest(data)
+            existing = np.concatenate([existing, embeddings[result["keep"]]])
+            if batch == 1:
+                print_clusters(result)
+
+        detector.report()
+
+        plain = client.collection("product_vectors_plain", schema)
+        plain.create_index("embedding", {"index_type": "FLAT", "metric_type": metric_type(collection.name)})
+        plain.load()
+        started = time.perf_counter()
+        for data in batches:
+            insert_batch(plain, ColumnBatch(schema.fields, data))
+        plain_s = time.perf_counter() - started
+        print(f"直接寫入 (不去重): {len(batches)} 批, {n_batches * batch_size} 筆, "
+              f"{n_batches * batch_size / plain_s:.0f} 筆/秒 → 去重入庫為 "
+              f"{detector.totals['rows'] / detector.totals['elapsed_s'] / (n_batches * batch_size / plain_s):.1%}")
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+稠密向量 + 稀疏關鍵字混合檢索
+Milvus 2.3 尚無稀疏向量欄位，因此以本地 BM25 倒排索引處理商品名稱，
+與 embedding 欄位的向量搜尋結果在同一次呼叫中以 RRF 或加權分數融合，並回報各階段延遲
+"""
+
+import re
+import time
+
+import numpy as np
+
+from milvus_common import collection_search_params, prepare_vectors
+from milvus_local_engine import FilterExpression
+
+# BM25 參數
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 融合設定
+DEFAULT_RRF_K = 60
+DEFAULT_OVERSAMPLE = 3
+DEFAULT_DENSE_WEIGHT = 0.5
+
+CJK_CHARS = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+TOKEN_PATTERN = re.compile(rf"[a-z0-9]+(?:[-_.'][a-z0-9]+)*|[{CJK_CHARS}]+")
+CJK_PATTERN = re.compile(rf"[{CJK_CHARS}]")
+
+
+def tokenize(text):
+    """詞彙切分: 英數詞保留完整型號 (wh-1000xm5) 與其組成部分，CJK 取單字與雙字"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if CJK_PATTERN.match(token):
+            terms.extend(token)
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token)
+            parts = re.split(r"[-_.']", token)
+            if len(parts) > 1:
+                terms.extend(parts)
+                terms.append("".join(parts))
+    return terms
+
+
+class BM25Index:
+    """以 CSR 形式儲存倒排表的 BM25 索引"""
+
+    def __init__(self, doc_ids, texts, metadata=None, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = np.asarray(doc_ids)
+        self.metadata = {}
+        for name, values in (metadata or {}).items():
+            values = np.asarray(values)
+            self.metadata[name] = values.astype(object) if values.dtype.kind == "U" else values
+
+        vocabulary = {}
+        term_ids = []
+        doc_index = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_lengths[i] = len(terms)
+            for term in terms:
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_index.append(i)
+
+        self.vocabulary = vocabulary
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = float(doc_lengths.mean()) if len(texts) else 0.0
+
+        # 合併同一 (詞, 文件) 的詞頻並依詞排序成 CSR
+        keys = np.asarray(term_ids, dtype=np.int64) * len(texts) + np.asarray(doc_index, dtype=np.int64)
+        keys, tf = np.unique(keys, return_counts=True)
+        posting_terms = keys // max(len(texts), 1)
+        self._posting_docs = (keys % max(len(texts), 1)).astype(np.int64)
+        self._posting_tf = tf.astype(np.float32)
+        self._offsets = np.searchsorted(posting_terms, np.arange(len(vocabulary) + 1))
+
+        document_frequency = np.diff(self._offsets)
+        n_docs = len(texts)
+        self._idf = np.log(1 + (n_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+    @classmethod
+    def from_collection(cls, collection, id_field, text_field, metadata_fields=(), batch_size=10_000):
+        """以分頁迭代器讀取集合的文字欄位建立索引"""
+        doc_ids, texts = [], []
+        metadata = {name: [] for name in metadata_fields}
+        iterator = collection.query_iterator(
+            batch_size=batch_size, output_fields=[text_field, *metadata_fields]
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            for row in rows:
+                doc_ids.append(row[id_field])
+                texts.append(row[text_field])
+                for name in metadata_fields:
+                    metadata[name].append(row[name])
+        iterator.close()
+        return cls(doc_ids, texts, metadata)
+
+    def _column(self, name):
+        if name not in self.metadata:
+            raise ValueError(f"BM25 索引未保存欄位 {name}")
+        return self.metadata[name]
+
+    def search(self, query, limit, expr=None):
+        """回傳 (文件 ID, BM25 分數)，依分數由高到低"""
+        term_ids = [self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary]
+        if not term_ids:
+            return np.empty(0, dtype=self.doc_ids.dtype), np.empty(0, dtype=np.float32)
+
+        slices = [slice(self._offsets[t], self._offsets[t + 1]) for t in term_ids]
+        docs = np.concatenate([self._posting_docs[s] for s in slices])
+        tf = np.concatenate([self._posting_tf[s] for s in slices])
+        idf = np.concatenate([np.full(s.stop - s.start, self._idf[t], dtype=np.float32)
+                              for s, t in zip(slices, term_ids)])
+
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+        scores = np.bincount(docs, weights=idf * tf * (self.k1 + 1) / (tf + norm),
+                             minlength=len(self.doc_ids))
+
+        candidates = np.flatnonzero(scores > 0)
+        if expr:
+            candidates = candidates[FilterExpression(expr).evaluate(self._column)[candidates]]
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return self.doc_ids[candidates], scores[candidates].astype(np.float32)
+
+
+def reciprocal_rank_fusion(ranked_lists, k=DEFAULT_RRF_K):
+    """RRF: score = Σ 1 / (k + rank)"""
+    scores = {}
+    for ids in ranked_lists:
+        for rank, doc_id in enumerate(ids, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def min_max(values):
+    values = np.asarray(values, dtype=np.float32)
+    if not len(values):
+        return values
+    span = values.max() - values.min()
+    return (values - values.min()) / span if span > 0 else np.ones_like(values)
+
+
+def weighted_fusion(dense_ids, dense_scores, sparse_ids, sparse_scores, dense_weight):
+    """各自 min-max 正規化 (越大越好) 後加權相加"""
+    scores = {}
+    for doc_id, score in zip(dense_ids, min_max(dense_scores)):
+        scores[doc_id] = scores.get(doc_id, 0.0) + dense_weight * float(score)
+    for doc_id, score in zip(sparse_ids, min_max(sparse_scores)):
+        scores[doc_id] = scores.get(doc_id, 0.0) + (1 - dense_weight) * float(score)
+    return scores
+
+
+class HybridSearcher:
+    """對同一集合同時進行向量搜尋與 BM25 搜尋並融合結果"""
+
+    def __init__(self, collection, bm25_index, featurizer, id_field="id", anns_field="embedding",
+                 search_params=None):
+        self.collection = collection
+        self.id_field = id_field
+        self.bm25_index = bm25_index
+        self.featurizer = featurizer
+        self.anns_field = anns_field
+        self.search_params = search_params or collection_search_params(collection.name)
+
+    def search(self, query_text, limit=10, expr=None, output_fields=None, fusion="rrf",
+               dense_weight=DEFAULT_DENSE_WEIGHT, rrf_k=DEFAULT_RRF_K, oversample=DEFAULT_OVERSAMPLE):
+        """回傳 (結果清單, 各階段延遲 ms)"""
+        timings = {}
+        started = time.perf_counter()
+        candidates = limit * oversample
+
+        stage = time.perf_counter()
+        query_vector = prepare_vectors(self.collection.name, self.featurizer.transform([query_text]))[0]
+        timings["embed_ms"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        dense_hits = self.collection.search(
+            data=[query_vector.tolist()], anns_field=self.anns_field, param=self.search_params,
+            limit=candidates, expr=expr, output_fields=output_fields or [],
+        )[0]
+        timings["dense_ms"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        sparse_ids, sparse_scores = self.bm25_index.search(query_text, candidates, expr=expr)
+        timings["sparse_ms"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        dense_ids = [hit.id for hit in dense_hits]
+        entities = {hit.id: hit.entity for hit in dense_hits}
+        sparse_ids = sparse_ids.tolist()
+        if fusion == "rrf":
+            fused = reciprocal_rank_fusion([dense_ids, sparse_ids], k=rrf_k)
+        elif fusion == "weighted":
+            # L2 距離越小越好，轉為越大越好再正規化
+            higher_is_better = self.search_params.get("metric_type") in ("IP", "COSINE")
+            dense_scores = [hit.distance if higher_is_better else -hit.distance for hit in dense_hits]
+            fused = weighted_fusion(dense_ids, dense_scores, sparse_ids, sparse_scores, dense_weight)
+        else:
+            raise ValueError(f"不支援的融合方式: {fusion}")
+
+        dense_rank = {doc_id: rank for rank, doc_id in enumerate(dense_ids, start=1)}
+        sparse_rank = {doc_id: rank for rank, doc_id in enumerate(sparse_ids, start=1)}
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+        # 只由 BM25 命中的結果需另外查詢欄位
+        missing = [doc_id for doc_id, _ in ranked if doc_id not in entities]
+        if missing and output_fields:
+            for row in self.collection.query(
+                expr=f"{self.id_field} in {missing}", output_fields=output_fields
+            ):
+                entities[row[self.id_field]] = row
+        results = [
+            {
+                "id": doc_id,
+                "score": score,
+                "dense_rank": dense_rank.get(doc_id),
+                "sparse_rank": sparse_rank.get(doc_id),
+                "entity": entities.get(doc_id),
+            }
+            for doc_id, score in ranked
+        ]
+        timings["fusion_ms"] = (time.perf_counter() - stage) * 1000
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        return results, timings
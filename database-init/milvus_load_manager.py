@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Milvus 集合載入管理
+依 schema、索引類型與資料筆數估算每個集合的記憶體用量，
+以設定的副本數載入集合、非阻塞地輪詢載入進度，
+並在超過記憶體預算時釋放最久未使用的冷集合
+"""
+
+import time
+from collections import OrderedDict
+
+from pymilvus import Collection, DataType, utility
+from pymilvus.client.types import LoadState
+
+# 載入管理設定
+MEMORY_BUDGET_BYTES = 4 * 1024 ** 3  # 查詢節點可用於集合的記憶體 (4 GB)
+DEFAULT_REPLICA_NUMBER = 1
+LOAD_POLL_INTERVAL_SECONDS = 0.5
+LOAD_TIMEOUT_SECONDS = 300
+
+# 估算參數
+VARCHAR_FILL_RATIO = 0.5  # VARCHAR 平均使用 max_length 的比例
+JSON_FIELD_BYTES = 256
+ARRAY_FIELD_BYTES = 64
+LOAD_OVERHEAD_RATIO = 1.2  # segment 中繼資料、主鍵索引等額外開銷
+
+SCALAR_FIELD_BYTES = {
+    DataType.BOOL: 1,
+    DataType.INT8: 1,
+    DataType.INT16: 2,
+    DataType.INT32: 4,
+    DataType.INT64: 8,
+    DataType.FLOAT: 4,
+    DataType.DOUBLE: 8,
+}
+
+
+def vector_bytes_per_row(dim, index_params=None, binary=False):
+    """估算單筆向量在指定索引下的記憶體用量"""
+    if binary:
+        return dim / 8
+
+    index_params = index_params or {}
+    index_type = index_params.get("index_type", "FLAT")
+    params = index_params.get("params", {})
+
+    if index_type == "IVF_SQ8":
+        return dim
+    if index_type == "IVF_PQ":
+        return params.get("m", dim // 4) * params.get("nbits", 8) / 8
+    if index_type == "HNSW":
+        # 原始向量 + 第 0 層 2M 個鄰居 ID
+        return dim * 4 + params.get("M", 16) * 2 * 4
+    if index_type == "DISKANN":
+        # 只有 PQ 壓縮碼常駐記憶體
+        return dim * 4 * 0.25
+    # FLAT、IVF_FLAT 及未建立索引
+    return dim * 4
+
+
+def index_fixed_bytes(dim, index_params=None):
+    """估算與資料筆數無關的索引固定開銷 (例如 IVF 中心點)"""
+    index_params = index_params or {}
+    index_type = index_params.get("index_type", "FLAT")
+    params = index_params.get("params", {})
+
+    if index_type.startswith("IVF_"):
+        return params.get("nlist", 128) * dim * 4
+    return 0
+
+
+def scalar_bytes_per_row(field):
+    """估算單筆純量欄位的記憶體用量"""
+    if field.dtype == DataType.VARCHAR:
+        max_length = field.params.get("max_length", 256)
+        return max_length * VARCHAR_FILL_RATIO + 8  # 加上 offset
+    if field.dtype == DataType.JSON:
+        return JSON_FIELD_BYTES
+    if field.dtype == DataType.ARRAY:
+        return ARRAY_FIELD_BYTES
+    return SCALAR_FIELD_BYTES.get(field.dtype, 8)
+
+
+def estimate_collection_memory(fields, index_params_by_field, row_count, replica_number=1):
+    """依欄位定義、索引參數與資料筆數估算集合載入後的記憶體用量 (bytes)"""
+    per_row = 0.0
+    fixed = 0.0
+
+    for field in fields:
+        if field.dtype in (DataType.FLOAT_VECTOR, DataType.BINARY_VECTOR):
+            dim = field.params["dim"]
+            index_params = index_params_by_field.get(field.name)
+            per_row += vector_bytes_per_row(
+                dim, index_params, binary=field.dtype == DataType.BINARY_VECTOR
+            )
+            fixed += index_fixed_bytes(dim, index_params)
+        else:
+            per_row += scalar_bytes_per_row(field)
+
+    total = (per_row * row_count + fixed) * LOAD_OVERHEAD_RATIO
+    return int(total * replica_number)
+
+
+def estimate_loaded_memory(collection, replica_number=1):
+    """讀取線上集合的 schema、索引與筆數估算載入記憶體"""
+    index_params_by_field = {
+        index.field_name: index.params for index in collection.indexes
+    }
+    return estimate_collection_memory(
+        collection.schema.fields,
+        index_params_by_field,
+        collection.num_entities,
+        replica_number=replica_number,
+    )
+
+
+def parse_loading_progress(progress):
+    """將 utility.loading_progress 的回傳值轉為 0-100 的整數"""
+    value = progress.get("loading_progress", "0%")
+    if isinstance(value, str):
+        value = value.rstrip("%") or 0
+    return int(float(value))
+
+
+class CollectionLoadManager:
+    """在記憶體預算內管理集合載入與釋放 (LRU)"""
+
+    def __init__(self, memory_budget_bytes=MEMORY_BUDGET_BYTES,
+                 replica_number=DEFAULT_REPLICA_NUMBER, using="default", pinned=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.replica_number = replica_number
+        self.using = using
+        self.pinned = set(pinned or [])
+        # 集合名稱 -> 估算記憶體，順序即為最近使用順序 (最舊在前)
+        self._loaded = OrderedDict()
+        self._load_started_at = {}
+
+    @property
+    def used_bytes(self):
+        """目前已載入集合的估算記憶體總和"""
+        return sum(self._loaded.values())
+
+    def estimate(self, collection_name):
+        """估算集合以目前副本數載入所需的記憶體"""
+        collection = Collection(collection_name, using=self.using)
+        return estimate_loaded_memory(collection, self.replica_number)
+
+    def sync_loaded_collections(self):
+        """將伺服器上已載入的集合納入預算計算"""
+        for collection_name in utility.list_collections(using=self.using):
+            if collection_name in self._loaded:
+                continue
+            state = utility.load_state(collection_name, using=self.using)
+            if state in (LoadState.Loaded, LoadState.Loading):
+                self._loaded[collection_name] = self.estimate(collection_name)
+
+    def acquire(self, collection_name, wait=True, timeout=LOAD_TIMEOUT_SECONDS):
+        """取得可搜尋的集合，必要時先釋放冷集合再載入"""
+        collection = Collection(collection_name, using=self.using)
+
+        if collection_name in self._loaded:
+            self._loaded.move_to_end(collection_name)
+        else:
+            required = estimate_loaded_memory(collection, self.replica_number)
+            self._make_room(required, exclude=collection_name)
+
+            print(f"載入集合 {collection_name} (副本數 {self.replica_number}, "
+                  f"估算 {required / 1024 ** 2:.1f} MB)...")
+            collection.load(replica_number=self.replica_number, _async=True)
+            self._loaded[collection_name] = required
+            self._load_started_at[collection_name] = time.time()
+
+        if wait and not self.wait_until_loaded(collection_name, timeout=timeout):
+            raise TimeoutError(f"集合 {collection_name} 載入逾時 ({timeout}s)")
+        return collection
+
+    def progress(self, collection_name):
+        """非阻塞查詢載入進度 (0-100)"""
+        progress = utility.loading_progress(collection_name, using=self.using)
+        return parse_loading_progress(progress)
+
+    def is_loaded(self, collection_name):
+        """集合是否已完成載入"""
+        return self.progress(collection_name) >= 100
+
+    def wait_until_loaded(self, collection_name, timeout=LOAD_TIMEOUT_SECONDS,
+                          poll_interval=LOAD_POLL_INTERVAL_SECONDS):
+        """輪詢載入進度直到完成或逾時"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.is_loaded(collection_name):
+                started_at = self._load_started_at.pop(collection_name, None)
+                if started_at is not None:
+                    print(f"✅ 集合 {collection_name} 載入完成 "
+                          f"({time.time() - started_at:.2f}s)")
+                return True
+            time.sleep(poll_interval)
+        return False
+
+    def release(self, collection_name):
+        """釋放集合並從預算中扣除"""
+        Collection(collection_name, using=self.using).release()
+        self._loaded.pop(collection_name, None)
+        self._load_started_at.pop(collection_name, None)
+        print(f"釋放集合 {collection_name}")
+
+    def release_all(self):
+        """釋放所有由管理器追蹤且未固定的集合"""
+        for collection_name in list(self._loaded):
+            if collection_name not in self.pinned:
+                self.release(collection_name)
+
+    def _make_room(self, required, exclude=None):
+        """依 LRU 順序釋放冷集合直到可容納 required bytes"""
+        if required > self.memory_budget_bytes:
+            raise RuntimeError(
+                f"集合 {exclude} 估算需要 {required / 1024 ** 2:.1f} MB，"
+                f"超過記憶體預算 {self.memory_budget_bytes / 1024 ** 2:.1f} MB"
+            )
+
+        while self.used_bytes + required > self.memory_budget_bytes:
+            victim = next(
+                (name for name in self._loaded
+                 if name != exclude and name not in self.pinned),
+                None,
+            )
+            if victim is None:
+                raise RuntimeError(
+                    f"無法釋放足夠記憶體載入 {exclude}："
+                    f"已使用 {self.used_bytes / 1024 ** 2:.1f} MB，其餘集合皆已固定"
+                )
+            self.release(victim)
+
+    def report(self):
+        """顯示目前載入狀態與預算使用量"""
+        print(f"記憶體預算: {self.used_bytes / 1024 ** 2:.1f} / "
+              f"{self.memory_budget_bytes / 1024 ** 2:.1f} MB")
+        for collection_name, required in self._loaded.items():
+            pinned = " (固定)" if collection_name in self.pinned else ""
+            print(f"  - {collection_name}: {required / 1024 ** 2:.1f} MB, "
+                  f"進度 {self.progress(collection_name)}%{pinned}")
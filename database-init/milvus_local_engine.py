@@ -0,0 +1,864 @@
+#!/usr/bin/env python3
+"""
+程序內的 NumPy 向量引擎
+實作本專案使用到的 Milvus 子集合: 以相同的 FieldSchema 建立集合、insert、flush、
+create_index (FLAT 與以 k-means 訓練的 IVF)、load、search (output_fields 與過濾表達式)、
+query 與 query_iterator。向量以記憶體映射的 float32 檔案儲存。
+可在沒有 docker-compose 環境時取代 Milvus，也可作為基準測試的精確搜尋基準
+
+用法:
+    python3 milvus_local_engine.py [資料筆數]
+"""
+
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+# 引擎設定
+INITIAL_CAPACITY = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_TRAIN_POINTS_PER_LIST = 64
+KMEANS_SEED = 42
+DISTANCE_CHUNK_ROWS = 65_536  # 精確搜尋時每次計算距離的資料列數
+QUERY_CHUNK_ROWS = 1024  # 精確搜尋時每次計算距離的查詢數
+DEFAULT_NPROBE = 10
+DEFAULT_NUM_PARTITIONS = 64  # 與 Milvus partition key 預設分區數相同
+PARTITION_INDEX_MIN_ROWS = 1024  # 分區資料列少於此值時精確搜尋 (對應 Milvus 小 segment 不使用索引)
+SCHEMA_FILE = "schema.json"
+META_FILE = "meta.json"
+
+VECTOR_TYPES = (DataType.FLOAT_VECTOR,)
+NUMPY_SCALAR_TYPES = {
+    DataType.BOOL: np.bool_,
+    DataType.INT8: np.int8,
+    DataType.INT16: np.int16,
+    DataType.INT32: np.int32,
+    DataType.INT64: np.int64,
+    DataType.FLOAT: np.float32,
+    DataType.DOUBLE: np.float64,
+    DataType.VARCHAR: object,
+    DataType.JSON: object,
+}
+HIGHER_IS_BETTER = ("IP", "COSINE")
+PARTITION_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+# ==============================================
+# 距離計算
+# ==============================================
+
+def normalize_rows(vectors):
+    """L2 正規化每一列 (零向量維持為零)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def pairwise_distances(queries, vectors, metric):
+    """計算查詢對資料的距離矩陣；L2 為平方距離，與 Milvus 一致"""
+    if metric == "L2":
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        v_norms = np.einsum("ij,ij->i", vectors, vectors)
+        return np.maximum(q_norms[:, None] + v_norms[None, :] - 2 * queries @ vectors.T, 0)
+    if metric == "IP":
+        return queries @ vectors.T
+    if metric == "COSINE":
+        return normalize_rows(queries) @ normalize_rows(vectors).T
+    raise ValueError(f"不支援的距離類型: {metric}")
+
+
+def top_k(distances, k, metric):
+    """沿最後一軸取前 k 名，回傳 (索引, 距離)；無效項目以 inf 表示"""
+    scores = -distances if metric in HIGHER_IS_BETTER else distances
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    part = np.argpartition(scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(part_scores, axis=1, kind="stable")
+    indices = np.take_along_axis(part, order, axis=1)
+    return indices, np.take_along_axis(distances, indices, axis=1)
+
+
+def in_range(distances, metric, radius, range_filter=None):
+    """Milvus range search 條件: L2 為 range_filter <= d < radius，IP/COSINE 為 radius < d <= range_filter"""
+    if metric in HIGHER_IS_BETTER:
+        keep = distances > radius
+        if range_filter is not None:
+            keep &= distances <= range_filter
+    else:
+        keep = distances < radius
+        if range_filter is not None:
+            keep &= distances >= range_filter
+    return keep
+
+
+def brute_force_search(queries, vectors, k, metric="L2", mask=None, keep=None):
+    """分塊精確搜尋，回傳 (資料列索引, 距離)；可作為 recall 計算的基準
+
+    keep(距離矩陣) 回傳布林遮罩時 (range search 的半徑條件)，只對區塊內有符合項目的查詢取 top-k
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+    if len(queries) > QUERY_CHUNK_ROWS:  # 大 nq 分段，距離矩陣維持在固定大小
+        parts = [brute_force_search(queries[start:start + QUERY_CHUNK_ROWS], vectors, k, metric, mask, keep)
+                 for start in range(0, len(queries), QUERY_CHUNK_ROWS)]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+    worst = -np.inf if metric in HIGHER_IS_BETTER else np.inf
+    best_idx = np.full((len(queries), 0), -1, dtype=np.int64)
+    best_dist = np.full((len(queries), 0), worst, dtype=np.float32)
+
+    for start in range(0, len(vectors), DISTANCE_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + DISTANCE_CHUNK_ROWS], dtype=np.float32)
+        distances = pairwise_distances(queries, chunk, metric).astype(np.float32)
+        if mask is not None:
+            distances[:, ~mask[start:start + len(chunk)]] = worst
+        if keep is not None:
+            within = keep(distances)
+            active = np.flatnonzero(within.any(axis=1))
+            idx = np.zeros((len(queries), min(k, len(chunk))), dtype=np.int64)
+            dist = np.full(idx.shape, worst, dtype=np.float32)
+            if len(active):
+                active_distances = np.where(within[active], distances[active], worst)
+                idx[active], dist[active] = top_k(active_distances, k, metric)
+        else:
+            idx, dist = top_k(distances, k, metric)
+        best_idx = np.concatenate([best_idx, idx + start], axis=1)
+        best_dist = np.concatenate([best_dist, dist], axis=1)
+        keep, best_dist = top_k(best_dist, k, metric)
+        best_idx = np.take_along_axis(best_idx, keep, axis=1)
+
+    valid = np.isfinite(best_dist)
+    best_idx[~valid] = -1
+    return best_idx, best_dist
+
+
+def kmeans(vectors, n_clusters, n_iter=KMEANS_ITERATIONS, seed=KMEANS_SEED):
+    """以 Lloyd 演算法訓練中心點 (抽樣訓練，空群重新取樣)"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    n_train = min(len(vectors), n_clusters * KMEANS_TRAIN_POINTS_PER_LIST)
+    train = np.asarray(vectors[np.sort(rng.choice(len(vectors), n_train, replace=False))],
+                       dtype=np.float32)
+    centroids = train[rng.choice(n_train, n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = assign_to_centroids(train, centroids)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        non_empty = counts > 0
+        order = np.argsort(assignment, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.add.reduceat(train[order], starts[non_empty], axis=0)
+        centroids[non_empty] = sums / counts[non_empty, None]
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            centroids[empty] = train[rng.choice(n_train, len(empty), replace=False)]
+    return centroids
+
+
+def assign_to_centroids(vectors, centroids):
+    """分塊計算每筆向量最近的中心點"""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), DISTANCE_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + DISTANCE_CHUNK_ROWS], dtype=np.float32)
+        assignment[start:start + len(chunk)] = np.argmin(
+            pairwise_distances(chunk, centroids, "L2"), axis=1
+        )
+    return assignment
+
+
+def object_array(values):
+    """建立一維 object 陣列 (避免 JSON 清單被展開成多維)"""
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+# ==============================================
+# 過濾表達式
+# ==============================================
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<op>==|!=|<=|>=|&&|\|\||[<>!()\[\],])
+      | (?P<name>[A-Za-z_$][A-Za-z0-9_$]*)
+    )""", re.VERBOSE)
+
+COMPARISON_OPS = {
+    "==": np.equal, "!=": np.not_equal,
+    "<": np.less, "<=": np.less_equal,
+    ">": np.greater, ">=": np.greater_equal,
+}
+
+
+def tokenize(expr):
+    """將過濾表達式切為 token"""
+    tokens = []
+    position = 0
+    expr = expr.strip()
+    while position < len(expr):
+        match = TOKEN_PATTERN.match(expr, position)
+        if not match or match.end() == position:
+            raise ValueError(f"無法解析的表達式: {expr[position:]}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "number":
+            value = float(value) if any(c in value for c in ".eE") else int(value)
+        elif kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "name" and value.lower() in ("and", "or", "not", "in", "like"):
+            kind, value = "op", value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+class FilterExpression:
+    """Milvus 布林表達式子集合: 比較、in / not in、like、and / or / not 與括號"""
+
+    def __init__(self, expr):
+        self.expr = expr
+        self._tokens = tokenize(expr)
+        self._pos = 0
+
+    def evaluate(self, column):
+        """依欄位取值函數 column(name) 計算布林遮罩"""
+        self._pos = 0
+        self._column = column
+        mask = self._or()
+        if self._pos != len(self._tokens):
+            raise ValueError(f"表達式有多餘內容: {self.expr}")
+        return mask
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else (None, None)
+
+    def _take(self, *values):
+        kind, value = self._peek()
+        if kind == "op" and value in values:
+            self._pos += 1
+            return value
+        return None
+
+    def _expect(self, value):
+        if not self._take(value):
+            raise ValueError(f"表達式缺少 '{value}': {self.expr}")
+
+    def _or(self):
+        mask = self._and()
+        while self._take("or", "||"):
+            mask = mask | self._and()
+        return mask
+
+    def _and(self):
+        mask = self._not()
+        while self._take("and", "&&"):
+            mask = mask & self._not()
+        return mask
+
+    def _not(self):
+        if self._take("not", "!"):
+            return ~self._not()
+        if self._take("("):
+            mask = self._or()
+            self._expect(")")
+            return mask
+        return self._comparison()
+
+    def _literal(self):
+        kind, value = self._peek()
+        if kind not in ("number", "string"):
+            raise ValueError(f"預期常數值: {self.expr}")
+        self._pos += 1
+        return value
+
+    def _comparison(self):
+        kind, name = self._peek()
+        if kind != "name":
+            raise ValueError(f"預期欄位名稱: {self.expr}")
+        self._pos += 1
+        values = self._column(name)
+
+        negate = bool(self._take("not"))
+        if self._take("in"):
+            self._expect("[")
+            items = []
+            while not self._take("]"):
+                items.append(self._literal())
+                self._take(",")
+            mask = np.isin(values, np.array(items, dtype=values.dtype))
+            return ~mask if negate else mask
+        if negate:
+            raise ValueError(f"'not' 之後預期 'in': {self.expr}")
+
+        if self._take("like"):
+            pattern = self._literal()
+            regex = re.compile("^" + re.escape(pattern).replace("%", ".*") + "$")
+            return np.fromiter((bool(regex.match(str(v))) for v in values), dtype=bool,
+                               count=len(values))
+
+        kind, op = self._peek()
+        if kind != "op" or op not in COMPARISON_OPS:
+            raise ValueError(f"預期比較運算子: {self.expr}")
+        self._pos += 1
+        return np.asarray(COMPARISON_OPS[op](values, self._literal()), dtype=bool)
+
+
+# ==============================================
+# 搜尋結果
+# ==============================================
+
+class LocalEntity(dict):
+    """對應 pymilvus hit.entity，支援 .get(field)"""
+
+
+class LocalHit:
+    """對應 pymilvus Hit"""
+
+    def __init__(self, pk, distance, entity):
+        self.id = pk
+        self.distance = float(distance)
+        self.entity = LocalEntity(entity)
+
+    def __repr__(self):
+        return f"LocalHit(id={self.id}, distance={self.distance:.4f})"
+
+
+class LocalIndex:
+    """對應 pymilvus Index 的描述資訊"""
+
+    def __init__(self, field_name, params, index_name=""):
+        self.field_name = field_name
+        self.params = params
+        self.index_name = index_name
+
+
+class LocalMutationResult:
+    """對應 pymilvus MutationResult"""
+
+    def __init__(self, primary_keys, delete_count=0):
+        self.primary_keys = primary_keys
+        self.insert_count = len(primary_keys)
+        self.delete_count = delete_count
+
+
+class LocalQueryIterator:
+    """對應 pymilvus query_iterator，依寫入順序分頁"""
+
+    def __init__(self, collection, batch_size, expr, output_fields):
+        self._rows = np.flatnonzero(collection._filter_mask(expr))
+        self._collection = collection
+        self._batch_size = batch_size
+        self._output_fields = output_fields
+        self._offset = 0
+
+    def next(self):
+        rows = self._rows[self._offset:self._offset + self._batch_size]
+        self._offset += len(rows)
+        return self._collection._rows_to_records(rows, self._output_fields)
+
+    def close(self):
+        self._rows = self._rows[:0]
+
+
+# ==============================================
+# 集合
+# ==============================================
+
+class LocalCollection:
+    """以 NumPy 陣列與記憶體映射檔案實作的集合"""
+
+    def __init__(self, name, schema, data_dir, shards_num=1, num_partitions=DEFAULT_NUM_PARTITIONS):
+        self.name = name
+        self.schema = schema
+        self.description = schema.description
+        self.num_shards = shards_num
+        # partition key: 依鍵值雜湊分區，表達式含鍵值等於 / in 條件時只搜尋對應分區
+        self._partition_key = next((f.name for f in schema.fields if getattr(f, "is_partition_key", False)), None)
+        self.num_partitions = num_partitions if self._partition_key else 1
+        self._partitions = None
+        self.indexes = []
+        self._dir = os.path.join(data_dir, name)
+        os.makedirs(self._dir, exist_ok=True)
+
+        self._primary = next(f for f in schema.fields if f.is_primary)
+        self._fields = {f.name: f for f in schema.fields}
+        self._count = 0
+        self._capacity = 0
+        self._next_auto_id = 1
+        self._loaded = False
+        self._alive = np.zeros(0, dtype=bool)
+        self._vectors = {}
+        self._scalars = {}
+        # IVF 索引: 欄位 -> {"centroids", "assignment", "order", "offsets", "dirty"}
+        self._ivf = {}
+        self._grow(INITIAL_CAPACITY)
+
+    # ---------- 儲存 ----------
+
+    def _vector_path(self, field_name):
+        return os.path.join(self._dir, f"{field_name}.f32")
+
+    def _grow(self, capacity):
+        """擴充容量；向量檔以 truncate 延長後重新映射，不需複製資料"""
+        for field in self.schema.fields:
+            if field.dtype in VECTOR_TYPES:
+                dim = field.params["dim"]
+                path = self._vector_path(field.name)
+                if field.name in self._vectors:
+                    self._vectors[field.name].flush()
+                with open(path, "ab") as f:
+                    if f.tell() < capacity * dim * 4:
+                        f.truncate(capacity * dim * 4)
+                self._vectors[field.name] = np.memmap(
+                    path, dtype=np.float32, mode="r+", shape=(capacity, dim)
+                )
+            else:
+                grown = np.zeros(capacity, dtype=NUMPY_SCALAR_TYPES[field.dtype])
+                if field.name in self._scalars:
+                    grown[:self._count] = self._scalars[field.name][:self._count]
+                self._scalars[field.name] = grown
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._count] = self._alive[:self._count]
+        self._alive = alive
+        self._capacity = capacity
+
+    def _columns_from_data(self, data):
+        """將 list-of-columns、dict-of-columns 或 list-of-rows 轉為欄位字典"""
+        insert_fields = [f for f in self.schema.fields if not (f.is_primary and f.auto_id)]
+        if isinstance(data, dict):
+            return {f.name: data[f.name] for f in insert_fields}
+        if data and isinstance(data[0], dict):
+            return {f.name: [row[f.name] for row in data] for f in insert_fields}
+        if len(data) != len(insert_fields):
+            raise ValueError(f"集合 {self.name} 需要 {len(insert_fields)} 個欄位，收到 {len(data)} 個")
+        return {f.name: column for f, column in zip(insert_fields, data)}
+
+    def insert(self, data, **kwargs):
+        """寫入資料，回傳主鍵"""
+        columns = self._columns_from_data(data)
+        n_rows = len(next(iter(columns.values())))
+
+        if self._primary.auto_id:
+            pks = np.arange(self._next_auto_id, self._next_auto_id + n_rows, dtype=np.int64)
+            self._next_auto_id += n_rows
+            columns[self._primary.name] = pks
+
+        if self._count + n_rows > self._capacity:
+            self._grow(max(self._capacity * 2, self._count + n_rows))
+
+        start, stop = self._count, self._count + n_rows
+        for name, values in columns.items():
+            field = self._fields[name]
+            if field.dtype in VECTOR_TYPES:
+                block = np.asarray(values, dtype=np.float32).reshape(n_rows, field.params["dim"])
+                self._vectors[name][start:stop] = block
+            elif field.dtype == DataType.VARCHAR:
+                self._scalars[name][start:stop] = np.asarray(values, dtype=str).astype(object)
+            elif field.dtype == DataType.JSON:
+                self._scalars[name][start:stop] = object_array(values)
+            else:
+                self._scalars[name][start:stop] = values
+        self._alive[start:stop] = True
+        self._count = stop
+        self._partitions = None
+
+        for field_name, ivf in self._ivf.items():
+            new_assignment = assign_to_centroids(self._vectors[field_name][start:stop], ivf["centroids"])
+            ivf["assignment"] = np.concatenate([ivf["assignment"], new_assignment])
+            ivf["dirty"] = True
+
+        return LocalMutationResult(self._scalars[self._primary.name][start:stop].tolist())
+
+    def delete(self, expr, **kwargs):
+        """依表達式刪除資料 (標記刪除)"""
+        mask = self._filter_mask(expr)
+        self._alive[:self._count] &= ~mask
+        return LocalMutationResult([], delete_count=int(mask.sum()))
+
+    def upsert(self, data, **kwargs):
+        """以主鍵覆寫: 先刪除相同主鍵再寫入"""
+        if self._primary.auto_id:
+            raise ValueError(f"集合 {self.name} 使用 auto_id，不支援 upsert")
+        columns = self._columns_from_data(data)
+        pks = np.asarray(columns[self._primary.name])
+        existing = np.isin(self._scalars[self._primary.name][:self._count], pks)
+        self._alive[:self._count] &= ~existing
+        return self.insert(columns)
+
+    def flush(self, **kwargs):
+        """將向量寫回檔案並保存純量欄位與中繼資料"""
+        for memmap in self._vectors.values():
+            memmap.flush()
+        for name, values in self._scalars.items():
+            field = self._fields[name]
+            values = values[:self._count]
+            if field.dtype == DataType.JSON:
+                values = np.array([json.dumps(v, ensure_ascii=False) for v in values])
+            elif field.dtype == DataType.VARCHAR:
+                values = values.astype(str)
+            np.save(os.path.join(self._dir, f"{name}.npy"), values)
+        np.save(os.path.join(self._dir, "_alive.npy"), self._alive[:self._count])
+
+        with open(os.path.join(self._dir, SCHEMA_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.schema.to_dict(), f, ensure_ascii=False)
+        with open(os.path.join(self._dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "count": self._count,
+                "next_auto_id": self._next_auto_id,
+                "num_shards": self.num_shards,
+                "num_partitions": self.num_partitions,
+                "indexes": [
+                    {"field_name": i.field_name, "params": i.params, "index_name": i.index_name}
+                    for i in self.indexes
+                ],
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, name, data_dir):
+        """由 flush 過的目錄重新開啟集合"""
+        directory = os.path.join(data_dir, name)
+        with open(os.path.join(directory, SCHEMA_FILE), encoding="utf-8") as f:
+            schema = CollectionSchema.construct_from_dict(json.load(f))
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+
+        collection = cls(name, schema, data_dir, shards_num=meta["num_shards"],
+                         num_partitions=meta.get("num_partitions", DEFAULT_NUM_PARTITIONS))
+        count = meta["count"]
+        collection._grow(max(count, INITIAL_CAPACITY))
+        for field in schema.fields:
+            if field.dtype in VECTOR_TYPES:
+                continue
+            values = np.load(os.path.join(directory, f"{field.name}.npy"))
+            if field.dtype == DataType.JSON:
+                values = object_array([json.loads(v) for v in values])
+            elif field.dtype == DataType.VARCHAR:
+                values = object_array(values.tolist())
+            collection._scalars[field.name][:count] = values
+        collection._alive[:count] = np.load(os.path.join(directory, "_alive.npy"))
+        collection._count = count
+        collection._next_auto_id = meta["next_auto_id"]
+        for index in meta["indexes"]:
+            collection.create_index(index["field_name"], index["params"], index_name=index["index_name"])
+        return collection
+
+    # ---------- 索引與載入 ----------
+
+    @property
+    def num_entities(self):
+        return int(self._alive[:self._count].sum())
+
+    def create_index(self, field_name, index_params, index_name="", **kwargs):
+        """建立索引；IVF_* 以 k-means 訓練中心點，純量索引僅記錄"""
+        self.indexes = [i for i in self.indexes if i.field_name != field_name]
+        self.indexes.append(LocalIndex(field_name, index_params, index_name or field_name))
+        self._ivf.pop(field_name, None)
+
+        index_type = index_params.get("index_type", "FLAT")
+        if field_name in self._vectors and index_type.startswith("IVF_") and self._count:
+            nlist = index_params.get("params", {}).get("nlist", 128)
+            vectors = self._vectors[field_name][:self._count]
+            centroids = kmeans(vectors, nlist)
+            self._ivf[field_name] = {
+                "centroids": centroids,
+                "assignment": assign_to_centroids(vectors, centroids),
+                "dirty": True,
+            }
+
+    def load(self, **kwargs):
+        self._loaded = True
+
+    def release(self, **kwargs):
+        self._loaded = False
+
+    def _metric_for(self, field_name, param):
+        for index in self.indexes:
+            if index.field_name == field_name and "metric_type" in index.params:
+                return index.params["metric_type"]
+        return param.get("metric_type", "L2")
+
+    def _inverted_lists(self, field_name):
+        """依 IVF 分群排序後的資料列與每群的起訖位置"""
+        ivf = self._ivf[field_name]
+        if ivf["dirty"]:
+            ivf["order"] = np.argsort(ivf["assignment"], kind="stable")
+            ivf["offsets"] = np.searchsorted(
+                ivf["assignment"][ivf["order"]], np.arange(len(ivf["centroids"]) + 1)
+            )
+            ivf["dirty"] = False
+        return ivf["order"], ivf["offsets"]
+
+    def partition_of(self, keys):
+        """partition key 值對應的分區編號 (乘法雜湊)"""
+        keys = np.asarray(keys, dtype=np.int64).astype(np.uint64)
+        return ((keys * PARTITION_HASH_MULTIPLIER) >> np.uint64(32)) % np.uint64(self.num_partitions)
+
+    def _partition_rows(self, partitions):
+        """指定分區的資料列 (依分區排序的列號，寫入後重建)"""
+        if self._partitions is None:
+            assignment = self.partition_of(self._scalars[self._partition_key][:self._count])
+            order = np.argsort(assignment, kind="stable")
+            offsets = np.searchsorted(assignment[order], np.arange(self.num_partitions + 1))
+            self._partitions = (order, offsets)
+        order, offsets = self._partitions
+        return np.concatenate([order[offsets[p]:offsets[p + 1]] for p in sorted(partitions)] or
+                              [np.zeros(0, dtype=np.int64)])
+
+    def _pruned_rows(self, expr):
+        """表達式為 AND 連接且含 partition key 的 == / in 條件時，回傳候選資料列；否則回傳 None"""
+        if not self._partition_key or not expr or re.search(r"\b(or|not)\b|\|\||!(?!=)", expr):
+            return None
+        key = re.escape(self._partition_key)
+        match = re.search(rf"(?<![\w.]){key}\s*(?:==\s*(-?\d+)|in\s*\[([^\]]*)\])", expr)
+        if match is None:
+            return None
+        keys = [match.group(1)] if match.group(1) is not None else match.group(2).split(",")
+        keys = [int(k) for k in keys if k.strip()]
+        return self._partition_rows({int(p) for p in self.partition_of(keys)})
+
+    # ---------- 搜尋與查詢 ----------
+
+    def _column(self, name):
+        if name not in self._scalars:
+            raise ValueError(f"集合 {self.name} 沒有欄位 {name}")
+        return self._scalars[name][:self._count]
+
+    def _filter_mask(self, expr, rows=None):
+        """表達式遮罩；指定 rows 時只計算這些資料列"""
+        if rows is None:
+            mask = self._alive[:self._count].copy()
+            if expr:
+                mask &= FilterExpression(expr).evaluate(self._column)
+            return mask
+        mask = self._alive[rows]
+        if expr:
+            mask &= FilterExpression(expr).evaluate(lambda name: self._column(name)[rows])
+        return mask
+
+    def _rows_to_records(self, rows, output_fields):
+        output_fields = output_fields or []
+        if "*" in output_fields:  # 本地引擎不保存動態欄位，"*" 即全部 schema 欄位
+            output_fields = [f.name for f in self.schema.fields]
+        fields = [self._primary.name] + [f for f in output_fields if f != self._primary.name]
+        columns = {}
+        for name in fields:
+            if name in self._vectors:
+                columns[name] = [vector.tolist() for vector in self._vectors[name][rows]]
+            else:
+                columns[name] = self._scalars[name][rows].tolist()
+        return [{name: columns[name][i] for name in fields} for i in range(len(rows))]
+
+    def search(self, data, anns_field, param, limit, expr=None, output_fields=None, **kwargs):
+        """向量搜尋，回傳每個查詢的 LocalHit 清單"""
+        if not self._loaded:
+            raise RuntimeError(f"集合 {self.name} 尚未載入")
+
+        queries = np.asarray(data, dtype=np.float32).reshape(len(data), -1)
+        metric = self._metric_for(anns_field, param)
+        vectors = self._vectors[anns_field][:self._count]
+        pruned = self._pruned_rows(expr)
+        search_params = param.get("params", {})
+        keep = None
+        if "radius" in search_params:  # range search: 精確搜尋只對有半徑內結果的查詢取 top-k
+            keep = lambda distances: in_range(distances, metric, search_params["radius"],
+                                              search_params.get("range_filter"))
+
+        if pruned is not None and (len(pruned) < PARTITION_INDEX_MIN_ROWS or anns_field not in self._ivf
+                                   or kwargs.get("exact")):
+            # 只搜尋鍵值所在的分區
+            mask = self._filter_mask(expr, pruned)
+            rows, distances = brute_force_search(queries, vectors[pruned], limit, metric, mask, keep)
+            rows = np.where(rows >= 0, pruned[np.maximum(rows, 0)], -1)
+        elif pruned is not None:
+            # 大分區: 以索引搜尋，只掃描分區內的資料列
+            nprobe = param.get("params", {}).get("nprobe", DEFAULT_NPROBE)
+            scope = np.zeros(self._count, dtype=bool)
+            scope[pruned] = True
+            mask = np.zeros(self._count, dtype=bool)
+            mask[pruned] = self._filter_mask(expr, pruned)
+            rows, distances = self._search_ivf(queries, anns_field, vectors, limit, metric, mask, nprobe, scope)
+        elif anns_field in self._ivf and not kwargs.get("exact"):
+            nprobe = param.get("params", {}).get("nprobe", DEFAULT_NPROBE)
+            rows, distances = self._search_ivf(queries, anns_field, vectors, limit, metric,
+                                               self._filter_mask(expr), nprobe)
+        else:
+            rows, distances = brute_force_search(queries, vectors, limit, metric, self._filter_mask(expr), keep)
+
+        if keep is not None:
+            rows = np.where(keep(distances), rows, -1)
+
+        pks = self._scalars[self._primary.name]
+        results = []
+        for query_rows, query_distances in zip(rows, distances):
+            valid = query_rows >= 0
+            query_rows = query_rows[valid]
+            records = self._rows_to_records(query_rows, output_fields)
+            results.append([
+                LocalHit(pk, distance, record)
+                for pk, distance, record in zip(pks[query_rows].tolist(), query_distances[valid], records)
+            ])
+        return results
+
+    def _search_ivf(self, queries, field_name, vectors, limit, metric, mask, nprobe, scope=None):
+        """IVF 搜尋: 掃描 nprobe 個列表的所有資料列 (scope 為分區時只掃描分區內)，
+        過濾條件與刪除以遮罩套用在距離上，與 Milvus 相同不因條件選擇性而少算距離"""
+        ivf = self._ivf[field_name]
+        worst = -np.inf if metric in HIGHER_IS_BETTER else np.inf
+        order, offsets = self._inverted_lists(field_name)
+        centroid_distances = pairwise_distances(queries, ivf["centroids"], "L2")
+        nprobe = min(nprobe, len(ivf["centroids"]))
+        probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        all_rows = np.full((len(queries), limit), -1, dtype=np.int64)
+        all_distances = np.full((len(queries), limit), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in probes[i]])
+            if scope is not None:
+                candidates = candidates[scope[candidates]]
+            if not len(candidates):
+                continue
+            distances = pairwise_distances(query[None, :], vectors[candidates], metric)
+            distances[:, ~mask[candidates]] = worst
+            idx, dist = top_k(distances, limit, metric)
+            valid = np.isfinite(dist[0])
+            n_valid = int(valid.sum())
+            all_rows[i, :n_valid] = candidates[idx[0][valid]]
+            all_distances[i, :n_valid] = dist[0][valid]
+        return all_rows, all_distances
+
+    def query(self, expr, output_fields=None, limit=None, offset=0, **kwargs):
+        """依表達式查詢資料；output_fields 為 ["count(*)"] 時回傳筆數"""
+        pruned = self._pruned_rows(expr)
+        if pruned is None:
+            rows = np.flatnonzero(self._filter_mask(expr))
+        else:
+            rows = np.sort(pruned[self._filter_mask(expr, pruned)])
+        if output_fields == ["count(*)"]:
+            return [{"count(*)": len(rows)}]
+        rows = rows[offset:offset + limit] if limit is not None else rows[offset:]
+        return self._rows_to_records(rows, output_fields)
+
+    def query_iterator(self, batch_size=1000, expr=None, output_fields=None, **kwargs):
+        return LocalQueryIterator(self, batch_size, expr, output_fields)
+
+
+# ==============================================
+# 引擎
+# ==============================================
+
+class LocalMilvus:
+    """集合的容器，對應 utility.has_collection / drop_collection / list_collections"""
+
+    def __init__(self, data_dir=None):
+        self._owns_dir = data_dir is None
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix="local-milvus-")
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._collections = {}
+        for name in os.listdir(self.data_dir):
+            if os.path.exists(os.path.join(self.data_dir, name, META_FILE)):
+                self._collections[name] = LocalCollection.open(name, self.data_dir)
+
+    def collection(self, name, schema=None, shards_num=1, num_partitions=DEFAULT_NUM_PARTITIONS, **kwargs):
+        """取得集合；若不存在且提供 schema 則建立"""
+        if name not in self._collections:
+            if schema is None:
+                raise ValueError(f"集合 {name} 不存在")
+            self._collections[name] = LocalCollection(name, schema, self.data_dir, shards_num, num_partitions)
+        return self._collections[name]
+
+    def has_collection(self, name):
+        return name in self._collections
+
+    def drop_collection(self, name):
+        self._collections.pop(name, None)
+        shutil.rmtree(os.path.join(self.data_dir, name), ignore_errors=True)
+
+    def list_collections(self):
+        return list(self._collections)
+
+    def close(self):
+        """關閉引擎；暫存目錄會一併刪除"""
+        self._collections.clear()
+        if self._owns_dir:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+def main():
+    """以 product_vectors 結構比較 IVF 與精確搜尋的延遲與 recall"""
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_queries = 100
+    limit = 10
+
+    fields = [
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=512),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+        FieldSchema(name="price_range", dtype=DataType.INT64),
+        FieldSchema(name="brand", dtype=DataType.VARCHAR, max_length=100),
+        FieldSchema(name="created_at", dtype=DataType.INT64)
+    ]
+    schema = CollectionSchema(fields=fields, description="商品特徵向量集合")
+
+    engine = LocalMilvus()
+    try:
+        collection = engine.collection("product_vectors", schema)
+        rng = np.random.default_rng(0)
+        category_ids = rng.integers(1, 11, n_rows)
+        embeddings = rng.random((n_rows, 512), dtype=np.float32)
+        embeddings[np.arange(n_rows)[:, None], (category_ids[:, None] - 1) * 50 + np.arange(50)] += 0.5
+
+        start = time.perf_counter()
+        collection.insert([
+            np.arange(1, n_rows + 1), embeddings, category_ids,
+            rng.integers(1, 5, n_rows), rng.choice(["Apple", "Nike", "Adidas", "SK-II"], n_rows),
+            np.full(n_rows, int(time.time())),
+        ])
+        collection.flush()
+        print(f"寫入 {n_rows} 筆: {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        collection.create_index("embedding", {"metric_type": "L2", "index_type": "IVF_FLAT",
+                                              "params": {"nlist": 256}})
+        collection.load()
+        print(f"建立 IVF_FLAT (nlist=256): {time.perf_counter() - start:.2f}s")
+
+        queries = embeddings[rng.choice(n_rows, n_queries)] + rng.normal(0, 0.05, (n_queries, 512))
+        search_params = {"metric_type": "L2", "params": {"nprobe": 16}}
+
+        start = time.perf_counter()
+        exact = collection.search(queries, "embedding", search_params, limit, exact=True)
+        exact_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        approx = collection.search(queries, "embedding", search_params, limit,
+                                   expr=None, output_fields=["category_id", "brand"])
+        ivf_elapsed = time.perf_counter() - start
+
+        recall = np.mean([
+            len({h.id for h in a} & {h.id for h in e}) / limit for a, e in zip(approx, exact)
+        ])
+        print(f"精確搜尋: {exact_elapsed / n_queries * 1000:.2f} ms/查詢")
+        print(f"IVF 搜尋 (nprobe=16): {ivf_elapsed / n_queries * 1000:.2f} ms/查詢, "
+              f"recall@{limit} = {recall:.3f}")
+
+        category_query = embeddings[np.flatnonzero(category_ids == 1)[:1]]
+        filtered = collection.search(category_query, "embedding", search_params, limit,
+                                     expr="category_id in [1, 2] and brand != 'Nike'",
+                                     output_fields=["category_id", "brand"])
+        print(f"過濾搜尋: {[(h.id, h.entity.get('category_id'), h.entity.get('brand')) for h in filtered[0][:3]]}")
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Compaction 與 segment 健康排程
+檢查每個已載入集合的 segment 數量、大小與刪除比例，超過門檻時觸發 compaction 並等待完成，
+記錄 compaction 前後的搜尋延遲；結果逐筆附加到 JSON Lines 紀錄檔
+
+刪除比例以 1 - count(*) / segment 總列數估算 (segment 列數在 compaction 前仍包含已刪除資料)
+
+用法:
+    python3 milvus_maintenance.py status
+    python3 milvus_maintenance.py run [--force] [--dry-run] [--collections product_vectors]
+    python3 milvus_maintenance.py schedule --interval-minutes 60
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+from pymilvus import Collection, DataType, connections, utility
+from pymilvus.client.types import LoadState
+from pymilvus.grpc_gen.common_pb2 import SegmentState
+
+from milvus_common import ECOMMERCE_COLLECTIONS, connect_to_milvus
+
+# 門檻設定
+SMALL_SEGMENT_BYTES = 64 * 1024 ** 2
+MAX_SMALL_SEGMENTS = 4
+MAX_DELETED_RATIO = 0.10
+MAX_SEGMENTS_PER_SHARD = 8
+
+# 執行設定
+COMPACTION_TIMEOUT_SECONDS = 600
+LATENCY_SAMPLES = 50
+DEFAULT_INTERVAL_MINUTES = 60
+DEFAULT_HISTORY_FILE = "milvus_maintenance.jsonl"
+
+DEFAULT_THRESHOLDS = {
+    "small_segment_bytes": SMALL_SEGMENT_BYTES,
+    "max_small_segments": MAX_SMALL_SEGMENTS,
+    "max_deleted_ratio": MAX_DELETED_RATIO,
+    "max_segments_per_shard": MAX_SEGMENTS_PER_SHARD,
+}
+
+
+def inspect_collection(collection, thresholds=DEFAULT_THRESHOLDS):
+    """回傳集合的 segment 健康資訊 (集合需已載入)"""
+    segments = utility.get_query_segment_info(collection.name)
+    # 多副本時同一 segment 會出現多次
+    unique = {segment.segmentID: segment for segment in segments}.values()
+    sealed = [segment for segment in unique if segment.state != SegmentState.Growing]
+
+    segment_rows = sum(segment.num_rows for segment in unique)
+    live_rows = collection.query(expr="", output_fields=["count(*)"])[0]["count(*)"]
+    deleted_ratio = max(0.0, 1 - live_rows / segment_rows) if segment_rows else 0.0
+
+    return {
+        "collection": collection.name,
+        "shards": collection.num_shards,
+        "segments": len(unique),
+        "sealed_segments": len(sealed),
+        "growing_segments": len(unique) - len(sealed),
+        "small_segments": sum(1 for s in sealed if s.mem_size < thresholds["small_segment_bytes"]),
+        "segment_rows": segment_rows,
+        "live_rows": live_rows,
+        "deleted_ratio": deleted_ratio,
+        "mem_bytes": sum(segment.mem_size for segment in unique),
+    }
+
+
+def compaction_reasons(health, thresholds=DEFAULT_THRESHOLDS):
+    """回傳觸發 compaction 的原因清單，空清單表示健康"""
+    reasons = []
+    if health["small_segments"] > thresholds["max_small_segments"]:
+        reasons.append(f"小 segment {health['small_segments']} 個")
+    if health["deleted_ratio"] > thresholds["max_deleted_ratio"]:
+        reasons.append(f"刪除比例 {health['deleted_ratio']:.1%}")
+    if health["sealed_segments"] > thresholds["max_segments_per_shard"] * max(health["shards"], 1):
+        reasons.append(f"sealed segment {health['sealed_segments']} 個")
+    return reasons
+
+
+def measure_search_latency(collection, samples=LATENCY_SAMPLES, seed=0):
+    """以隨機向量搜尋第一個浮點向量欄位，回傳延遲分位數 (ms)；無向量欄位時回傳 None"""
+    field = next((f for f in collection.schema.fields if f.dtype == DataType.FLOAT_VECTOR), None)
+    if field is None:
+        return None
+    metric = next((index.params.get("metric_type") for index in collection.indexes
+                   if index.field_name == field.name), "L2")
+
+    rng = np.random.default_rng(seed)
+    latencies = []
+    for _ in range(samples):
+        began = time.perf_counter()
+        collection.search(
+            data=[rng.random(field.params["dim"], dtype=np.float32).tolist()], anns_field=field.name,
+            param={"metric_type": metric, "params": {"nprobe": 10}}, limit=10,
+        )
+        latencies.append((time.perf_counter() - began) * 1000)
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {"p50": float(p50), "p99": float(p99)}
+
+
+def compact(collection, timeout=COMPACTION_TIMEOUT_SECONDS):
+    """觸發 compaction 並等待完成，回傳 (compaction ID, 計畫數, 秒數)"""
+    started = time.time()
+    collection.compact()
+    compaction_id = collection.compaction_id
+    collection.wait_for_compaction_completed(timeout=timeout)
+    plans = collection.get_compaction_plans()
+    return compaction_id, len(plans.plans), time.time() - started
+
+
+def maintain_collection(name, thresholds=DEFAULT_THRESHOLDS, force=False, dry_run=False):
+    """檢查單一集合，必要時 compaction，回傳紀錄"""
+    record = {"collection": name, "timestamp": int(time.time())}
+    if utility.load_state(name) != LoadState.Loaded:
+        record["skipped"] = "未載入"
+        return record
+
+    collection = Collection(name)
+    record["before"] = inspect_collection(collection, thresholds)
+    record["reasons"] = compaction_reasons(record["before"], thresholds)
+    if not (record["reasons"] or force) or dry_run:
+        record["compacted"] = False
+        return record
+
+    record["latency_before_ms"] = measure_search_latency(collection)
+    record["compaction_id"], record["plans"], record["compaction_s"] = compact(collection)
+    record["after"] = inspect_collection(collection, thresholds)
+    record["latency_after_ms"] = measure_search_latency(collection)
+    record["compacted"] = True
+    return record
+
+
+def print_record(record):
+    """顯示單一集合的檢查 / compaction 結果"""
+    name = record["collection"]
+    if "skipped" in record:
+        print(f"⚠️ {name}: {record['skipped']}，略過")
+        return
+    before = record["before"]
+    print(f"{name}: {before['segments']} 個 segment (sealed {before['sealed_segments']}, "
+          f"growing {before['growing_segments']}, 小 {before['small_segments']}), "
+          f"{before['live_rows']}/{before['segment_rows']} 筆有效, 刪除比例 {before['deleted_ratio']:.1%}")
+    if record["reasons"]:
+        print(f"  需要 compaction: {', '.join(record['reasons'])}")
+    if record.get("compacted"):
+        after = record["after"]
+        print(f"  ✅ compaction {record['compaction_id']}: {record['plans']} 個計畫, {record['compaction_s']:.1f}s, "
+              f"segment {before['segments']} → {after['segments']}, "
+              f"刪除比例 {before['deleted_ratio']:.1%} → {after['deleted_ratio']:.1%}")
+        latency_before, latency_after = record["latency_before_ms"], record["latency_after_ms"]
+        if latency_before and latency_after:
+            print(f"  搜尋延遲 p50 {latency_before['p50']:.2f} → {latency_after['p50']:.2f} ms, "
+                  f"p99 {latency_before['p99']:.2f} → {latency_after['p99']:.2f} ms")
+
+
+def run_maintenance(collection_names=None, thresholds=DEFAULT_THRESHOLDS, force=False, dry_run=False,
+                    history_file=DEFAULT_HISTORY_FILE):
+    """檢查多個集合並將紀錄附加到紀錄檔"""
+    collection_names = collection_names or [
+        name for name in ECOMMERCE_COLLECTIONS if utility.has_collection(name)
+    ]
+    records = []
+    for name in collection_names:
+        try:
+            record = maintain_collection(name, thresholds, force, dry_run)
+        except Exception as e:
+            record = {"collection": name, "timestamp": int(time.time()), "skipped": f"失敗: {e}"}
+        print_record(record)
+        records.append(record)
+
+    if history_file and not dry_run:
+        with open(history_file, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return records
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Milvus compaction 與 segment 健康排程")
+    parser.add_argument("--collections", nargs="*")
+    parser.add_argument("--history-file", default=DEFAULT_HISTORY_FILE)
+    parser.add_argument("--max-deleted-ratio", type=float, default=MAX_DELETED_RATIO)
+    parser.add_argument("--max-small-segments", type=int, default=MAX_SMALL_SEGMENTS)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="只檢查 segment 健康")
+    run_parser = subparsers.add_parser("run", help="立即執行一次")
+    run_parser.add_argument("--force", action="store_true", help="未達門檻也執行 compaction")
+    run_parser.add_argument("--dry-run", action="store_true")
+    schedule_parser = subparsers.add_parser("schedule", help="定期執行")
+    schedule_parser.add_argument("--interval-minutes", type=float, default=DEFAULT_INTERVAL_MINUTES)
+
+    args = parser.parse_args()
+    thresholds = dict(DEFAULT_THRESHOLDS, max_deleted_ratio=args.max_deleted_ratio,
+                      max_small_segments=args.max_small_segments)
+
+    if not connect_to_milvus():
+        sys.exit(1)
+
+    try:
+        if args.command == "status":
+            run_maintenance(args.collections, thresholds, dry_run=True)
+        elif args.command == "run":
+            run_maintenance(args.collections, thresholds, args.force, args.dry_run, args.history_file)
+        else:
+            while True:
+                print(f"\n=== {time.strftime('%Y-%m-%d %H:%M:%S')} 例行檢查 ===")
+                run_maintenance(args.collections, thresholds, history_file=args.history_file)
+                time.sleep(args.interval_minutes * 60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+多商家 (multi-tenant) 商品搜尋
+商家後台只搜尋自家商品；product_vectors 以 merchant_id 作為 partition key，
+Milvus 依 merchant_id 雜湊將資料分到 num_partitions 個分區，搜尋表達式含
+merchant_id == x / merchant_id in [...] 時只搜尋對應分區，
+大商家商品數成長不會拖慢其他商家的搜尋 (除非雜湊到同一分區)
+
+partition key 只能在建立集合時指定；既有集合的遷移: 以 milvus_snapshot.py 匯出舊資料，
+以新 schema (見 milvus-init.py) 重建 product_vectors，再以 milvus_backfill.py 或 milvus_bulk_import.py
+搭配 --merchant-map 匯入；舊快照沒有 merchant_id，依 product_id 由對照表 [{product_id, merchant_id}, ...] 補上
+(PostgreSQL Products 表目前沒有商家欄位，對照表需由商家系統匯出)，對照表缺少的 product_id 會中止匯入:
+    python3 milvus_backfill.py run --snapshot ./snapshots/20240101 --collection product_vectors \\
+        --checkpoint product_vectors.ckpt.json --merchant-map merchants.json
+
+用法:
+    python3 milvus_merchant_search.py bench                           # 本地引擎，大商家成長 1× / 10× / 100×
+    python3 milvus_merchant_search.py bench --milvus                  # 實際 Milvus (建立暫時集合)
+    python3 milvus_merchant_search.py search --merchant 3 --product-id 1024     # 以既有商品的向量搜尋
+    python3 milvus_merchant_search.py search --merchant 3 --vector-file query.npy
+product_vectors 的 embedding 不是由文字產生，search 以商品 id 或向量檔 (.npy / JSON 數字陣列) 作為查詢
+
+本地引擎的純量過濾與 Milvus 相同會掃描 IVF 探測列表內所有商品 (過濾只套用在距離上)，
+partition key 只掃描商家所在分區，因此 bench 的本地結果即可看出大商家成長時其他商家延遲是否受影響
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+from milvus_columnar import ColumnBatch
+from milvus_common import collection_search_params, prepare_vectors
+from milvus_local_engine import LocalMilvus
+
+# 商家分區設定
+MERCHANT_FIELD = "merchant_id"
+MERCHANT_NUM_PARTITIONS = 64  # 與 Milvus partition key 預設分區數相同
+SEARCH_OUTPUT_FIELDS = ["product_id", "category_id", "brand", MERCHANT_FIELD]
+
+# 測量設定
+DEFAULT_MERCHANTS = 50
+DEFAULT_SMALL_ROWS = 200  # 每個小商家的商品數
+DEFAULT_LARGE_ROWS = 1_000  # 大商家的初始商品數
+GROWTH_FACTORS = (1, 10, 100)
+DEFAULT_QUERIES = 200
+DEFAULT_LIMIT = 10
+DEFAULT_DIM = 512
+BENCH_NLIST = 128
+BENCH_NPROBE = 16
+INSERT_BATCH_ROWS = 10_000
+LARGE_MERCHANT_ID = 0
+BENCH_COLLECTION_PREFIX = "merchant_bench_"
+
+
+def merchant_field():
+    """product_vectors 的 merchant_id 欄位 (partition key)"""
+    return FieldSchema(name=MERCHANT_FIELD, dtype=DataType.INT64, is_partition_key=True)
+
+
+def has_partition_key(collection, field_name=MERCHANT_FIELD):
+    """集合是否以 field_name 作為 partition key (否則商家過濾只是全集合的純量過濾)"""
+    return any(field.name == field_name and getattr(field, "is_partition_key", False)
+               for field in collection.schema.fields)
+
+
+def merchant_expr(merchant_ids, expr=None):
+    """限定商家的過濾表達式；merchant_ids 可為單一商家或清單，expr 為額外條件"""
+    if np.ndim(merchant_ids) == 0:
+        scoped = f"{MERCHANT_FIELD} == {int(merchant_ids)}"
+    else:
+        scoped = f"{MERCHANT_FIELD} in [{', '.join(str(int(m)) for m in merchant_ids)}]"
+    return f"{scoped} and ({expr})" if expr else scoped
+
+
+def merchant_search(collection, data, merchant_ids, limit, expr=None, anns_field="embedding",
+                    search_params=None, output_fields=None):
+    """只搜尋指定商家的商品 (查詢向量依集合距離類型處理)"""
+    return collection.search(
+        data=prepare_vectors(collection.name, data).tolist(),
+        anns_field=anns_field,
+        param=search_params or collection_search_params(collection.name),
+        limit=limit,
+        expr=merchant_expr(merchant_ids, expr),
+        output_fields=output_fields,
+    )
+
+
+class MerchantScope:
+    """綁定單一商家的集合檢視；search / query 自動加上商家條件，供商家後台 API 使用"""
+
+    def __init__(self, collection, merchant_id):
+        self.collection = collection
+        self.merchant_id = int(merchant_id)
+        if not has_partition_key(collection):
+            print(f"⚠️ 集合 {collection.name} 沒有 {MERCHANT_FIELD} partition key，商家搜尋會掃描全集合")
+
+    def search(self, data, limit, expr=None, **kwargs):
+        return merchant_search(self.collection, data, self.merchant_id, limit, expr=expr, **kwargs)
+
+    def query(self, expr=None, **kwargs):
+        return self.collection.query(expr=merchant_expr(self.merchant_id, expr), **kwargs)
+
+    def count(self):
+        return self.query(output_fields=["count(*)"])[0]["count(*)"]
+
+
+# ---------- 既有資料遷移 ----------
+
+def load_merchant_map(path):
+    """讀取 [{product_id, merchant_id}, ...]，回傳 {product_id: merchant_id}"""
+    with open(path, encoding="utf-8") as f:
+        products = json.load(f)
+    return {int(product["product_id"]): int(product[MERCHANT_FIELD]) for product in products}
+
+
+def with_merchant_ids(batch, schema, merchant_map, pk_name="product_id"):
+    """依 product_id 補上 merchant_id，回傳符合 schema 的批次；商品表找不到的 product_id 直接拒絕"""
+    product_ids = np.asarray(batch.columns[pk_name], dtype=np.int64)
+    missing = [pid for pid in product_ids.tolist() if pid not in merchant_map]
+    if missing:
+        raise ValueError(f"{len(missing)} 個 product_id 在商家對照表中找不到 (例如 {missing[:5]})")
+    columns = dict(batch.columns)
+    columns[MERCHANT_FIELD] = np.fromiter((merchant_map[pid] for pid in product_ids.tolist()),
+                                          dtype=np.int64, count=len(product_ids))
+    return ColumnBatch(schema.fields, columns, batch.dynamic)
+
+
+class MerchantMapSource:
+    """包裝回填 / 匯入來源 (沒有 merchant_id 的舊資料)，每個批次依對照表補上 merchant_id
+
+    schema 為來源 schema 加上 merchant_id partition key，ensure_target 建立的目標集合即為新 schema
+    """
+
+    def __init__(self, source, merchant_map, map_path=None):
+        if any(field.name == MERCHANT_FIELD for field in source.schema.fields):
+            raise ValueError(f"來源已有 {MERCHANT_FIELD} 欄位，不需要商家對照表")
+        self.source = source
+        self.merchant_map = merchant_map
+        self.map_path = map_path
+        self.pk_name = next(f.name for f in source.schema.fields if f.is_primary)
+        self.schema = CollectionSchema(fields=[*source.schema.fields, merchant_field()],
+                                       description=source.schema.description,
+                                       enable_dynamic_field=source.schema.enable_dynamic_field)
+        self.indexes = source.indexes
+
+    def describe(self):
+        return {**self.source.describe(), "merchant_map": self.map_path}
+
+    def batches(self, cursor, batch_size):
+        for batch, next_cursor in self.source.batches(cursor, batch_size):
+            if batch is not None:
+                batch = with_merchant_ids(batch, self.schema, self.merchant_map, self.pk_name)
+            yield batch, next_cursor
+
+
+# ---------- 延遲隔離測量 ----------
+
+def create_bench_collection(client, name, dim, partition_key):
+    """建立測試集合 (client 為 LocalMilvus 時使用本地引擎，否則使用 Milvus)"""
+    fields = [
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        merchant_field() if partition_key else FieldSchema(name=MERCHANT_FIELD, dtype=DataType.INT64),
+    ]
+    schema = CollectionSchema(fields=fields, description="商家分區測量")
+    num_partitions = {"num_partitions": MERCHANT_NUM_PARTITIONS} if partition_key else {}
+    if client is not None:
+        collection = client.collection(name, schema, **num_partitions)
+    else:
+        from pymilvus import Collection, utility
+
+        if utility.has_collection(name):
+            utility.drop_collection(name)
+        collection = Collection(name=name, schema=schema, using='default', shards_num=1, **num_partitions)
+    return collection
+
+
+def insert_rows(collections, product_ids, merchant_ids, rng, dim):
+    """兩個集合寫入相同資料"""
+    for start in range(0, len(product_ids), INSERT_BATCH_ROWS):
+        ids = product_ids[start:start + INSERT_BATCH_ROWS]
+        vectors = prepare_vectors("product_vectors", rng.random((len(ids), dim), dtype=np.float32))
+        for collection in collections:
+            collection.insert([ids, vectors, merchant_ids[start:start + INSERT_BATCH_ROWS]])
+    for collection in collections:
+        collection.flush()
+
+
+def measure(collection, queries, merchant_ids, limit):
+    """逐筆商家搜尋，回傳 (延遲 ms 清單, 回傳筆數清單)"""
+    search_params = {"metric_type": "IP", "params": {"nprobe": BENCH_NPROBE}}
+    latencies, hit_counts = [], []
+    for query, merchant_id in zip(queries, merchant_ids):
+        started = time.perf_counter()
+        hits = collection.search(data=[query.tolist()], anns_field="embedding", param=search_params,
+                                 limit=limit, expr=merchant_expr(merchant_id))[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        hit_counts.append(len(hits))
+    return latencies, hit_counts
+
+
+def shared_partition_merchants(collection, merchant_ids):
+    """與大商家位於同一分區的商家；僅本地引擎可得知分區配置，Milvus 回傳空集合"""
+    if not hasattr(collection, "partition_of"):
+        return set()
+    partitions = collection.partition_of(merchant_ids)
+    large_partition = collection.partition_of([LARGE_MERCHANT_ID])[0]
+    return set(np.asarray(merchant_ids)[partitions == large_partition].tolist())
+
+
+def summarize(latencies, hit_counts, merchant_ids, shared, limit):
+    """小商家 (不含同分區) / 同分區小商家 / 大商家的 p50 / p99，以及小商家結果填滿率"""
+    latencies, merchant_ids = np.asarray(latencies), np.asarray(merchant_ids)
+    groups = {
+        "small": (merchant_ids != LARGE_MERCHANT_ID) & ~np.isin(merchant_ids, list(shared)),
+        "shared": np.isin(merchant_ids, list(shared)),
+        "large": merchant_ids == LARGE_MERCHANT_ID,
+    }
+    summary = {}
+    for group, mask in groups.items():
+        if mask.any():
+            p50, p99 = np.percentile(latencies[mask], [50, 99])
+            summary[group] = (float(p50), float(p99))
+    small = merchant_ids != LARGE_MERCHANT_ID
+    summary["fill"] = float(np.mean(np.asarray(hit_counts)[small]) / limit)
+    return summary
+
+
+def run_bench(client, args):
+    """大商家商品數依 GROWTH_FACTORS 成長，比較純量過濾與 partition key 的商家搜尋延遲"""
+    rng = np.random.default_rng(args.seed)
+    collections = {
+        "純量過濾": create_bench_collection(client, f"{BENCH_COLLECTION_PREFIX}filter", args.dim, False),
+        "partition key": create_bench_collection(client, f"{BENCH_COLLECTION_PREFIX}partition_key", args.dim, True),
+    }
+    small_merchants = np.arange(1, args.merchants + 1)
+    shared = shared_partition_merchants(collections["partition key"], small_merchants)
+    rows = []
+    try:
+        # 小商家商品與大商家初始商品
+        merchant_ids = np.concatenate([np.repeat(small_merchants, args.small_rows),
+                                       np.full(args.large_rows, LARGE_MERCHANT_ID)])
+        insert_rows(list(collections.values()), np.arange(len(merchant_ids)), merchant_ids, rng, args.dim)
+        next_id, large_rows = len(merchant_ids), args.large_rows
+        for collection in collections.values():
+            collection.create_index("embedding", {"metric_type": "IP", "index_type": "IVF_FLAT",
+                                                  "params": {"nlist": BENCH_NLIST}})
+            collection.load()
+
+        for factor in GROWTH_FACTORS:
+            target = args.large_rows * factor
+            if target > large_rows:
+                insert_rows(list(collections.values()), np.arange(next_id, next_id + target - large_rows),
+                            np.full(target - large_rows, LARGE_MERCHANT_ID), rng, args.dim)
+                next_id += target - large_rows
+                large_rows = target
+
+            # 九成查詢來自小商家，一成來自大商家
+            query_merchants = np.where(rng.random(args.queries) < 0.9,
+                                       rng.choice(small_merchants, args.queries), LARGE_MERCHANT_ID)
+            queries = prepare_vectors("product_vectors", rng.random((args.queries, args.dim), dtype=np.float32))
+            for label, collection in collections.items():
+                latencies, hit_counts = measure(collection, queries, query_merchants, args.limit)
+                rows.append({"factor": factor, "large_rows": large_rows, "total_rows": next_id, "config": label,
+                             **summarize(latencies, hit_counts, query_merchants, shared, args.limit)})
+            print(f"  ✓ 大商家 {factor}× ({large_rows:,} 筆，總計 {next_id:,} 筆)")
+    finally:
+        for collection in collections.values():
+            collection.release()
+            if client is None:
+                from pymilvus import utility
+
+                utility.drop_collection(collection.name)
+    return rows, shared
+
+
+def print_rows(rows, shared):
+    def cell(row, group):
+        return f"{row[group][0]:>7.2f}/{row[group][1]:<7.2f}" if group in row else f"{'-':>15}"
+
+    print(f"\n{'大商家':>8}{'總筆數':>10}  {'設定':<14}{'小商家 p50/p99':>16}{'同分區 p50/p99':>16}{'大商家 p50/p99':>16}{'小商家填滿率':>10}")
+    for row in rows:
+        print(f"{row['factor']:>7}×{row['total_rows']:>10,}  {row['config']:<14}"
+              f"{cell(row, 'small'):>16}{cell(row, 'shared'):>16}{cell(row, 'large'):>16}{row['fill']:>10.0%}")
+    print(f"(延遲單位 ms；同分區: 與大商家雜湊到同一分區的小商家 {sorted(shared) or '無'}，無法與大商家隔離；"
+          f"填滿率: 小商家回傳筆數 / limit)")
+
+
+def load_query_vector(path):
+    """讀取查詢向量檔 (.npy 或 JSON 數字陣列)"""
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32).reshape(1, -1)
+    with open(path, encoding="utf-8") as f:
+        return np.asarray(json.load(f), dtype=np.float32).reshape(1, -1)
+
+
+def run_search(args):
+    """以既有商品的向量或向量檔搜尋單一商家的商品"""
+    from pymilvus import connections
+    from milvus_common import connect_to_milvus
+    from milvus_load_manager import CollectionLoadManager
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        load_manager = CollectionLoadManager()
+        load_manager.sync_loaded_collections()
+        collection = load_manager.acquire("product_vectors")
+        scope = MerchantScope(collection, args.merchant)
+        if args.product_id is not None:
+            rows = collection.query(expr=f"product_id == {args.product_id}", output_fields=["embedding"])
+            if not rows:
+                raise ValueError(f"找不到商品 {args.product_id}")
+            vector, label = np.asarray([rows[0]["embedding"]], dtype=np.float32), f"商品 {args.product_id} 的相似商品"
+        else:
+            vector, label = load_query_vector(args.vector_file), f"向量檔 {args.vector_file}"
+        hits = scope.search(vector, args.limit, expr=args.expr, output_fields=SEARCH_OUTPUT_FIELDS)[0]
+        print(f"🔍 商家 {args.merchant} 搜尋{label}: {len(hits)} 筆")
+        for hit in hits:
+            print(f"  - 商品 {hit.id} (類別 {hit.entity.get('category_id')}, {hit.entity.get('brand')}) "
+                  f"距離 {hit.distance:.4f}")
+    except Exception as e:
+        print(f"❌ 搜尋失敗: {e}")
+        sys.exit(1)
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="多商家商品搜尋 (merchant_id partition key)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search = subparsers.add_parser("search", help="搜尋單一商家的商品")
+    search.add_argument("--merchant", type=int, required=True)
+    query = search.add_mutually_exclusive_group(required=True)
+    query.add_argument("--product-id", type=int, help="以此商品的向量作為查詢")
+    query.add_argument("--vector-file", help="查詢向量檔 (.npy 或 JSON 數字陣列，維度同 product_vectors)")
+    search.add_argument("--expr", default=None, help="額外過濾條件，例如 category_id == 1")
+    search.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+
+    bench = subparsers.add_parser("bench", help="大商家成長時各商家的搜尋延遲隔離")
+    bench.add_argument("--merchants", type=int, default=DEFAULT_MERCHANTS)
+    bench.add_argument("--small-rows", type=int, default=DEFAULT_SMALL_ROWS)
+    bench.add_argument("--large-rows", type=int, default=DEFAULT_LARGE_ROWS)
+    bench.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    bench.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    bench.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    bench.add_argument("--milvus", action="store_true", help="使用 Milvus 而非本地引擎")
+    bench.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "search":
+        run_search(args)
+        return
+
+    if args.milvus:
+        from pymilvus import connections
+        from milvus_common import connect_to_milvus
+
+        if not connect_to_milvus():
+            sys.exit(1)
+        try:
+            rows, shared = run_bench(None, args)
+        except Exception as e:
+            print(f"❌ 測量失敗: {e}")
+            sys.exit(1)
+        finally:
+            connections.disconnect("default")
+            print("🔌 Milvus 連線已關閉")
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            client = LocalMilvus(data_dir)
+            rows, shared = run_bench(client, args)
+            client.close()
+    print_rows(rows, shared)
+
+
+if __name__ == "__main__":
+    main()
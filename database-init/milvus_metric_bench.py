@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+距離類型測量: 未正規化 L2 / 未正規化 IP / 正規化後 IP
+以與 milvus-init.py 相同的方式產生 product_vectors / user_vectors 向量 (隨機值 + 類別特徵偏移)，
+並以對數常態的長度倍率模擬熱門商品 / 活躍用戶的「長」向量，比較兩種設定的:
+  - 搜尋延遲 (逐筆查詢 p50 / p99)
+  - 索引 recall@k (相對同一距離類型的精確搜尋)
+  - cosine recall@k (相對精確 cosine 排名，即語意上想要的結果)
+  - 長向量佔比 (結果中屬於長度前 10% 的比例)
+用於決定 milvus_common.COLLECTION_METRICS 的設定
+
+用法:
+    python3 milvus_metric_bench.py                          # 本地引擎
+    python3 milvus_metric_bench.py --rows 100000 --milvus   # 實際 Milvus (建立暫時集合)
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pymilvus import CollectionSchema, DataType, FieldSchema
+
+from milvus_common import normalize_vectors
+from milvus_local_engine import LocalMilvus, brute_force_search
+
+# 測量設定
+DEFAULT_ROWS = 50_000
+DEFAULT_QUERIES = 200
+DEFAULT_LIMIT = 10
+DEFAULT_NLIST = 256
+DEFAULT_NPROBE = 16
+NORM_SIGMA = 0.5  # 長度倍率 lognormal(0, σ)
+LONG_VECTOR_QUANTILE = 0.9
+BENCH_COLLECTION_PREFIX = "metric_bench_"
+
+# 與 milvus-init.py / milvus-test-data.py 相同的維度與類別特徵區段
+COLLECTION_SPECS = {
+    "product_vectors": {"dim": 512, "n_categories": 5, "block": 100, "offset": 0.6},
+    "user_vectors": {"dim": 256, "n_categories": 5, "block": 50, "offset": 0.4},
+}
+
+# (名稱, 索引距離類型, 是否正規化)
+CONFIGS = (
+    ("L2 (未正規化)", "L2", False),
+    ("IP (未正規化)", "IP", False),
+    ("IP (正規化)", "IP", True),
+)
+
+
+def generate_vectors(n_rows, spec, rng):
+    """隨機值 + 類別區段偏移，再乘上長度倍率；回傳 (向量, 類別)"""
+    categories = rng.integers(0, spec["n_categories"], n_rows)
+    vectors = rng.random((n_rows, spec["dim"]), dtype=np.float32)
+    columns = categories[:, None] * spec["block"] + np.arange(spec["block"])
+    vectors[np.arange(n_rows)[:, None], columns] += spec["offset"]
+    vectors *= rng.lognormal(0.0, NORM_SIGMA, n_rows).astype(np.float32)[:, None]
+    return vectors, categories
+
+
+def exact_cosine_top_k(queries, vectors, k):
+    """精確 cosine 排名 (資料列索引)"""
+    indices, _ = brute_force_search(normalize_vectors(queries), normalize_vectors(vectors), k, "IP")
+    return indices
+
+
+def recall(results, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(found) & set(expected)) / k for found, expected in zip(results, truth)]))
+
+
+def create_collection(client, name, dim):
+    """建立測試集合 (client 為 LocalMilvus 時使用本地引擎，否則使用 Milvus)"""
+    schema = CollectionSchema(fields=[
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+    ], description="距離類型測量")
+    if client is not None:
+        return client.collection(name, schema)
+
+    from pymilvus import Collection, utility
+
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    return Collection(name=name, schema=schema, using='default', shards_num=1)
+
+
+def run_config(client, name, vectors, queries, metric, normalize, args):
+    """寫入、建立索引並逐筆搜尋，回傳 (結果資料列索引, 延遲 ms 清單)"""
+    suffix = f"{metric.lower()}_normalized" if normalize else metric.lower()
+    collection = create_collection(client, f"{BENCH_COLLECTION_PREFIX}{name}_{suffix}", vectors.shape[1])
+    try:
+        stored = normalize_vectors(vectors) if normalize else vectors
+        for start in range(0, len(stored), 10_000):
+            block = stored[start:start + 10_000]
+            collection.insert([np.arange(start, start + len(block)), block])
+        collection.flush()
+        collection.create_index("embedding", {"metric_type": metric, "index_type": "IVF_FLAT",
+                                              "params": {"nlist": args.nlist}})
+        collection.load()
+
+        search_params = {"metric_type": metric, "params": {"nprobe": args.nprobe}}
+        query_block = normalize_vectors(queries) if normalize else queries
+        results, latencies = [], []
+        for query in query_block:
+            began = time.perf_counter()
+            hits = collection.search(data=[query.tolist()], anns_field="embedding",
+                                     param=search_params, limit=args.limit)[0]
+            latencies.append((time.perf_counter() - began) * 1000)
+            results.append([hit.id for hit in hits])
+        return results, latencies
+    finally:
+        collection.release()
+        if client is None:
+            from pymilvus import utility
+
+            utility.drop_collection(collection.name)
+
+
+def bench_collection(client, name, args, rng):
+    """測量單一集合的各設定，回傳結果清單"""
+    spec = COLLECTION_SPECS[name]
+    vectors, _ = generate_vectors(args.rows, spec, rng)
+    # 查詢以相同方式產生 (同樣帶有長度倍率)
+    queries, _ = generate_vectors(args.queries, spec, rng)
+
+    norms = np.linalg.norm(vectors, axis=1)
+    long_rows = norms >= np.quantile(norms, LONG_VECTOR_QUANTILE)
+    cosine_truth = exact_cosine_top_k(queries, vectors, args.limit)
+
+    rows = []
+    for label, metric, normalize in CONFIGS:
+        stored = normalize_vectors(vectors) if normalize else vectors
+        query_block = normalize_vectors(queries) if normalize else queries
+        metric_truth, _ = brute_force_search(query_block, stored, args.limit, metric)
+
+        results, latencies = run_config(client, name, vectors, queries, metric, normalize, args)
+        found = np.array([ids + [-1] * (args.limit - len(ids)) for ids in results])
+        p50, p99 = np.percentile(latencies, [50, 99])
+        rows.append({
+            "collection": name,
+            "config": label,
+            "p50_ms": float(p50),
+            "p99_ms": float(p99),
+            "index_recall": recall(found, metric_truth),
+            "cosine_recall": recall(found, cosine_truth),
+            "long_share": float(long_rows[found[found >= 0]].mean()),
+        })
+    return rows
+
+
+def print_rows(rows):
+    print(f"\n{'集合':<16}{'設定':<14}{'p50 ms':>8}{'p99 ms':>8}{'索引 recall':>12}{'cosine recall':>15}{'長向量佔比':>10}")
+    for row in rows:
+        print(f"{row['collection']:<16}{row['config']:<14}{row['p50_ms']:>8.2f}{row['p99_ms']:>8.2f}"
+              f"{row['index_recall']:>12.3f}{row['cosine_recall']:>15.3f}{row['long_share']:>10.1%}")
+    print(f"(長向量: 長度前 {1 - LONG_VECTOR_QUANTILE:.0%}，均勻分布時佔比約 {1 - LONG_VECTOR_QUANTILE:.0%})")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="未正規化 L2 與正規化 IP 的延遲 / recall 比較")
+    parser.add_argument("--collections", nargs="*", default=list(COLLECTION_SPECS), choices=COLLECTION_SPECS)
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--nlist", type=int, default=DEFAULT_NLIST)
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    parser.add_argument("--milvus", action="store_true", help="使用 Milvus 而非本地引擎")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    rows = []
+    if args.milvus:
+        from pymilvus import connections
+        from milvus_common import connect_to_milvus
+
+        if not connect_to_milvus():
+            sys.exit(1)
+        try:
+            for name in args.collections:
+                rows.extend(bench_collection(None, name, args, rng))
+        except Exception as e:
+            print(f"❌ 測量失敗: {e}")
+            sys.exit(1)
+        finally:
+            connections.disconnect("default")
+            print("🔌 Milvus 連線已關閉")
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            client = LocalMilvus(data_dir)
+            for name in args.collections:
+                rows.extend(bench_collection(client, name, args, rng))
+            client.close()
+    print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()
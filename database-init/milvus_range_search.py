@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+門檻式 (range) 相似度搜尋
+以 Milvus range search 取回半徑內或相似度高於門檻的所有鄰居 (並設上限)，
+查詢以批次送出，供 product_similarity 產生只含有意義配對的資料
+"""
+
+import time
+
+import numpy as np
+
+from milvus_common import collection_search_params, normalize_vectors
+
+# 搜尋設定
+DEFAULT_MIN_SIMILARITY = 0.72
+DEFAULT_MAX_NEIGHBORS = 10
+DEFAULT_BATCH_SIZE = 256
+L2_CANDIDATE_OVERSAMPLE = 4
+MAX_SEARCH_LIMIT = 16384  # Milvus topk 上限
+RADIUS_EPSILON = 1e-6
+
+
+def range_search(collection, query_vectors, radius, range_filter=None,
+                 max_neighbors=DEFAULT_MAX_NEIGHBORS, batch_size=DEFAULT_BATCH_SIZE,
+                 anns_field="embedding", search_params=None, expr=None, output_fields=None):
+    """批次 range search，回傳每個查詢的 Hit 清單
+
+    L2 回傳 range_filter <= 距離 < radius；IP/COSINE 回傳 radius < 分數 <= range_filter。
+    每個查詢最多 max_neighbors 筆，依距離由近到遠；search_params 預設依集合距離類型
+    """
+    search_params = search_params or collection_search_params(collection.name)
+    params = dict(search_params.get("params", {}), radius=radius)
+    if range_filter is not None:
+        params["range_filter"] = range_filter
+    param = dict(search_params, params=params)
+
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+    results = []
+    for start in range(0, len(query_vectors), batch_size):
+        batch = query_vectors[start:start + batch_size]
+        results.extend(collection.search(
+            data=batch.tolist(), anns_field=anns_field, param=param,
+            limit=min(max_neighbors, MAX_SEARCH_LIMIT), expr=expr, output_fields=output_fields or [],
+        ))
+    return results
+
+
+def l2_radius_for_cosine(query_norms, norm_range, min_similarity):
+    """涵蓋所有 cosine ≥ 門檻向量的 L2 平方距離半徑
+
+    d = |q|² + |v|² - 2·cos·|q|·|v| 對 |v| 為凸函數，上界取資料向量長度範圍的兩端
+    """
+    low, high = norm_range
+    bound = lambda norms: query_norms ** 2 + norms ** 2 - 2 * min_similarity * query_norms * norms
+    return float(np.maximum(bound(low), bound(high)).max()) + RADIUS_EPSILON
+
+
+def similar_neighbors(collection, query_vectors, min_similarity=DEFAULT_MIN_SIMILARITY,
+                      max_neighbors=DEFAULT_MAX_NEIGHBORS, batch_size=DEFAULT_BATCH_SIZE,
+                      anns_field="embedding", search_params=None, norm_range=(1.0, 1.0), expr=None):
+    """回傳每個查詢 (鄰居 ID, cosine 相似度)，只含相似度 ≥ 門檻者，依相似度由高到低
+
+    COSINE / IP 索引直接以門檻為 radius；L2 索引以 norm_range (資料向量長度範圍) 換算
+    涵蓋半徑取回候選，再以回傳的向量計算精確 cosine 篩選
+    """
+    search_params = search_params or collection_search_params(collection.name)
+    metric = search_params.get("metric_type", "L2")
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+
+    if metric in ("IP", "COSINE"):
+        # IP 集合寫入時已正規化，查詢也正規化後分數即為 cosine
+        hits = range_search(collection, normalize_vectors(query_vectors), min_similarity - RADIUS_EPSILON,
+                            max_neighbors=max_neighbors, batch_size=batch_size,
+                            anns_field=anns_field, search_params=search_params, expr=expr)
+        return [
+            (np.array([hit.id for hit in query_hits]),
+             np.array([hit.distance for hit in query_hits], dtype=np.float32))
+            for query_hits in hits
+        ]
+
+    neighbors = []
+    for start in range(0, len(query_vectors), batch_size):
+        batch = query_vectors[start:start + batch_size]
+        query_norms = np.linalg.norm(batch, axis=1)
+        radius = l2_radius_for_cosine(query_norms, norm_range, min_similarity)
+        hits = range_search(collection, batch, radius,
+                            max_neighbors=max_neighbors * L2_CANDIDATE_OVERSAMPLE, batch_size=batch_size,
+                            anns_field=anns_field, search_params=search_params, expr=expr,
+                            output_fields=[anns_field])
+        for query, query_norm, query_hits in zip(batch, query_norms, hits):
+            if not query_hits:
+                neighbors.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            ids = np.array([hit.id for hit in query_hits])
+            vectors = np.asarray([hit.entity.get(anns_field) for hit in query_hits], dtype=np.float32)
+            similarity = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1) * query_norm, 1e-12)
+            keep = np.flatnonzero(similarity >= min_similarity)
+            keep = keep[np.argsort(-similarity[keep], kind="stable")][:max_neighbors]
+            neighbors.append((ids[keep], similarity[keep].astype(np.float32)))
+    return neighbors
+
+
+def build_similarity_pairs(product_collection, min_similarity=DEFAULT_MIN_SIMILARITY,
+                           max_neighbors=DEFAULT_MAX_NEIGHBORS, batch_size=DEFAULT_BATCH_SIZE,
+                           id_field="product_id", anns_field="embedding", search_params=None,
+                           similarity_type="content_based"):
+    """掃描整個商品集合產生 product_similarity 欄位資料，配對數量隨實際相似度變動
+
+    回傳 (可直接 insert 的欄位清單, 統計)
+    """
+    start_time = time.time()
+    product_ids, embeddings = [], []
+    iterator = product_collection.query_iterator(batch_size=batch_size * 4, output_fields=[anns_field])
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        for row in rows:
+            product_ids.append(row[id_field])
+            embeddings.append(row[anns_field])
+    iterator.close()
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1) if len(embeddings) else np.ones(1)
+    # 多取一筆以扣除查詢商品本身
+    neighbors = similar_neighbors(
+        product_collection, embeddings, min_similarity, max_neighbors + 1, batch_size,
+        anns_field, search_params, norm_range=(float(norms.min()), float(norms.max())),
+    )
+
+    id_1s, id_2s, scores = [], [], []
+    for product_id, (neighbor_ids, similarity) in zip(product_ids, neighbors):
+        others = neighbor_ids != product_id
+        neighbor_ids, similarity = neighbor_ids[others][:max_neighbors], similarity[others][:max_neighbors]
+        id_1s.extend([product_id] * len(neighbor_ids))
+        id_2s.extend(neighbor_ids.tolist())
+        scores.extend(np.round(similarity, 4).tolist())
+
+    per_product = np.bincount(np.unique(id_1s, return_inverse=True)[1]) if id_1s else np.zeros(0, dtype=np.int64)
+    created_at = int(time.time())
+    data = [id_1s, id_2s, scores, [similarity_type] * len(id_1s), [created_at] * len(id_1s)]
+    stats = {
+        "products": len(product_ids),
+        "pairs": len(id_1s),
+        "products_without_pairs": len(product_ids) - len(per_product),
+        "capped_products": int((per_product >= max_neighbors).sum()),
+        "elapsed_s": time.time() - start_time,
+    }
+    return data, stats
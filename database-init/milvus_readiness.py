@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+載入後暖機與就緒判斷
+collection.load() 完成後，前幾次搜尋仍因快取與 segment 暖機而明顯較慢。
+ReadinessGate 先輪詢載入進度，再以暖機查詢 (product_vectors 取樣商品向量、
+user_vectors 取樣 search_history 查詢向量) 逐輪逐筆搜尋，直到連續數輪 p99 變化在容許範圍內
+才標記為就緒；status() 提供就緒狀態與各階段耗時，供服務 /ready 端點與初始化腳本使用
+
+用法:
+    python3 milvus_readiness.py                                   # product_vectors + user_vectors
+    python3 milvus_readiness.py --collections product_vectors --max-seconds 60
+結束碼: 0 = 就緒且延遲已穩定, 2 = 暖機逾時 (仍標記就緒), 1 = 失敗
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import numpy as np
+from pymilvus import DataType
+
+from milvus_common import collection_search_params, prepare_vectors
+from milvus_load_manager import LOAD_POLL_INTERVAL_SECONDS, LOAD_TIMEOUT_SECONDS, parse_loading_progress
+
+# 暖機設定
+DEFAULT_COLLECTIONS = ("product_vectors", "user_vectors")
+DEFAULT_WARMUP_QUERIES = 200
+ROUND_SIZE = 50  # 每輪逐筆搜尋數
+STABLE_TOLERANCE = 0.15  # 相鄰兩輪 p99 相對變化上限
+STABLE_ROUNDS = 3  # 連續穩定輪數
+MAX_WARMUP_SECONDS = 120
+WARMUP_LIMIT = 10
+SAMPLE_OVERSCAN = 5  # 取樣時多讀幾倍資料列再隨機挑選
+
+# 暖機查詢來源: 集合 → (來源集合, 向量欄位)，與實際流量的查詢向量相同
+WARMUP_QUERY_SOURCES = {
+    "product_vectors": ("product_vectors", "embedding"),
+    "user_vectors": ("search_history", "query_vector"),
+}
+
+
+def vector_field(collection):
+    """集合的第一個浮點向量欄位 (名稱, 維度)"""
+    for field in collection.schema.fields:
+        if field.dtype == DataType.FLOAT_VECTOR:
+            return field.name, field.params["dim"]
+    raise ValueError(f"集合 {collection.name} 沒有 FLOAT_VECTOR 欄位")
+
+
+def sample_warmup_queries(collection, n_queries=DEFAULT_WARMUP_QUERIES, source_collection=None,
+                          field_name=None, seed=0):
+    """由來源集合 (需已載入) 取樣暖機查詢向量；來源不存在或無資料時以隨機向量代替"""
+    rng = np.random.default_rng(seed)
+    _, dim = vector_field(collection)
+    vectors = np.zeros((0, dim), dtype=np.float32)
+    if source_collection is not None:
+        try:
+            rows = source_collection.query(expr="", output_fields=[field_name], limit=n_queries * SAMPLE_OVERSCAN)
+            vectors = np.array([row[field_name] for row in rows], dtype=np.float32).reshape(-1, dim)
+        except Exception as e:
+            print(f"⚠️ 無法由 {source_collection.name} 取樣暖機查詢: {e}")
+    if len(vectors):
+        vectors = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    else:
+        vectors = rng.random((n_queries, dim), dtype=np.float32)
+    return prepare_vectors(collection.name, vectors)
+
+
+def milvus_loading_progress(collection):
+    """以 utility.loading_progress 取得 0-100 的載入進度"""
+    from pymilvus import utility
+
+    return parse_loading_progress(utility.loading_progress(collection.name, using=collection._using))
+
+
+class ReadinessGate:
+    """依序等待集合載入並暖機；所有集合延遲穩定後 ready 為 True
+
+    暖機查詢依 WARMUP_QUERY_SOURCES 由集合本身或 source_collections 中的來源集合取樣，
+    也可由 queries 直接指定 (取樣筆數為 n_queries)；progress_fn(collection) 回傳 0-100 的載入進度，
+    None 表示 load() 為同步 (例如本地引擎)
+    """
+
+    def __init__(self, collections, queries=None, source_collections=None, progress_fn=milvus_loading_progress,
+                 n_queries=DEFAULT_WARMUP_QUERIES, round_size=ROUND_SIZE, tolerance=STABLE_TOLERANCE, stable_rounds=STABLE_ROUNDS,
+                 max_seconds=MAX_WARMUP_SECONDS, load_timeout=LOAD_TIMEOUT_SECONDS):
+        self.collections = list(collections)
+        self.queries = queries or {}
+        self.source_collections = source_collections or {}
+        self.progress_fn = progress_fn
+        self.n_queries = n_queries
+        self.round_size = round_size
+        self.tolerance = tolerance
+        self.stable_rounds = stable_rounds
+        self.max_seconds = max_seconds
+        self.load_timeout = load_timeout
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._status = {
+            collection.name: {"state": "pending", "load_s": None, "warmup_s": None, "rounds": [], "stable": False}
+            for collection in self.collections
+        }
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """阻塞直到就緒或逾時，回傳是否就緒"""
+        return self._ready.wait(timeout)
+
+    def _update(self, name, **values):
+        with self._lock:
+            self._status[name].update(values)
+
+    def status(self):
+        """就緒狀態與各集合的載入 / 暖機耗時、每輪 p50 / p99"""
+        with self._lock:
+            collections = {name: dict(item, rounds=list(item["rounds"])) for name, item in self._status.items()}
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {"ready": self.ready, "elapsed_s": elapsed, "error": self.error, "collections": collections}
+
+    def wait_until_loaded(self, collection):
+        """輪詢載入進度直到 100%，回傳耗時"""
+        started = time.time()
+        if self.progress_fn is None:
+            return 0.0
+        while self.progress_fn(collection) < 100:
+            if time.time() - started > self.load_timeout:
+                raise TimeoutError(f"集合 {collection.name} 載入逾時 ({self.load_timeout}s)")
+            time.sleep(LOAD_POLL_INTERVAL_SECONDS)
+        return time.time() - started
+
+    def warm_up(self, collection, queries):
+        """逐輪逐筆搜尋，直到連續 stable_rounds 輪 p99 相對變化在 tolerance 內；回傳是否穩定"""
+        anns_field, _ = vector_field(collection)
+        search_params = collection_search_params(collection.name)
+        data = queries.tolist()
+        deadline = time.time() + self.max_seconds
+        stable, previous_p99, position = 0, None, 0
+
+        while time.time() < deadline:
+            latencies = []
+            for _ in range(self.round_size):
+                started = time.perf_counter()
+                collection.search(data=[data[position % len(data)]], anns_field=anns_field,
+                                  param=search_params, limit=WARMUP_LIMIT)
+                latencies.append((time.perf_counter() - started) * 1000)
+                position += 1
+            p50, p99 = np.percentile(latencies, [50, 99])
+            with self._lock:
+                self._status[collection.name]["rounds"].append({"p50_ms": float(p50), "p99_ms": float(p99)})
+
+            if previous_p99 is not None and abs(p99 - previous_p99) <= self.tolerance * previous_p99:
+                stable += 1
+                if stable >= self.stable_rounds:
+                    return True
+            else:
+                stable = 0
+            previous_p99 = p99
+        return False
+
+    def run(self):
+        """依序載入並暖機所有集合，回傳是否全部穩定 (逾時仍標記就緒)"""
+        self.started_at = time.time()
+        all_stable = True
+        try:
+            for collection in self.collections:
+                name = collection.name
+                self._update(name, state="loading")
+                self._update(name, load_s=self.wait_until_loaded(collection), state="warming")
+
+                queries = self.queries.get(name)
+                if queries is None:
+                    source_name, field_name = WARMUP_QUERY_SOURCES.get(name, (None, None))
+                    source = collection if source_name == name else self.source_collections.get(source_name)
+                    queries = sample_warmup_queries(collection, self.n_queries, source_collection=source,
+                                                    field_name=field_name)
+                started = time.time()
+                stable = self.warm_up(collection, queries)
+                self._update(name, warmup_s=time.time() - started, stable=stable, state="ready")
+                all_stable &= stable
+                if not stable:
+                    print(f"⚠️ {name} 暖機 {self.max_seconds}s 內延遲未穩定，仍標記為就緒")
+        except Exception as e:
+            self.error = str(e)
+            print(f"❌ 就緒檢查失敗: {e}")
+            return False
+        finally:
+            self.finished_at = time.time()
+        self._ready.set()
+        return all_stable
+
+    def start(self):
+        """於背景執行緒執行 run()"""
+        thread = threading.Thread(target=self.run, name="milvus-readiness", daemon=True)
+        thread.start()
+        return thread
+
+
+def print_status(status):
+    for name, item in status["collections"].items():
+        rounds = item["rounds"]
+        if not rounds:
+            print(f"  - {name}: {item['state']}")
+            continue
+        first, last = rounds[0], rounds[-1]
+        print(f"  - {name}: 載入 {item['load_s']:.2f}s, 暖機 {item['warmup_s']:.2f}s ({len(rounds)} 輪), "
+              f"p99 {first['p99_ms']:.2f} → {last['p99_ms']:.2f} ms, "
+              f"p50 {first['p50_ms']:.2f} → {last['p50_ms']:.2f} ms{'' if item['stable'] else ' (未穩定)'}")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Milvus 載入後暖機與就緒判斷")
+    parser.add_argument("--collections", nargs="*", default=list(DEFAULT_COLLECTIONS))
+    parser.add_argument("--queries", type=int, default=DEFAULT_WARMUP_QUERIES)
+    parser.add_argument("--round-size", type=int, default=ROUND_SIZE)
+    parser.add_argument("--tolerance", type=float, default=STABLE_TOLERANCE)
+    parser.add_argument("--max-seconds", type=float, default=MAX_WARMUP_SECONDS)
+    args = parser.parse_args()
+
+    from pymilvus import connections, utility
+    from milvus_common import connect_to_milvus
+    from milvus_load_manager import CollectionLoadManager
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        load_manager = CollectionLoadManager()
+        load_manager.sync_loaded_collections()
+        collections = [load_manager.acquire(name, wait=False) for name in args.collections]
+        sources = {name: load_manager.acquire(name) for name, _ in
+                   (WARMUP_QUERY_SOURCES[c] for c in args.collections if c in WARMUP_QUERY_SOURCES)
+                   if name not in args.collections and utility.has_collection(name)}
+        gate = ReadinessGate(collections, source_collections=sources, n_queries=args.queries,
+                             round_size=args.round_size,
+                             tolerance=args.tolerance, max_seconds=args.max_seconds)
+        stable = gate.run()
+        status = gate.status()
+        print(f"{'✅' if status['ready'] else '❌'} 就緒: {status['ready']} ({status['elapsed_s']:.2f}s)")
+        print_status(status)
+        exit_code = 0 if stable else (2 if status["ready"] else 1)
+    except Exception as e:
+        print(f"❌ 就緒檢查失敗: {e}")
+        exit_code = 1
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+"""
+微批次推薦服務 (asyncio)
+數毫秒內同時到達的請求合併為一次多向量 (nq > 1) 搜尋，結果再分送回各請求；
+同一商品 / 用戶的並行請求只佔一個查詢位置。相似商品搜尋先查語意快取 (milvus_semantic_cache.py)，
+只有未命中的查詢送到 product_vectors。結果由本地商品資料補齊欄位，
+/metrics 提供各端點延遲與批次大小統計。
+沒有預先計算推薦的新用戶若帶有 category_id (偏好或瀏覽中的分類)，
+改以分類質心 (milvus_category_centroids.py) 搜尋商品，質心定期增量更新。
+下架商品以排除位元表 (milvus_deactivation.py 狀態檔，定期重新載入) 從結果排除並補足筆數；
+用戶的預先計算推薦排除後不足 limit 筆時，以其推薦商品向量的平均一次 nq > 1 搜尋 product_vectors 補足
+(user_vectors 為 256 維行為向量，與 512 維商品向量不在同一空間，不能直接以用戶向量搜尋商品)
+
+端點:
+    GET /recommendations/similar/<product_id>?limit=10
+    GET /recommendations?user_id=<user_id>&category_id=<category_id>&limit=10
+    GET /metrics
+    GET /health
+    GET /ready     (product_vectors 載入並暖機、延遲穩定前回傳 503)
+
+用法:
+    python3 milvus_recommend_service.py serve --port 8090
+    python3 milvus_recommend_service.py bench --requests 5000 --concurrency 200  # 本地引擎壓測
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from milvus_category_centroids import CategoryCentroids, cold_start_search
+from milvus_common import collection_search_params, metric_type, prepare_vectors
+from milvus_deactivation import ExclusionBitset, ExclusionState, search_live
+from milvus_semantic_cache import DEFAULT_DISTANCE_THRESHOLD, CachedProductSearcher, SemanticQueryCache
+
+# 批次設定
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 3.0
+DEFAULT_MAX_INFLIGHT_BATCHES = 2
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+METRICS_WINDOW = 10_000
+DEFAULT_PORT = 8090
+EXECUTOR_WORKERS = 4
+DEFAULT_CENTROID_REFRESH_S = 300
+DEFAULT_EXCLUSIONS_RELOAD_S = 10
+DEFAULT_CACHE_ENTRIES = 8192  # 0 表示不使用語意快取
+DEFAULT_CACHE_TTL_S = 300  # 新增商品最晚在此時間後出現在相似商品結果
+
+# 價格區間編碼 → 代表價格 (本地商品資料的替代值)
+PRICE_BY_RANGE = {1: 299, 2: 1290, 3: 4990, 4: 15900, 5: 39900}
+
+
+class LatencyStats:
+    """保留最近 METRICS_WINDOW 筆數值並計算分位數"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.values = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value):
+        self.values.append(value)
+        self.count += 1
+
+    def summary(self):
+        if not self.values:
+            return {"count": self.count}
+        p50, p95, p99 = np.percentile(self.values, [50, 95, 99])
+        return {"count": self.count, "mean": float(np.mean(self.values)),
+                "p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(self.values))}
+
+
+class MicroBatcher:
+    """將等待中的請求鍵合併成批次呼叫 batch_fn(keys) -> 結果清單
+
+    相同鍵在等待中或執行中時共用同一個結果；達到 max_batch_size 或等待 max_wait_ms 後送出。
+    執行中的批次達 max_inflight 時暫不送出，請求持續累積，批次完成後立即送出下一批
+    batch_fn 為阻塞函數，於執行緒池中執行
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, executor=None, max_inflight=DEFAULT_MAX_INFLIGHT_BATCHES):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.max_inflight = max_inflight
+        self._pending = {}
+        self._inflight = {}
+        self._running = 0
+        self._timer = None
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.batch_sizes = LatencyStats()
+        self.batch_ms = LatencyStats()
+
+    async def submit(self, key):
+        self.requests += 1
+        future = self._pending.get(key) or self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._timer is None and self._running < self.max_inflight:
+                self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        # shield: 單一請求取消時不影響共用同一結果的其他請求
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running >= self.max_inflight:
+            return
+        batch = dict(list(self._pending.items())[:self.max_batch_size])
+        for key in batch:
+            del self._pending[key]
+        if batch:
+            self._running += 1
+            self._inflight.update(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        keys = list(batch)
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.batch_fn, keys)
+        except Exception as e:
+            self.errors += 1
+            results = None
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._running -= 1
+            for key in keys:
+                self._inflight.pop(key, None)
+            if self._pending:
+                self._flush()
+
+        self.batch_sizes.add(len(keys))
+        self.batch_ms.add((time.perf_counter() - started) * 1000)
+        if results is not None:
+            for key, result in zip(keys, results):
+                if not batch[key].done():
+                    batch[key].set_result(result)
+
+    def metrics(self):
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "batch_size": self.batch_sizes.summary(),
+            "batch_ms": self.batch_ms.summary(),
+        }
+
+
+class ProductStore:
+    """本地商品資料 (代替 PostgreSQL products 表): product_id → 名稱、價格、庫存、狀態"""
+
+    def __init__(self, products):
+        self.products = {int(product["product_id"]): product for product in products}
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_collection(cls, collection, batch_size=10_000):
+        """由 product_vectors 的純量欄位產生替代商品資料"""
+        products = []
+        iterator = collection.query_iterator(
+            batch_size=batch_size, output_fields=["category_id", "price_range", "brand"]
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            for row in rows:
+                products.append({
+                    "product_id": row["product_id"],
+                    "name": f"{row['brand']} 商品 {row['product_id']}",
+                    "brand": row["brand"],
+                    "category_id": row["category_id"],
+                    "price": PRICE_BY_RANGE.get(row["price_range"], 0),
+                    "stock_quantity": 100,
+                    "status": "active",
+                })
+        iterator.close()
+        return cls(products)
+
+    def hydrate(self, scored_ids, limit):
+        """依序補齊商品欄位，略過不存在或非 active 的商品"""
+        items = []
+        for product_id, score in scored_ids:
+            product = self.products.get(product_id)
+            if product is None or product.get("status") != "active":
+                continue
+            items.append(dict(product, score=score))
+            if len(items) >= limit:
+                break
+        return items
+
+
+class RecommendationService:
+    """相似商品、用戶推薦與冷啟動推薦，各自以 MicroBatcher 合併請求"""
+
+    def __init__(self, product_collection, recommendation_collection, product_store,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 search_params=None, centroids=None, exclusions=None, readiness=None, search_cache=None):
+        self.product_collection = product_collection
+        self.search_cache = search_cache
+        self.recommendation_collection = recommendation_collection
+        self.product_store = product_store
+        self.centroids = centroids
+        self.exclusions = exclusions or ExclusionBitset()
+        self.readiness = readiness
+        self.search_params = search_params or collection_search_params(product_collection.name)
+        self.executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+        self.similar_batcher = MicroBatcher("similar_product", self._similar_batch,
+                                            max_batch_size, max_wait_ms, self.executor)
+        self.user_batcher = MicroBatcher("user_recommendations", self._user_batch,
+                                         max_batch_size, max_wait_ms, self.executor)
+        self.cold_start_batcher = MicroBatcher("cold_start", self._cold_start_batch,
+                                               max_batch_size, max_wait_ms, self.executor)
+        self.latency = {"similar_product": LatencyStats(), "user_recommendations": LatencyStats(),
+                        "cold_start": LatencyStats()}
+        self.started_at = time.time()
+        self.user_refills = 0
+
+    def _similar_batch(self, product_ids):
+        """一次查詢取回所有向量，再以一次 nq > 1 搜尋取得鄰居 (多取一筆以排除商品本身，並略過下架商品)
+
+        有語意快取時先查快取，只有未命中的向量送出搜尋
+        """
+        rows = self.product_collection.query(
+            expr=f"product_id in {list(product_ids)}", output_fields=["embedding"]
+        )
+        embeddings = {row["product_id"]: row["embedding"] for row in rows}
+        found = [product_id for product_id in product_ids if product_id in embeddings]
+
+        neighbors = {}
+        if found:
+            vectors = [embeddings[product_id] for product_id in found]
+            if self.search_cache is not None:
+                results = [[(record["id"], record["distance"]) for record in records]
+                           for records in self.search_cache.search(vectors, MAX_LIMIT + 1,
+                                                                   exclusions=self.exclusions)]
+            else:
+                results = [[(hit.id, hit.distance) for hit in hits]
+                           for hits in search_live(self.product_collection, vectors, MAX_LIMIT + 1,
+                                                   self.exclusions, param=self.search_params)]
+            for product_id, hits in zip(found, results):
+                neighbors[product_id] = [(pid, float(distance)) for pid, distance in hits if pid != product_id]
+        return [neighbors.get(product_id) for product_id in product_ids]
+
+    def _user_batch(self, keys):
+        """以一次 in 查詢取回多位用戶的預先計算推薦 (鍵為 (user_id, limit))；
+        排除下架商品後不足 limit 筆的用戶，再以 _refill_users 補足"""
+        needed = {}
+        for user_id, limit in keys:
+            needed[user_id] = max(needed.get(user_id, 0), limit)
+        rows = self.recommendation_collection.query(
+            expr=f"user_id in {list(needed)}", output_fields=["user_id", "product_id", "score"]
+        )
+        by_user = {user_id: [] for user_id in needed}
+        recommended = {user_id: [] for user_id in needed}
+        excluded = self.exclusions.contains([row["product_id"] for row in rows])
+        for row, skip in zip(rows, excluded):
+            recommended[row["user_id"]].append(row["product_id"])
+            if not skip:
+                by_user[row["user_id"]].append((row["product_id"], float(row["score"])))
+        for scored in by_user.values():
+            scored.sort(key=lambda item: item[1], reverse=True)
+
+        short = {user_id: limit - len(by_user[user_id]) for user_id, limit in needed.items()
+                 if recommended[user_id] and len(by_user[user_id]) < limit}
+        if short:
+            for user_id, extra in self._refill_users(short, recommended).items():
+                by_user[user_id].extend(extra)
+        return [by_user[user_id] for user_id, _ in keys]
+
+    def _refill_users(self, short, recommended):
+        """short 為 {user_id: 缺少筆數}；以每位用戶推薦商品 (含已下架) 向量的平均一次 nq > 1 搜尋，
+        排除下架與已推薦的商品，回傳 {user_id: [(product_id, 分數)]} (接在預先計算的推薦之後)"""
+        product_ids = sorted({product_id for user_id in short for product_id in recommended[user_id]})
+        rows = self.product_collection.query(expr=f"product_id in {product_ids}", output_fields=["embedding"])
+        embeddings = {row["product_id"]: row["embedding"] for row in rows}
+        users = [user_id for user_id in short if any(pid in embeddings for pid in recommended[user_id])]
+        if not users:
+            return {}
+        vectors = prepare_vectors(self.product_collection.name, [
+            np.mean([embeddings[pid] for pid in recommended[user_id] if pid in embeddings], axis=0)
+            for user_id in users
+        ])
+        fetch = max(short[user_id] + len(recommended[user_id]) for user_id in users)
+        results = search_live(self.product_collection, vectors.tolist(), fetch, self.exclusions,
+                              param=self.search_params)
+        self.user_refills += len(users)
+        refill = {}
+        for user_id, hits in zip(users, results):
+            seen = set(recommended[user_id])
+            refill[user_id] = [(hit.id, float(hit.distance)) for hit in hits if hit.id not in seen][:short[user_id]]
+        return refill
+
+    def _cold_start_batch(self, category_ids):
+        """所有分類的質心 / 子質心合併為一次多向量搜尋 (搜尋時排除下架商品並補滿筆數)"""
+        return cold_start_search(self.product_collection, self.centroids, category_ids,
+                                 MAX_LIMIT, self.search_params, exclusions=self.exclusions)
+
+    async def similar_products(self, product_id, limit=DEFAULT_LIMIT):
+        started = time.perf_counter()
+        neighbors = await self.similar_batcher.submit(product_id)
+        items = None if neighbors is None else self.product_store.hydrate(neighbors, limit)
+        self.latency["similar_product"].add((time.perf_counter() - started) * 1000)
+        return items
+
+    async def user_recommendations(self, user_id, limit=DEFAULT_LIMIT, category_id=None):
+        """用戶沒有預先計算的推薦且提供 category_id 時，改以分類質心搜尋"""
+        started = time.perf_counter()
+        scored = await self.user_batcher.submit((user_id, limit))
+        endpoint = "user_recommendations"
+        if not scored and category_id is not None and self.centroids is not None:
+            scored = await self.cold_start_batcher.submit(category_id)
+            endpoint = "cold_start"
+        items = self.product_store.hydrate(scored, limit)
+        self.latency[endpoint].add((time.perf_counter() - started) * 1000)
+        return items
+
+    async def refresh_centroids(self, interval_s, path=None):
+        """定期只掃描新增商品更新分類質心，指定 path 時一併寫回磁碟"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                added = await loop.run_in_executor(self.executor, self.centroids.refresh, self.product_collection)
+                if added and path:
+                    await loop.run_in_executor(self.executor, self.centroids.save, path)
+            except Exception as e:
+                print(f"⚠️ 分類質心更新失敗: {e}")
+
+    async def reload_exclusions(self, path, interval_s):
+        """狀態檔修改時間變更時重新載入排除位元表 (整個替換，不需加鎖)"""
+        loaded_mtime = None
+        while True:
+            try:
+                mtime = os.path.getmtime(path) if os.path.exists(path) else None
+                if mtime != loaded_mtime:
+                    self.exclusions = ExclusionState.load(path).bitset()
+                    loaded_mtime = mtime
+            except Exception as e:
+                print(f"⚠️ 排除表載入失敗: {e}")
+            await asyncio.sleep(interval_s)
+
+    def metrics(self):
+        return {
+            "uptime_s": time.time() - self.started_at,
+            "latency_ms": {name: stats.summary() for name, stats in self.latency.items()},
+            "batchers": {batcher.name: batcher.metrics()
+                         for batcher in (self.similar_batcher, self.user_batcher, self.cold_start_batcher)},
+            "centroids": None if self.centroids is None else {
+                "categories": len(self.centroids),
+                "watermark": self.centroids.watermark,
+                "updated_at": self.centroids.updated_at,
+            },
+            "excluded_products": len(self.exclusions),
+            "user_refills": self.user_refills,
+            "semantic_cache": None if self.search_cache is None else self.search_cache.stats(),
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def build_search_cache(collection, entries=DEFAULT_CACHE_ENTRIES, threshold=DEFAULT_DISTANCE_THRESHOLD,
+                       ttl_s=DEFAULT_CACHE_TTL_S):
+    """product_vectors 的語意快取 (entries 為 0 時回傳 None)"""
+    if not entries:
+        return None
+    dim = next(f.params["dim"] for f in collection.schema.fields if f.name == "embedding")
+    cache = SemanticQueryCache(dim, max_entries=entries, distance_threshold=threshold, ttl_seconds=ttl_s)
+    return CachedProductSearcher(collection, cache)
+
+
+# ==============================================
+# HTTP
+# ==============================================
+
+HTTP_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+               503: "Service Unavailable"}
+
+
+async def _write_json(writer, status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = (
+        f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(headers.encode("ascii") + body)
+    await writer.drain()
+
+
+async def route(service, method, target):
+    """回傳 (狀態碼, JSON 內容)"""
+    if method != "GET":
+        return 404, {"success": False, "message": "not found"}
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split("/") if part]
+    limit = min(int(query.get("limit", [DEFAULT_LIMIT])[0]), MAX_LIMIT)
+
+    if parts == ["health"]:
+        return 200, {"status": "ok"}
+    if parts == ["ready"]:
+        if service.readiness is None:
+            return 200, {"ready": True}
+        status = service.readiness.status()
+        return (200 if status["ready"] else 503), status
+    if parts == ["metrics"]:
+        return 200, service.metrics()
+    if len(parts) == 3 and parts[:2] == ["recommendations", "similar"]:
+        items = await service.similar_products(int(parts[2]), limit)
+        if items is None:
+            return 404, {"success": False, "message": f"商品 {parts[2]} 不存在"}
+        return 200, {"success": True, "data": items}
+    if parts == ["recommendations"]:
+        if "user_id" not in query:
+            return 400, {"success": False, "message": "缺少 user_id"}
+        category_id = int(query["category_id"][0]) if "category_id" in query else None
+        items = await service.user_recommendations(int(query["user_id"][0]), limit, category_id)
+        return 200, {"success": True, "data": items}
+    return 404, {"success": False, "message": "not found"}
+
+
+async def handle_connection(service, reader, writer):
+    """最小 HTTP/1.1 處理 (支援 keep-alive)"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, version = request_line.decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if int(headers.get("content-length", 0)):
+                await reader.readexactly(int(headers["content-length"]))
+
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            try:
+                status, payload = await route(service, method, target)
+            except ValueError as e:
+                status, payload = 400, {"success": False, "message": str(e)}
+            except Exception as e:
+                status, payload = 500, {"success": False, "message": str(e)}
+            await _write_json(writer, status, payload, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host, port, centroid_refresh_s=None, centroids_path=None,
+                exclusions_path=None, exclusions_reload_s=DEFAULT_EXCLUSIONS_RELOAD_S):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port
+    )
+    # 保留 task 參照，避免被回收
+    tasks = []
+    if service.centroids is not None and centroid_refresh_s:
+        tasks.append(asyncio.create_task(service.refresh_centroids(centroid_refresh_s, centroids_path)))
+    if exclusions_path:
+        tasks.append(asyncio.create_task(service.reload_exclusions(exclusions_path, exclusions_reload_s)))
+    print(f"✅ 推薦服務已啟動: http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# ==============================================
+# 壓測
+# ==============================================
+
+async def run_benchmark(service, product_ids, user_ids, n_requests, concurrency, seed=0):
+    """以 Zipf 偏斜的請求並行呼叫服務，回傳整體吞吐量"""
+    from milvus_workload import ZipfSampler
+
+    rng = np.random.default_rng(seed)
+    products = ZipfSampler(product_ids, 1.1, rng).sample(n_requests, rng)
+    users = ZipfSampler(user_ids, 0.9, rng).sample(n_requests, rng)
+    is_user = rng.random(n_requests) < 0.3
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            if is_user[i]:
+                await service.user_recommendations(int(users[i]))
+            else:
+                await service.similar_products(int(products[i]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    return n_requests / (time.perf_counter() - started)
+
+
+def build_local_service(n_products, n_users, max_batch_size, max_wait_ms, data_dir, cache_entries=0):
+    """以本地引擎建立與 milvus-init.py 相同 schema 的測試資料"""
+    from pymilvus import CollectionSchema, DataType, FieldSchema
+    from milvus_local_engine import LocalMilvus
+
+    rng = np.random.default_rng(0)
+    client = LocalMilvus(data_dir)
+    products = client.collection("product_vectors", CollectionSchema(fields=[
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=512),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+        FieldSchema(name="price_range", dtype=DataType.INT64),
+        FieldSchema(name="brand", dtype=DataType.VARCHAR, max_length=100),
+    ]))
+    product_ids = list(range(1, n_products + 1))
+    brands = np.array(["Apple", "Nike", "Adidas", "SK-II", "Sony", "Dyson"])
+    products.insert([
+        product_ids,
+        prepare_vectors(products.name, rng.random((n_products, 512), dtype=np.float32)),
+        rng.integers(1, 11, n_products).tolist(),
+        rng.integers(1, 6, n_products).tolist(),
+        brands[rng.integers(0, len(brands), n_products)].tolist(),
+    ])
+    products.create_index("embedding", {"index_type": "FLAT", "metric_type": metric_type(products.name)})
+    products.load()
+
+    recommendations = client.collection("recommendations", CollectionSchema(fields=[
+        FieldSchema(name="recommendation_id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(name="user_id", dtype=DataType.INT64),
+        FieldSchema(name="product_id", dtype=DataType.INT64),
+        FieldSchema(name="score", dtype=DataType.FLOAT),
+    ]))
+    per_user = 20
+    user_ids = list(range(1, n_users + 1))
+    recommendations.insert([
+        np.repeat(user_ids, per_user).tolist(),
+        rng.integers(1, n_products + 1, n_users * per_user).tolist(),
+        rng.random(n_users * per_user).tolist(),
+    ])
+    recommendations.load()
+
+    service = RecommendationService(products, recommendations, ProductStore.from_collection(products),
+                                    max_batch_size, max_wait_ms,
+                                    search_cache=build_search_cache(products, cache_entries))
+    return client, service, product_ids, user_ids
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="微批次推薦服務")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="連接 Milvus 並啟動 HTTP 服務")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--products-json", help="商品資料 JSON，省略則由 product_vectors 產生")
+    serve_parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    serve_parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    serve_parser.add_argument("--centroids", help="分類質心 .npz，不存在時由 product_vectors 建立並寫入")
+    serve_parser.add_argument("--centroid-refresh-s", type=float, default=DEFAULT_CENTROID_REFRESH_S,
+                              help="分類質心增量更新間隔 (0 表示不更新)")
+    serve_parser.add_argument("--exclusions", help="milvus_deactivation.py 的排除表狀態檔")
+    serve_parser.add_argument("--exclusions-reload-s", type=float, default=DEFAULT_EXCLUSIONS_RELOAD_S)
+    serve_parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES,
+                              help="相似商品語意快取容量 (0 表示不使用)")
+    serve_parser.add_argument("--cache-threshold", type=float, default=DEFAULT_DISTANCE_THRESHOLD,
+                              help="快取命中的查詢向量距離門檻")
+
+    bench_parser = subparsers.add_parser("bench", help="以本地引擎比較批次與逐筆搜尋")
+    bench_parser.add_argument("--products", type=int, default=20_000)
+    bench_parser.add_argument("--users", type=int, default=2_000)
+    bench_parser.add_argument("--requests", type=int, default=5_000)
+    bench_parser.add_argument("--concurrency", type=int, default=200)
+    bench_parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    bench_parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES)
+
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        import tempfile
+        configs = [(1, 0), (DEFAULT_MAX_BATCH_SIZE, 0)]
+        if args.cache_entries:
+            configs.append((DEFAULT_MAX_BATCH_SIZE, args.cache_entries))
+        for max_batch_size, cache_entries in configs:
+            with tempfile.TemporaryDirectory() as data_dir:
+                client, service, product_ids, user_ids = build_local_service(
+                    args.products, args.users, max_batch_size, args.max_wait_ms, data_dir, cache_entries
+                )
+                qps = asyncio.run(run_benchmark(service, product_ids, user_ids,
+                                                args.requests, args.concurrency))
+                metrics = service.metrics()
+                similar = metrics["latency_ms"]["similar_product"]
+                batcher = metrics["batchers"]["similar_product"]
+                cache = metrics["semantic_cache"]
+                cache_note = f", 語意快取命中率 {cache['hit_rate']:.1%}" if cache else ""
+                print(f"max_batch_size={max_batch_size}{' + 語意快取' if cache else ''}: {qps:.0f} QPS, "
+                      f"相似商品 p50 {similar['p50']:.2f} / p99 {similar['p99']:.2f} ms, "
+                      f"平均批次 {batcher['batch_size']['mean']:.1f}, 合併 {batcher['coalesced']} 筆{cache_note}")
+                service.close()
+                client.close()
+        return
+
+    from pymilvus import connections
+    from milvus_common import connect_to_milvus
+    from milvus_load_manager import CollectionLoadManager
+    from milvus_readiness import ReadinessGate
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        load_manager = CollectionLoadManager()
+        load_manager.sync_loaded_collections()
+        product_collection = load_manager.acquire("product_vectors")
+        recommendation_collection = load_manager.acquire("recommendations")
+        product_store = (ProductStore.from_json(args.products_json) if args.products_json
+                         else ProductStore.from_collection(product_collection))
+        if args.centroids and os.path.exists(args.centroids):
+            centroids = CategoryCentroids.load(args.centroids)
+            centroids.refresh(product_collection)
+        else:
+            centroids = CategoryCentroids.from_collection(product_collection)
+        if args.centroids:
+            centroids.save(args.centroids)
+        print(f"📊 分類質心: {len(centroids)} 個分類 (watermark product_id={centroids.watermark})")
+        # 服務啟動後於背景暖機 product_vectors，/ready 在延遲穩定前回傳 503
+        readiness = ReadinessGate([product_collection])
+        service = RecommendationService(product_collection, recommendation_collection, product_store,
+                                        args.max_batch_size, args.max_wait_ms, centroids=centroids,
+                                        readiness=readiness,
+                                        search_cache=build_search_cache(product_collection, args.cache_entries,
+                                                                        args.cache_threshold))
+        readiness.start()
+        asyncio.run(serve(service, args.host, args.port, args.centroid_refresh_s, args.centroids,
+                          args.exclusions, args.exclusions_reload_s))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
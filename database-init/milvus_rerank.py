@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+搜尋結果多樣化重排序
+對超量取回的候選集合套用最大邊際相關 (MMR)，並可限制每個品牌 / 分類的數量。
+相似度以批次 NumPy 矩陣計算，可一次處理多個查詢
+每一步只計算新選入候選與其餘候選的一列相似度並累計最大值 (k·C·d)，不預先建立 C x C 相似度矩陣
+(C²·d，C = 300、k = 10 時為前者的 30 倍)；單一查詢的延遲主要是每一步固定的 NumPy 呼叫成本，
+需要高吞吐量時將多個查詢合併為一次呼叫 (search_diverse 的 nq > 1) 分攤這部分成本
+
+用法:
+    python3 milvus_rerank.py  # 測量 300 個候選的重排序延遲
+"""
+
+import time
+
+import numpy as np
+
+from milvus_common import collection_search_params, prepare_vectors
+
+# 重排序設定
+DEFAULT_MMR_LAMBDA = 0.7  # 1.0 = 只看相關度, 0.0 = 只看多樣性
+DEFAULT_OVERSAMPLE = 5
+
+
+def _normalize(vectors):
+    norms = np.sqrt(np.einsum("...d,...d->...", vectors, vectors))[..., None]
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _encode_groups(labels):
+    """將任意標籤編為 0..G-1 的整數 (整批共用編碼)"""
+    _, codes = np.unique(np.asarray(labels).ravel(), return_inverse=True)
+    return codes.reshape(np.shape(labels)), int(codes.max()) + 1 if codes.size else 0
+
+
+def mmr_rerank(query_vectors, candidate_vectors, k, mmr_lambda=DEFAULT_MMR_LAMBDA,
+               relevance=None, group_caps=None, valid=None):
+    """批次 MMR 重排序
+
+    query_vectors: (Q, d)；candidate_vectors: (Q, C, d)
+    relevance: (Q, C)，省略時以查詢與候選的 cosine 相似度計算
+    group_caps: {名稱: (標籤 (Q, C), 每組上限)}，例如品牌與分類
+    valid: (Q, C) 布林遮罩，標示實際存在的候選 (不足 C 筆時補位)
+    回傳 (Q, k) 的候選索引，不足以 -1 補齊
+    """
+    # 不建立正規化後的候選副本: cosine 以內積除以長度計算 (單一查詢時副本的配置與除法佔總時間約四分之一)
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    n_queries, n_candidates, _ = candidates.shape
+    norms = np.maximum(np.sqrt(np.einsum("qcd,qcd->qc", candidates, candidates)), 1e-12)
+
+    if relevance is None:
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        relevance = np.matmul(candidates, queries[:, :, None])[:, :, 0] / norms
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    available = np.ones((n_queries, n_candidates), dtype=bool) if valid is None else np.asarray(valid, dtype=bool).copy()
+    # 第一步所有候選冗餘度相同，以 cosine 下限 -1 起始不影響排序
+    max_similarity = np.full((n_queries, n_candidates), -1.0, dtype=np.float32)
+
+    caps = []
+    for labels, cap in (group_caps or {}).values():
+        codes, n_groups = _encode_groups(labels)
+        caps.append((codes, cap, np.zeros((n_queries, max(n_groups, 1)), dtype=np.int32)))
+
+    rows = np.arange(n_queries)
+    selected = np.full((n_queries, k), -1, dtype=np.int64)
+    for step in range(min(k, n_candidates)):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+
+        choice = np.argmax(scores, axis=1)
+        has_choice = scores[rows, choice] > -np.inf
+        if not has_choice.any():
+            break
+
+        selected[:, step] = np.where(has_choice, choice, -1)
+        available[rows, choice] &= ~has_choice
+        # 只計算新選入候選與其餘候選的相似度列，不建立完整的 (Q, C, C) 矩陣
+        similarity = np.matmul(candidates, candidates[rows, choice][:, :, None])[:, :, 0]
+        similarity /= norms * norms[rows, choice][:, None]
+        similarity[~has_choice] = -1.0
+        np.maximum(max_similarity, similarity, out=max_similarity)
+        # 組別達上限時，同組其餘候選全部移出可選集合
+        for codes, cap, counts in caps:
+            group = codes[rows, choice]
+            counts[rows, group] += has_choice
+            full = has_choice & (counts[rows, group] >= cap)
+            if full.any():
+                available &= ~(full[:, None] & (codes == group[:, None]))
+
+    # 候選一旦用盡便不再增加，結果自然靠前排列，其後以 -1 補齊
+    return selected
+
+
+def search_diverse(collection, query_vectors, limit=10, anns_field="embedding",
+                   search_params=None, oversample=DEFAULT_OVERSAMPLE,
+                   mmr_lambda=DEFAULT_MMR_LAMBDA, max_per_brand=None, max_per_category=None,
+                   expr=None, output_fields=None):
+    """超量取回 product_vectors 候選後重排序，回傳每個查詢的 Hit 清單
+
+    search_params 預設依集合距離類型，查詢向量依集合距離類型正規化
+    """
+    output_fields = list(output_fields or [])
+    needed = [anns_field, "brand", "category_id"]
+    fields = output_fields + [f for f in needed if f not in output_fields]
+    query_vectors = prepare_vectors(collection.name, query_vectors)
+
+    results = collection.search(
+        data=query_vectors.tolist(), anns_field=anns_field,
+        param=search_params or collection_search_params(collection.name),
+        limit=limit * oversample, expr=expr, output_fields=fields,
+    )
+
+    n_candidates = max((len(hits) for hits in results), default=0)
+    dim = query_vectors.shape[1]
+    candidate_vectors = np.zeros((len(results), n_candidates, dim), dtype=np.float32)
+    valid = np.zeros((len(results), n_candidates), dtype=bool)
+    brands = np.full((len(results), n_candidates), "", dtype=object)
+    categories = np.full((len(results), n_candidates), -1, dtype=np.int64)
+    for q, hits in enumerate(results):
+        for c, hit in enumerate(hits):
+            candidate_vectors[q, c] = hit.entity.get(anns_field)
+            brands[q, c] = hit.entity.get("brand")
+            categories[q, c] = hit.entity.get("category_id")
+            valid[q, c] = True
+
+    group_caps = {}
+    if max_per_brand:
+        group_caps["brand"] = (brands.astype(str), max_per_brand)
+    if max_per_category:
+        group_caps["category_id"] = (categories, max_per_category)
+
+    order = mmr_rerank(query_vectors, candidate_vectors, limit, mmr_lambda,
+                       group_caps=group_caps, valid=valid)
+    return [[results[q][c] for c in row if c >= 0] for q, row in enumerate(order)]
+
+
+def main():
+    """測量單一查詢與批次查詢的重排序延遲 (含品牌與分類上限)"""
+    rng = np.random.default_rng(0)
+    dim, n_candidates, k = 512, 300, 10
+    brands = np.array(["Apple", "Nike", "Adidas", "SK-II", "Sony", "Dyson"])
+
+    for n_queries in (1, 64):
+        queries = rng.random((n_queries, dim), dtype=np.float32)
+        candidates = queries[:, None, :] + rng.normal(0, 0.3, (n_queries, n_candidates, dim)).astype(np.float32)
+        brand_labels = brands[rng.integers(0, len(brands), (n_queries, n_candidates))]
+        category_labels = rng.integers(1, 11, (n_queries, n_candidates))
+
+        mmr_rerank(queries, candidates, k)  # 預熱
+        repeats = max(20, 200 // n_queries)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            order = mmr_rerank(queries, candidates, k, group_caps={
+                "brand": (brand_labels, 2), "category_id": (category_labels, 3),
+            })
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"{n_queries} 個查詢 x {n_candidates} 候選 → top {k}: "
+              f"{elapsed * 1000:.2f} ms ({elapsed / n_queries * 1000:.3f} ms/查詢)")
+        print(f"  第一個查詢的品牌: {brand_labels[0, order[0]].tolist()}")
+
+
+if __name__ == "__main__":
+    main()
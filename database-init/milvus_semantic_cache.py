@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+語意查詢快取
+在搜尋 product_vectors 之前，先於最近服務過的查詢向量中找最近鄰，
+距離在門檻內即直接回傳快取結果；容量有上限並以 LRU 淘汰
+milvus_recommend_service.py 的相似商品搜尋經由 CachedProductSearcher，命中率與距離分布見 /metrics
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from milvus_common import collection_search_params, prepare_vectors
+from milvus_deactivation import search_live
+
+# 快取設定
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_DISTANCE_THRESHOLD = 0.15
+DEFAULT_METRIC = "L2"
+DISTANCE_HISTORY_SIZE = 10_000  # 保留最近 N 次查詢的最近鄰距離以調整門檻
+
+
+def hits_to_records(hits, output_fields):
+    """將 pymilvus Hits 轉為可快取的純資料"""
+    return [
+        {
+            "id": hit.id,
+            "distance": hit.distance,
+            "entity": {field: hit.entity.get(field) for field in output_fields},
+        }
+        for hit in hits
+    ]
+
+
+class SemanticQueryCache:
+    """以查詢向量最近鄰為鍵的 LRU 快取"""
+
+    def __init__(self, dim, max_entries=DEFAULT_MAX_ENTRIES,
+                 distance_threshold=DEFAULT_DISTANCE_THRESHOLD, metric=DEFAULT_METRIC,
+                 ttl_seconds=None):
+        if metric not in ("L2", "COSINE"):
+            raise ValueError(f"不支援的距離類型: {metric}")
+
+        self.dim = dim
+        self.max_entries = max_entries
+        self.distance_threshold = distance_threshold
+        self.metric = metric
+        self.ttl_seconds = ttl_seconds
+
+        # 預先配置的查詢向量矩陣，每列為一個快取槽
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(max_entries, dtype=np.float32)
+        self._contexts = np.full(max_entries, -1, dtype=np.int64)
+        self._stored_at = np.zeros(max_entries, dtype=np.float64)
+        self._results = [None] * max_entries
+        # 槽位 -> None，順序即為最近使用順序 (最舊在前)
+        self._lru = OrderedDict()
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._used = 0  # 槽位由 0 開始依序使用，距離只需計算到已使用的最大槽位
+
+        self.hits = 0
+        self.misses = 0
+        self._nearest_distances = np.full(DISTANCE_HISTORY_SIZE, np.nan, dtype=np.float32)
+        self._distance_cursor = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _prepare(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if self.metric == "COSINE":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def _distances(self, vectors):
+        """查詢向量對已使用快取槽的距離矩陣 (n, 已使用槽位數)"""
+        dots = vectors @ self._vectors[:self._used].T
+        if self.metric == "COSINE":
+            return 1.0 - dots
+        sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        return np.sqrt(np.maximum(sq_norms[:, None] + self._sq_norms[None, :self._used] - 2 * dots, 0))
+
+    def _record_distances(self, distances):
+        positions = (self._distance_cursor + np.arange(len(distances))) % DISTANCE_HISTORY_SIZE
+        self._nearest_distances[positions] = distances
+        self._distance_cursor = (self._distance_cursor + len(distances)) % DISTANCE_HISTORY_SIZE
+
+    def lookup(self, vectors, context=0):
+        """批次查詢快取，回傳每個查詢的快取結果 (未命中為 None)"""
+        vectors = self._prepare(vectors)
+        results = [None] * len(vectors)
+        if not self._lru:
+            self.misses += len(vectors)
+            return results
+
+        distances = self._distances(vectors)
+        invalid = self._contexts[:self._used] != context
+        if self.ttl_seconds is not None:
+            invalid |= self._stored_at[:self._used] < time.time() - self.ttl_seconds
+        distances[:, invalid] = np.inf
+
+        nearest = np.argmin(distances, axis=1)
+        nearest_distance = distances[np.arange(len(vectors)), nearest]
+        self._record_distances(nearest_distance[np.isfinite(nearest_distance)])
+
+        for i, (slot, distance) in enumerate(zip(nearest, nearest_distance)):
+            if distance <= self.distance_threshold:
+                results[i] = self._results[slot]
+                self._lru.move_to_end(int(slot))
+                self.hits += 1
+            else:
+                self.misses += 1
+        return results
+
+    def store(self, vectors, results, context=0):
+        """寫入查詢向量與結果，容量滿時淘汰最久未使用的槽"""
+        vectors = self._prepare(vectors)
+        now = time.time()
+        for vector, result in zip(vectors, results):
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            else:
+                slot, _ = self._lru.popitem(last=False)
+            self._used = max(self._used, slot + 1)
+            self._vectors[slot] = vector
+            self._sq_norms[slot] = vector @ vector
+            self._contexts[slot] = context
+            self._stored_at[slot] = now
+            self._results[slot] = result
+            self._lru[slot] = None
+
+    def invalidate(self):
+        """清空快取 (商品資料更新後使用)"""
+        self._contexts[:] = -1
+        self._results = [None] * self.max_entries
+        self._lru.clear()
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        self._used = 0
+
+    def stats(self):
+        """命中率與最近鄰距離分布，用於調整距離門檻"""
+        total = self.hits + self.misses
+        distances = self._nearest_distances[~np.isnan(self._nearest_distances)]
+        stats = {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "distance_threshold": self.distance_threshold,
+        }
+        if len(distances):
+            p50, p90, p99 = np.percentile(distances, [50, 90, 99])
+            stats.update({
+                "nearest_distance_p50": float(p50),
+                "nearest_distance_p90": float(p90),
+                "nearest_distance_p99": float(p99),
+                # 若門檻放寬 / 收緊一倍時的命中比例
+                "hit_rate_at_half_threshold": float(np.mean(distances <= self.distance_threshold / 2)),
+                "hit_rate_at_double_threshold": float(np.mean(distances <= self.distance_threshold * 2)),
+            })
+        return stats
+
+    def report(self):
+        """顯示快取統計"""
+        stats = self.stats()
+        print(f"語意快取: {stats['entries']}/{stats['max_entries']} 筆, "
+              f"命中率 {stats['hit_rate']:.1%} ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+              f"門檻 {stats['distance_threshold']}")
+        if "nearest_distance_p50" in stats:
+            print(f"  最近鄰距離 p50/p90/p99: {stats['nearest_distance_p50']:.4f} / "
+                  f"{stats['nearest_distance_p90']:.4f} / {stats['nearest_distance_p99']:.4f}")
+            print(f"  門檻減半命中率: {stats['hit_rate_at_half_threshold']:.1%}, "
+                  f"門檻加倍命中率: {stats['hit_rate_at_double_threshold']:.1%}")
+
+
+class CachedProductSearcher:
+    """在 product_vectors 搜尋前先查語意快取 (快取操作以鎖保護，可由多個執行緒同時呼叫)"""
+
+    def __init__(self, collection, cache, anns_field="embedding",
+                 search_params=None):
+        self.collection = collection
+        self.cache = cache
+        self.anns_field = anns_field
+        self.search_params = search_params or collection_search_params(collection.name)
+        self.stale_hits = 0
+        self._lock = threading.Lock()
+
+    def _live(self, records, limit, exclusions):
+        """命中的快取結果重新套用排除表；排除後少於 limit 筆時視為未命中"""
+        excluded = exclusions.contains([record["id"] for record in records])
+        if not excluded.any():
+            return records
+        live = [record for record, skip in zip(records, excluded) if not skip]
+        return live if len(live) >= limit else None
+
+    def search(self, vectors, limit=10, expr=None, output_fields=None, exclusions=None):
+        """批次搜尋，只有未命中的查詢會送到 Milvus
+
+        exclusions (ExclusionBitset) 指定時未命中的查詢以 search_live 搜尋，命中的結果也重新排除
+        """
+        output_fields = output_fields or []
+        context = hash((limit, expr, tuple(output_fields)))
+        vectors = prepare_vectors(self.collection.name, np.reshape(vectors, (-1, self.cache.dim)))
+
+        with self._lock:
+            results = self.cache.lookup(vectors, context=context)
+        if exclusions is not None and len(exclusions):
+            for i, records in enumerate(results):
+                if records is not None:
+                    results[i] = self._live(records, min(limit, len(records)), exclusions)
+                    self.stale_hits += results[i] is None
+        missed = [i for i, result in enumerate(results) if result is None]
+        if not missed:
+            return results
+
+        data = vectors[missed].tolist()
+        if exclusions is not None:
+            search_results = search_live(self.collection, data, limit, exclusions, anns_field=self.anns_field,
+                                         param=self.search_params, expr=expr, output_fields=output_fields)
+        else:
+            search_results = self.collection.search(
+                data=data,
+                anns_field=self.anns_field,
+                param=self.search_params,
+                limit=limit,
+                expr=expr,
+                output_fields=output_fields,
+            )
+        fresh = [hits_to_records(hits, output_fields) for hits in search_results]
+        with self._lock:
+            self.cache.store(vectors[missed], fresh, context=context)
+
+        for i, records in zip(missed, fresh):
+            results[i] = records
+        return results
+
+    def stats(self):
+        """快取統計 (stale_hits: 命中但排除下架商品後不足而重新搜尋的次數)"""
+        with self._lock:
+            stats = self.cache.stats()
+        stats["stale_hits"] = self.stale_hits
+        return stats
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Milvus 集合快照匯出與還原
+匯出: 以分頁查詢迭代器串流每個集合，向量寫入可記憶體映射的 .npy，
+      純量欄位寫入 Parquet，並產生包含 schema 與索引參數的 manifest
+      (啟用動態欄位的集合，schema 以外的鍵以 JSON 字串寫入 Parquet 的 $meta 欄)
+還原: 依 manifest 重建集合，平行批次寫入後建立索引 (含動態欄位資料的集合改以逐列寫入)
+      (auto_id 主鍵的集合還原後主鍵會重新產生)
+
+用法:
+    python3 milvus_snapshot.py export ./snapshots/20240101
+    python3 milvus_snapshot.py restore ./snapshots/20240101 --load
+    python3 milvus_snapshot.py bench       # 本地引擎: 匯出 → 還原 → milvus_verify 比對 checksum，需完全一致
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    print("❌ 請安裝 pyarrow: pip3 install pyarrow")
+    sys.exit(1)
+
+from pymilvus import Collection, CollectionSchema, DataType, connections, utility
+from pymilvus.client.types import LoadState
+
+from milvus_columnar import DYNAMIC_FIELD, ColumnBatch, insert_batch
+from milvus_common import ECOMMERCE_COLLECTIONS, connect_to_milvus, consistency_level
+
+# 快照設定
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EXPORT_BATCH_SIZE = 10_000
+RESTORE_BATCH_SIZE = 10_000
+RESTORE_WORKERS = 4
+COPY_CHUNK_ROWS = 1_000_000
+
+# 往返驗證設定
+BENCH_ROWS = 20_000
+BENCH_DIM = 512
+BENCH_BATCH_SIZE = 5_000
+
+VECTOR_DTYPES = {
+    DataType.FLOAT_VECTOR: np.float32,
+    DataType.BINARY_VECTOR: np.uint8,
+}
+
+ARROW_TYPES = {
+    DataType.BOOL: pa.bool_(),
+    DataType.INT8: pa.int8(),
+    DataType.INT16: pa.int16(),
+    DataType.INT32: pa.int32(),
+    DataType.INT64: pa.int64(),
+    DataType.FLOAT: pa.float32(),
+    DataType.DOUBLE: pa.float64(),
+    DataType.VARCHAR: pa.string(),
+    DataType.JSON: pa.string(),  # 以 JSON 字串儲存
+}
+
+
+def vector_width(field):
+    """向量欄位在 .npy 中的欄寬"""
+    dim = field.params["dim"]
+    return dim // 8 if field.dtype == DataType.BINARY_VECTOR else dim
+
+
+def split_fields(schema):
+    """將 schema 欄位分為向量欄位與純量欄位"""
+    vector_fields = [f for f in schema.fields if f.dtype in VECTOR_DTYPES]
+    scalar_fields = [f for f in schema.fields if f.dtype not in VECTOR_DTYPES]
+    for field in scalar_fields:
+        if field.dtype not in ARROW_TYPES:
+            raise ValueError(f"欄位 {field.name} 的型別 {field.dtype} 不支援快照")
+    return vector_fields, scalar_fields
+
+
+def resize_npy(path, rows, copy_rows):
+    """以新的列數重寫 .npy，保留前 copy_rows 列"""
+    old = np.load(path, mmap_mode="r")
+    tmp_path = path + ".tmp"
+    new = open_memmap(tmp_path, mode="w+", dtype=old.dtype, shape=(rows,) + old.shape[1:])
+    for start in range(0, copy_rows, COPY_CHUNK_ROWS):
+        stop = min(start + COPY_CHUNK_ROWS, copy_rows)
+        new[start:stop] = old[start:stop]
+    new.flush()
+    del old, new
+    os.replace(tmp_path, path)
+    return open_memmap(path, mode="r+")
+
+
+def export_collection(collection_name, output_dir, batch_size=EXPORT_BATCH_SIZE, client=None):
+    """以分頁迭代器串流匯出單一集合，回傳 manifest 項目 (client 為 LocalMilvus 時由本地引擎匯出)"""
+    start_time = time.time()
+    collection = Collection(collection_name) if client is None else client.collection(collection_name)
+    collection.flush()
+
+    # 本地引擎查詢不需載入
+    was_loaded = client is not None or utility.load_state(collection_name) == LoadState.Loaded
+    if not was_loaded:
+        collection.load()
+
+    schema = collection.schema
+    vector_fields, scalar_fields = split_fields(schema)
+
+    # 以 num_entities 預先配置 .npy，結束時依實際列數調整
+    capacity = max(collection.num_entities, 1)
+    vector_files = {}
+    vector_arrays = {}
+    for field in vector_fields:
+        filename = f"{collection_name}.{field.name}.npy"
+        vector_files[field.name] = filename
+        vector_arrays[field.name] = open_memmap(
+            os.path.join(output_dir, filename), mode="w+",
+            dtype=VECTOR_DTYPES[field.dtype], shape=(capacity, vector_width(field))
+        )
+
+    scalar_file = f"{collection_name}.parquet"
+    columns_schema = [(f.name, ARROW_TYPES[f.dtype]) for f in scalar_fields]
+    field_names = [f.name for f in schema.fields]
+    output_fields = field_names
+    if schema.enable_dynamic_field:
+        columns_schema.append((DYNAMIC_FIELD, pa.string()))
+        output_fields = field_names + ["*"]  # "*" 另外回傳動態欄位的鍵
+    arrow_schema = pa.schema(columns_schema)
+    writer = pq.ParquetWriter(os.path.join(output_dir, scalar_file), arrow_schema)
+
+    iterator = collection.query_iterator(batch_size=batch_size, output_fields=output_fields)
+    written = 0
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            n_rows = len(rows)
+
+            if written + n_rows > capacity:
+                capacity = max(capacity * 2, written + n_rows)
+                for field in vector_fields:
+                    vector_arrays[field.name].flush()
+                    vector_arrays[field.name] = resize_npy(
+                        os.path.join(output_dir, vector_files[field.name]), capacity, written
+                    )
+
+            for field in vector_fields:
+                values = [row[field.name] for row in rows]
+                if field.dtype == DataType.BINARY_VECTOR:
+                    values = [np.frombuffer(value, dtype=np.uint8) for value in values]
+                vector_arrays[field.name][written:written + n_rows] = np.asarray(
+                    values, dtype=VECTOR_DTYPES[field.dtype]
+                )
+
+            columns = {}
+            for field in scalar_fields:
+                values = [row[field.name] for row in rows]
+                if field.dtype == DataType.JSON:
+                    values = [json.dumps(value, ensure_ascii=False) for value in values]
+                columns[field.name] = values
+            if schema.enable_dynamic_field:
+                known = set(field_names)
+                columns[DYNAMIC_FIELD] = [
+                    json.dumps({key: value for key, value in row.items() if key not in known}, ensure_ascii=False)
+                    for row in rows
+                ]
+            writer.write_table(pa.Table.from_pydict(columns, schema=arrow_schema))
+            written += n_rows
+    finally:
+        iterator.close()
+        writer.close()
+
+    for field in vector_fields:
+        vector_arrays[field.name].flush()
+        if written != capacity:
+            resize_npy(os.path.join(output_dir, vector_files[field.name]), written, written)
+    vector_arrays.clear()
+
+    if not was_loaded:
+        collection.release()
+
+    elapsed = time.time() - start_time
+    print(f"✅ 匯出 {collection_name}: {written} 筆, {elapsed:.2f}s "
+          f"({written / max(elapsed, 1e-9):.0f} 筆/秒)")
+
+    return {
+        "name": collection_name,
+        "schema": schema.to_dict(),
+        "num_shards": collection.num_shards,
+        "indexes": [
+            {"field_name": index.field_name, "index_name": index.index_name, "params": index.params}
+            for index in collection.indexes
+        ],
+        "row_count": written,
+        "vector_files": vector_files,
+        "scalar_file": scalar_file,
+        "dynamic_column": DYNAMIC_FIELD if schema.enable_dynamic_field else None,
+    }
+
+
+def export_snapshot(output_dir, collection_names=None, batch_size=EXPORT_BATCH_SIZE, client=None):
+    """匯出多個集合並寫入 manifest"""
+    os.makedirs(output_dir, exist_ok=True)
+    has_collection = utility.has_collection if client is None else client.has_collection
+    collection_names = collection_names or [
+        name for name in ECOMMERCE_COLLECTIONS if has_collection(name)
+    ]
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": int(time.time()),
+        "collections": [
+            export_collection(name, output_dir, batch_size, client) for name in collection_names
+        ],
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def _iter_insert_batches(entry, snapshot_dir, schema, batch_size):
+    """依序產生欄位式插入批次 (向量為 .npy 的切片，自動主鍵欄位略過，$meta 欄轉為批次的動態欄位資料)"""
+    vectors = {
+        name: np.load(os.path.join(snapshot_dir, filename), mmap_mode="r")
+        for name, filename in entry["vector_files"].items()
+    }
+    parquet_file = pq.ParquetFile(os.path.join(snapshot_dir, entry["scalar_file"]))
+
+    offset = 0
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        n_rows = record_batch.num_rows
+        yield ColumnBatch.from_arrow(schema.fields, record_batch, {
+            name: vectors[name][offset:offset + n_rows] for name in vectors
+        })
+        offset += n_rows
+
+
+def restore_collection(entry, snapshot_dir, batch_size=RESTORE_BATCH_SIZE,
+                       workers=RESTORE_WORKERS, load=False, client=None):
+    """依 manifest 項目重建集合並平行寫入資料 (client 為 LocalMilvus 時還原到本地引擎，逐批寫入)"""
+    start_time = time.time()
+    collection_name = entry["name"]
+    schema = CollectionSchema.construct_from_dict(entry["schema"])
+
+    if client is not None:
+        client.drop_collection(collection_name)
+        collection = client.collection(collection_name, schema, shards_num=entry["num_shards"])
+        workers = 1  # 本地引擎不支援平行寫入
+    else:
+        if utility.has_collection(collection_name):
+            print(f"集合 {collection_name} 已存在，刪除舊集合...")
+            utility.drop_collection(collection_name)
+
+        collection = Collection(
+            name=collection_name,
+            schema=schema,
+            using='default',
+            shards_num=entry["num_shards"],
+            consistency_level=consistency_level(collection_name)
+        )
+
+    # 限制同時進行中的批次數，避免整個檔案讀入記憶體
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for data in _iter_insert_batches(entry, snapshot_dir, schema, batch_size):
+            if len(pending) >= workers * 2:
+                pending.pop(0).result()
+            pending.append(pool.submit(insert_batch, collection, data))
+        for future in pending:
+            future.result()
+
+    collection.flush()
+    insert_elapsed = time.time() - start_time
+
+    for index in entry["indexes"]:
+        collection.create_index(
+            field_name=index["field_name"],
+            index_params=index["params"],
+            index_name=index["index_name"],
+        )
+    if load:
+        collection.load()
+
+    elapsed = time.time() - start_time
+    row_count = entry["row_count"]
+    print(f"✅ 還原 {collection_name}: {row_count} 筆, 寫入 {insert_elapsed:.2f}s "
+          f"({row_count / max(insert_elapsed, 1e-9):.0f} 筆/秒), 含索引共 {elapsed:.2f}s")
+    return collection
+
+
+def restore_snapshot(snapshot_dir, collection_names=None, batch_size=RESTORE_BATCH_SIZE,
+                     workers=RESTORE_WORKERS, load=False, client=None):
+    """依 manifest 還原快照中的集合"""
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest["format_version"] != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"不支援的快照版本: {manifest['format_version']}")
+
+    for entry in manifest["collections"]:
+        if collection_names and entry["name"] not in collection_names:
+            continue
+        restore_collection(entry, snapshot_dir, batch_size, workers, load, client)
+
+
+# ==============================================
+# 本地往返驗證
+# ==============================================
+
+def bench_schemas(dim):
+    """IP 集合 (寫入時正規化) 與 auto_id 主鍵的 L2 集合"""
+    from pymilvus import FieldSchema
+
+    vector_schema = CollectionSchema(fields=[
+        FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="category_id", dtype=DataType.INT64),
+        FieldSchema(name="price", dtype=DataType.FLOAT),
+    ], description="往返驗證")
+    history_schema = CollectionSchema(fields=[
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(name="user_id", dtype=DataType.INT64),
+        FieldSchema(name="query_embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+    ], description="往返驗證")
+    return {"product_vectors": vector_schema, "user_vectors": vector_schema, "search_history": history_schema}
+
+
+def run_roundtrip(rows, dim, batch_size, seed=0):
+    """本地引擎: 寫入 → 匯出 → 還原 → 與快照及原集合比對 checksum，回傳問題清單"""
+    import tempfile
+
+    from milvus_local_engine import LocalMilvus
+    from milvus_verify import compare, data_problems, manifest_from_snapshot, scan_collection
+
+    rng = np.random.default_rng(seed)
+    problems = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        source = LocalMilvus(os.path.join(data_dir, "source"))
+        for name, schema in bench_schemas(dim).items():
+            collection = source.collection(name, schema)
+            for start in range(0, rows, batch_size):
+                size = min(batch_size, rows - start)
+                vectors = rng.normal(size=(size, dim)).astype(np.float32)  # 未正規化，IP 集合寫入時正規化
+                if name == "search_history":
+                    columns = [rng.integers(1, 1000, size), vectors]
+                else:
+                    columns = [np.arange(start + 1, start + size + 1), vectors, rng.integers(1, 11, size),
+                               rng.random(size).astype(np.float32)]
+                insert_batch(collection, ColumnBatch(schema.fields, columns))
+            collection.flush()
+
+        snapshot_dir = os.path.join(data_dir, "snapshot")
+        export_snapshot(snapshot_dir, list(bench_schemas(dim)), batch_size, client=source)
+        target = LocalMilvus(os.path.join(data_dir, "target"))
+        restore_snapshot(snapshot_dir, batch_size=batch_size, client=target)
+
+        expected = {entry["name"]: entry for entry in manifest_from_snapshot(snapshot_dir)}
+        for name in bench_schemas(dim):
+            original = scan_collection(source.collection(name), workers=1)
+            # auto_id 主鍵還原後重新產生，只能比對整個集合；其餘依原集合的主鍵範圍逐段比對
+            ranges = None if original["auto_id"] else [(r["lo"], r["hi"]) for r in original["ranges"]]
+            restored = scan_collection(target.collection(name), workers=1, ranges=ranges)
+            found = data_problems(restored) + compare(restored, expected[name])
+            found += [f"與原集合比對: {p}" for p in compare(restored, original)]
+            status = "✅" if not found else "❌"
+            print(f"{status} {name}: 還原 {restored['rows']} 筆, checksum {restored['checksum']} "
+                  f"(快照 {expected[name]['checksum']}, 原集合 {original['checksum']})")
+            problems += [f"{name}: {p}" for p in found]
+        source.close()
+        target.close()
+    return problems
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Milvus 集合快照匯出與還原")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="匯出集合到目錄")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--collections", nargs="*")
+    export_parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+
+    restore_parser = subparsers.add_parser("restore", help="由目錄還原集合")
+    restore_parser.add_argument("directory")
+    restore_parser.add_argument("--collections", nargs="*")
+    restore_parser.add_argument("--batch-size", type=int, default=RESTORE_BATCH_SIZE)
+    restore_parser.add_argument("--workers", type=int, default=RESTORE_WORKERS)
+    restore_parser.add_argument("--load", action="store_true", help="還原後載入集合")
+
+    bench_parser = subparsers.add_parser("bench", help="本地引擎往返驗證 (匯出 → 還原 → checksum 比對)")
+    bench_parser.add_argument("--rows", type=int, default=BENCH_ROWS)
+    bench_parser.add_argument("--dim", type=int, default=BENCH_DIM)
+    bench_parser.add_argument("--batch-size", type=int, default=BENCH_BATCH_SIZE)
+
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        problems = run_roundtrip(args.rows, args.dim, args.batch_size)
+        for problem in problems:
+            print(f"  - {problem}")
+        if problems:
+            sys.exit(1)
+        print("🎉 往返驗證通過: 還原後 checksum 與快照及原集合一致")
+        return
+
+    if not connect_to_milvus():
+        sys.exit(1)
+
+    try:
+        start_time = time.time()
+        if args.command == "export":
+            export_snapshot(args.directory, args.collections, args.batch_size)
+        else:
+            restore_snapshot(args.directory, args.collections, args.batch_size,
+                             args.workers, args.load)
+        print(f"🎉 完成，共 {time.time() - start_time:.2f}s")
+    except Exception as e:
+        print(f"❌ 快照{'匯出' if args.command == 'export' else '還原'}失敗: {e}")
+        sys.exit(1)
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
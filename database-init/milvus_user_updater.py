@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+即時用戶向量更新
+user_vectors 原本只在批次作業重寫時更新，剛把登山用品加入購物車的用戶整天仍收到美妝推薦。
+UserVectorUpdater 消費行為事件 (user_id, behavior_type, product_id, duration)，
+以指數衰減 (EMA) 將商品向量投影到用戶空間後併入用戶向量:
+
+    u ← normalize((1 - α) · u + α · P(p))
+
+α 依行為類型與停留時間決定。事件只寫入預先配置的緩衝陣列 (每筆約 1 µs)，
+每個時間窗口結束時一次批次查詢商品與用戶向量，同一用戶的多個事件以封閉形式合併
+(u ← Π(1-α_i) · u + Σ α_i Π_{j>i}(1-α_j) · P(p_i))，再以一次 upsert 寫回
+
+商品 512 維 → 用戶 256 維的投影預設為相鄰兩維平均，與初始化資料的分類特徵區段對應
+(商品 [100k, 100k+100) ↔ 用戶 [50k, 50k+50))；也可載入學習得到的 512×256 矩陣 (.npy)
+
+用法:
+    python3 milvus_user_updater.py consume --events events.jsonl    # JSON Lines，- 表示 stdin
+    python3 milvus_user_updater.py bench                            # 本地引擎測量
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from milvus_columnar import ColumnBatch
+from milvus_common import prepare_vectors
+
+# 更新設定
+BEHAVIOR_WEIGHTS = {
+    "view": 0.02,
+    "click": 0.05,
+    "wishlist_add": 0.10,
+    "add_to_cart": 0.20,
+    "purchase": 0.30,
+}
+DURATION_SCALE_S = 30  # 停留時間加成: α × (1 + log1p(duration / DURATION_SCALE_S))
+MAX_ALPHA = 0.5
+DEFAULT_WINDOW_S = 2.0
+DEFAULT_MAX_EVENTS = 100_000  # 緩衝滿時立即寫回
+PRODUCT_CACHE_SIZE = 200_000  # 投影後商品向量快取筆數上限
+PRODUCT_DIM = 512
+USER_DIM = 256
+
+# 新用戶 (user_vectors 尚無資料) 的預設純量欄位
+NEW_USER_DEFAULTS = {"age_group": 0, "gender": "U"}
+
+
+def behavior_alpha(behavior_type, duration=0):
+    """事件的更新權重 α；未知行為類型回傳 0 (忽略)"""
+    base = BEHAVIOR_WEIGHTS.get(behavior_type, 0.0)
+    return min(MAX_ALPHA, base * (1.0 + np.log1p(max(duration, 0) / DURATION_SCALE_S)))
+
+
+class ProductProjection:
+    """商品向量 → 用戶向量空間的線性投影"""
+
+    def __init__(self, matrix=None, product_dim=PRODUCT_DIM, user_dim=USER_DIM):
+        if matrix is None and product_dim % user_dim:
+            raise ValueError(f"無法以平均池化將 {product_dim} 維投影到 {user_dim} 維")
+        self.matrix = None if matrix is None else np.asarray(matrix, dtype=np.float32)
+        self.product_dim = product_dim
+        self.user_dim = user_dim
+
+    @classmethod
+    def load(cls, path):
+        matrix = np.load(path)
+        return cls(matrix, *matrix.shape)
+
+    def __call__(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.product_dim)
+        if self.matrix is None:
+            projected = vectors.reshape(len(vectors), self.user_dim, -1).mean(axis=2)
+        else:
+            projected = vectors @ self.matrix
+        return prepare_vectors("user_vectors", projected)
+
+
+def coalesce(users, alphas, vectors):
+    """依用戶合併事件 (users 需依用戶分組且組內依時間排序)，回傳 (用戶, 保留比例, 增量向量)
+
+    逐筆 EMA 的封閉形式: 保留比例 = Π(1-α_i)，增量 = Σ α_i Π_{j>i}(1-α_j) · v_i
+    """
+    unique_users, starts = np.unique(users, return_index=True)
+    log_keep = np.log1p(-alphas)
+    group_total = np.add.reduceat(log_keep, starts)
+    inclusive = np.cumsum(log_keep)
+    group_offset = np.repeat(inclusive[starts] - log_keep[starts], np.diff(np.append(starts, len(users))))
+    after = np.repeat(group_total, np.diff(np.append(starts, len(users)))) - (inclusive - group_offset)
+    weights = (alphas * np.exp(after)).astype(np.float32)
+    deltas = np.add.reduceat(weights[:, None] * vectors, starts, axis=0)
+    return unique_users, np.exp(group_total).astype(np.float32), deltas
+
+
+class UserVectorUpdater:
+    """行為事件緩衝、依時間窗口合併並批次 upsert user_vectors"""
+
+    def __init__(self, user_collection, product_collection, projection=None,
+                 window_s=DEFAULT_WINDOW_S, max_events=DEFAULT_MAX_EVENTS):
+        self.user_collection = user_collection
+        self.product_collection = product_collection
+        self.projection = projection or ProductProjection()
+        self.window_s = window_s
+        self.max_events = max_events
+        self._user_fields = [f for f in user_collection.schema.fields if not (f.is_primary and f.auto_id)]
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 同一用戶的讀取-合併-寫回不可交錯
+        self._allocate()
+        self._window_started = None
+        self._product_cache = {}  # product_id → (投影向量, category_id)
+        self.totals = {"events": 0, "ignored": 0, "flushes": 0, "users_updated": 0, "users_created": 0,
+                       "unknown_products": 0, "flush_s": 0.0}
+
+    def _allocate(self):
+        self._users = np.empty(self.max_events, dtype=np.int64)
+        self._products = np.empty(self.max_events, dtype=np.int64)
+        self._alphas = np.empty(self.max_events, dtype=np.float64)
+        self._size = 0
+
+    def add(self, user_id, behavior_type, product_id, duration=0):
+        """加入一筆事件 (只寫入緩衝)；緩衝已滿或窗口到期時回傳 True，呼叫端應 flush()"""
+        alpha = behavior_alpha(behavior_type, duration)
+        with self._lock:
+            if alpha <= 0:
+                self.totals["ignored"] += 1
+                return False
+            if self._size == 0:
+                self._window_started = time.monotonic()
+            i = self._size
+            self._users[i] = user_id
+            self._products[i] = product_id
+            self._alphas[i] = alpha
+            self._size = i + 1
+            self.totals["events"] += 1
+            return self._size >= self.max_events or time.monotonic() - self._window_started >= self.window_s
+
+    def due(self):
+        """窗口是否到期"""
+        with self._lock:
+            return self._size > 0 and time.monotonic() - self._window_started >= self.window_s
+
+    def _product_vectors(self, product_ids):
+        """回傳 {product_id: (投影向量, category_id)}，快取未命中的商品以一次查詢取回"""
+        missing = [pid for pid in product_ids if pid not in self._product_cache]
+        if missing:
+            if len(self._product_cache) + len(missing) > PRODUCT_CACHE_SIZE:
+                self._product_cache.clear()
+            rows = self.product_collection.query(expr=f"product_id in {missing}",
+                                                 output_fields=["embedding", "category_id"])
+            if rows:
+                projected = self.projection(np.array([row["embedding"] for row in rows], dtype=np.float32))
+                for row, vector in zip(rows, projected):
+                    self._product_cache[row["product_id"]] = (vector, row["category_id"])
+        return {pid: self._product_cache[pid] for pid in product_ids if pid in self._product_cache}
+
+    def flush(self):
+        """合併窗口內事件並 upsert，回傳更新的用戶數"""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            size = self._size
+            if not size:
+                return 0
+            users, products, alphas = self._users[:size], self._products[:size], self._alphas[:size]
+            self._allocate()
+        started = time.perf_counter()
+
+        products_found = self._product_vectors(np.unique(products).tolist())
+        known = np.array([pid in products_found for pid in products.tolist()], dtype=bool)
+        self.totals["unknown_products"] += int((~known).sum())
+        users, products, alphas = users[known], products[known], alphas[known]
+        if not len(users):
+            return 0
+
+        # 依用戶分組，組內維持事件順序
+        order = np.argsort(users, kind="stable")
+        users, products, alphas = users[order], products[order], alphas[order]
+        vectors = np.stack([products_found[pid][0] for pid in products.tolist()])
+        user_ids, keep, deltas = coalesce(users, alphas, vectors)
+
+        scalar_names = [f.name for f in self._user_fields if f.name not in ("user_id", "embedding")]
+        rows = self.user_collection.query(expr=f"user_id in {user_ids.tolist()}",
+                                          output_fields=["embedding"] + scalar_names)
+        existing = {row["user_id"]: row for row in rows}
+
+        embeddings = deltas.copy()
+        columns = {name: [] for name in scalar_names}
+        # 新用戶以最後一筆事件的商品分類作為偏好分類
+        last_of_user = np.append(np.flatnonzero(np.diff(users)), len(users) - 1)
+        top_product = {int(users[i]): int(products[i]) for i in last_of_user}
+        for i, user_id in enumerate(user_ids.tolist()):
+            row = existing.get(user_id)
+            if row is not None:
+                embeddings[i] += keep[i] * np.asarray(row["embedding"], dtype=np.float32)
+                for name in scalar_names:
+                    columns[name].append(row[name])
+            else:
+                defaults = dict(NEW_USER_DEFAULTS, preference_category=products_found[top_product[user_id]][1],
+                                created_at=int(time.time()))
+                for name in scalar_names:
+                    columns[name].append(defaults.get(name, 0))
+
+        batch = ColumnBatch(self._user_fields, dict(columns, user_id=user_ids, embedding=embeddings))
+        self.user_collection.upsert(batch.prepared(self.user_collection.name).column_list())
+
+        self.totals["flushes"] += 1
+        self.totals["users_updated"] += len(existing)
+        self.totals["users_created"] += len(user_ids) - len(existing)
+        self.totals["flush_s"] += time.perf_counter() - started
+        return len(user_ids)
+
+    def consume(self, events):
+        """消費事件迭代器 ({user_id, behavior_type, product_id, duration})；
+        背景執行緒在事件暫停時仍依窗口到期寫回"""
+        stopped = threading.Event()
+
+        def ticker():
+            while not stopped.wait(self.window_s / 4):
+                if self.due():
+                    self.flush()
+
+        thread = threading.Thread(target=ticker, name="user-vector-flush", daemon=True)
+        thread.start()
+        try:
+            for event in events:
+                if self.add(int(event["user_id"]), event["behavior_type"], int(event["product_id"]),
+                            int(event.get("duration") or 0)):
+                    self.flush()
+        finally:
+            stopped.set()
+            thread.join()
+            self.flush()
+
+
+def read_events(path):
+    """逐行讀取 JSON Lines 事件 (path 為 - 時讀取 stdin)"""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def print_totals(totals):
+    print(f"📊 事件 {totals['events']} 筆 (忽略 {totals['ignored']}, 未知商品 {totals['unknown_products']}), "
+          f"寫回 {totals['flushes']} 次, 更新 {totals['users_updated']} / 新增 {totals['users_created']} 位用戶, "
+          f"寫回耗時 {totals['flush_s']:.2f}s")
+
+
+# ==============================================
+# 本地測量
+# ==============================================
+
+def run_benchmark(n_products, n_users, n_events, seed=0):
+    """本地引擎: 單筆事件成本、窗口寫回成本，以及偏好轉移後推薦分類的變化"""
+    from pymilvus import CollectionSchema, DataType, FieldSchema
+    from milvus_local_engine import LocalMilvus
+
+    rng = np.random.default_rng(seed)
+    n_categories = 5
+    # 與 milvus-test-data.py 相同: 分類特徵區段 (商品 100 維 / 用戶 50 維)
+    product_categories = rng.integers(0, n_categories, n_products)
+    products = rng.random((n_products, PRODUCT_DIM), dtype=np.float32)
+    products[np.arange(n_products)[:, None], product_categories[:, None] * 100 + np.arange(100)] += 0.6
+    user_categories = rng.integers(0, n_categories, n_users)
+    users = rng.random((n_users, USER_DIM), dtype=np.float32)
+    users[np.arange(n_users)[:, None], user_categories[:, None] * 50 + np.arange(50)] += 0.4
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = LocalMilvus(data_dir)
+        product_collection = client.collection("product_vectors", CollectionSchema(fields=[
+            FieldSchema(name="product_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=PRODUCT_DIM),
+            FieldSchema(name="category_id", dtype=DataType.INT64),
+        ]))
+        product_collection.insert([np.arange(n_products), prepare_vectors("product_vectors", products),
+                                   product_categories])
+        product_collection.load()
+        user_collection = client.collection("user_vectors", CollectionSchema(fields=[
+            FieldSchema(name="user_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=USER_DIM),
+            FieldSchema(name="age_group", dtype=DataType.INT64),
+            FieldSchema(name="preference_category", dtype=DataType.INT64),
+            FieldSchema(name="gender", dtype=DataType.VARCHAR, max_length=10),
+            FieldSchema(name="created_at", dtype=DataType.INT64),
+        ]))
+        user_collection.insert([np.arange(n_users), prepare_vectors("user_vectors", users),
+                                np.ones(n_users, dtype=np.int64), user_categories,
+                                ["F"] * n_users, np.zeros(n_users, dtype=np.int64)])
+        user_collection.load()
+
+        updater = UserVectorUpdater(user_collection, product_collection, window_s=3600)
+        # 兩個窗口: 第一個包含商品快取填入，第二個為快取已暖的穩定狀態
+        windows = []
+        for _ in range(2):
+            event_users = rng.integers(0, n_users, n_events)
+            event_products = rng.integers(0, n_products, n_events)
+            event_types = rng.choice(list(BEHAVIOR_WEIGHTS), n_events)
+            event_durations = rng.integers(0, 120, n_events)
+            started = time.perf_counter()
+            for user_id, behavior_type, product_id, duration in zip(
+                    event_users.tolist(), event_types.tolist(), event_products.tolist(), event_durations.tolist()):
+                updater.add(user_id, behavior_type, product_id, duration)
+            add_us = (time.perf_counter() - started) / n_events * 1e6
+            started = time.perf_counter()
+            updated = updater.flush()
+            windows.append((add_us, updated, (time.perf_counter() - started) * 1000))
+
+        # 偏好轉移: 用戶 0 連續對另一分類的商品加入購物車
+        user_id = 0
+        target = (int(user_categories[user_id]) + 1) % n_categories
+        target_products = np.flatnonzero(product_categories == target)[:5]
+        projected_products = updater.projection(products)
+
+        def category_share():
+            vector = np.asarray(user_collection.query(expr=f"user_id == {user_id}",
+                                                      output_fields=["embedding"])[0]["embedding"])
+            top = np.argsort(-(projected_products @ vector))[:20]
+            return float(np.mean(product_categories[top] == target))
+
+        before = category_share()
+        steps = []
+        for product_id in target_products.tolist():
+            updater.add(user_id, "add_to_cart", product_id, 60)
+            updater.flush()
+            steps.append(category_share())
+        client.close()
+
+    for label, (add_us, updated, flush_ms) in zip(("商品快取未暖", "商品快取已暖"), windows):
+        print(f"{label}: 緩衝每筆 {add_us:.2f} µs, 寫回 {updated} 位用戶 (合併 {n_events} 筆事件) "
+              f"{flush_ms:.1f} ms, 每筆事件 {flush_ms * 1000 / n_events:.1f} µs")
+    print(f"偏好轉移: 用戶 {user_id} 對分類 {target} 商品連續加入購物車，前 20 推薦屬於該分類比例 "
+          f"{before:.0%} → " + " → ".join(f"{share:.0%}" for share in steps))
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="即時用戶向量更新")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    consume_parser = subparsers.add_parser("consume", help="消費 JSON Lines 行為事件並寫回 user_vectors")
+    consume_parser.add_argument("--events", default="-")
+    consume_parser.add_argument("--window-s", type=float, default=DEFAULT_WINDOW_S)
+    consume_parser.add_argument("--projection", help="512×256 投影矩陣 .npy，省略則使用相鄰維度平均")
+
+    bench_parser = subparsers.add_parser("bench", help="以本地引擎測量")
+    bench_parser.add_argument("--products", type=int, default=20_000)
+    bench_parser.add_argument("--users", type=int, default=10_000)
+    bench_parser.add_argument("--events", type=int, default=100_000)
+
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_benchmark(args.products, args.users, args.events)
+        return
+
+    from pymilvus import connections
+    from milvus_common import connect_to_milvus
+    from milvus_load_manager import CollectionLoadManager
+
+    if not connect_to_milvus():
+        sys.exit(1)
+    updater = None
+    try:
+        load_manager = CollectionLoadManager()
+        load_manager.sync_loaded_collections()
+        projection = ProductProjection.load(args.projection) if args.projection else None
+        updater = UserVectorUpdater(load_manager.acquire("user_vectors"), load_manager.acquire("product_vectors"),
+                                    projection, window_s=args.window_s)
+        updater.consume(read_events(args.events))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"❌ 用戶向量更新失敗: {e}")
+        sys.exit(1)
+    finally:
+        if updater is not None:
+            print_totals(updater.totals)
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
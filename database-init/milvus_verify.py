@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+集合資料完整性驗證
+將 INT64 主鍵空間切成多個範圍，以分頁查詢迭代器平行掃描，逐範圍檢查:
+  - 向量維度、NaN / Inf、向量長度分布
+  - 重複主鍵
+  - 與來源 manifest 比對每個範圍的筆數與 checksum
+checksum 為每筆資料 64 位元雜湊的總和 (與順序無關)，涵蓋主鍵、向量與純量欄位；
+auto_id 主鍵在快照還原後會重新產生，這類集合的雜湊不含主鍵，且只比對整個集合的筆數與 checksum
+來源 manifest 可由來源叢集掃描產生，或直接由 milvus_snapshot.py 的匯出目錄產生
+
+用法:
+    python3 milvus_verify.py manifest source.json --ranges 32          # 掃描來源叢集
+    python3 milvus_verify.py manifest-from-snapshot ./snapshots/20240101 source.json
+    python3 milvus_verify.py verify source.json --workers 8
+    python3 milvus_verify.py scan --collections product_vectors        # 不比對，只檢查資料
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pymilvus import DataType
+
+# 驗證設定
+MANIFEST_FORMAT_VERSION = 1
+DEFAULT_RANGES = 16
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 5_000
+HASH_SEED = 20240101
+NORM_BIN_EDGES = np.concatenate([[0.0], np.logspace(-3, 4, 29)])
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+VECTOR_TYPES = (DataType.FLOAT_VECTOR, DataType.BINARY_VECTOR)
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix64(values):
+    """splitmix64 終結函數 (uint64 陣列)"""
+    values = values.astype(np.uint64, copy=True)
+    with np.errstate(over="ignore"):
+        values ^= values >> np.uint64(30)
+        values *= np.uint64(0xBF58476D1CE4E5B9)
+        values ^= values >> np.uint64(27)
+        values *= np.uint64(0x94D049BB133111EB)
+        values ^= values >> np.uint64(31)
+    return values
+
+
+def _column_weights(width, salt):
+    rng = np.random.default_rng([HASH_SEED, salt])
+    return rng.integers(0, 2 ** 63, width, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def hash_column(field, values, field_index):
+    """回傳每筆資料在此欄位的 64 位元雜湊；向量維度錯誤的列回傳 None 於第二個值"""
+    salt = np.uint64(field_index + 1)
+    if field.dtype == DataType.FLOAT_VECTOR:
+        block = np.asarray(values, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    elif field.dtype == DataType.BINARY_VECTOR:
+        block = np.frombuffer(b"".join(values), dtype=np.uint8).reshape(len(values), -1).astype(np.uint64)
+    elif field.dtype in (DataType.FLOAT, DataType.DOUBLE):
+        block = np.asarray(values, dtype=np.float64).view(np.uint64)[:, None]
+    elif field.dtype == DataType.VARCHAR:
+        block = np.fromiter((zlib.crc32(value.encode("utf-8")) for value in values),
+                            dtype=np.uint64, count=len(values))[:, None]
+    elif field.dtype == DataType.JSON:
+        block = np.fromiter((zlib.crc32(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+                             for value in values), dtype=np.uint64, count=len(values))[:, None]
+    else:
+        block = np.asarray(values, dtype=np.int64).view(np.uint64)[:, None]
+    with np.errstate(over="ignore"):
+        return _mix64((block * _column_weights(block.shape[1], int(salt))).sum(axis=1, dtype=np.uint64) + salt)
+
+
+class RangeStats:
+    """單一主鍵範圍的累計統計"""
+
+    def __init__(self, lo, hi):
+        self.lo = lo
+        self.hi = hi
+        self.rows = 0
+        self.checksum = np.uint64(0)
+        self.dim_errors = 0
+        self.nan_rows = 0
+        self.inf_rows = 0
+        self.norm_histogram = np.zeros(len(NORM_BIN_EDGES), dtype=np.int64)
+        self.norm_min = np.inf
+        self.norm_max = 0.0
+        self.norm_sum = 0.0
+        self._pk_blocks = []
+        self.elapsed_s = 0.0
+
+    def add(self, fields, columns):
+        """累計一個批次 (欄位名稱 → 值清單)"""
+        pk_field = next(f for f in fields if f.is_primary)
+        n_rows = len(columns[pk_field.name])
+        if not n_rows:
+            return
+        self.rows += n_rows
+        if pk_field.dtype == DataType.INT64:
+            self._pk_blocks.append(np.asarray(columns[pk_field.name], dtype=np.int64))
+        else:
+            self._pk_blocks.append(np.asarray(columns[pk_field.name], dtype=object))
+
+        row_hash = np.zeros(n_rows, dtype=np.uint64)
+        for index, field in enumerate(fields):
+            if field.is_primary and field.auto_id:
+                continue
+            values = columns[field.name]
+            if field.dtype == DataType.FLOAT_VECTOR:
+                dim = field.params["dim"]
+                lengths = np.fromiter((len(value) for value in values), dtype=np.int64, count=n_rows)
+                valid = lengths == dim
+                self.dim_errors += int((~valid).sum())
+                if not valid.all():
+                    values = [value for value, ok in zip(values, valid) if ok]
+                vectors = np.asarray(values, dtype=np.float32).reshape(-1, dim)
+                self._check_values(vectors)
+                hashed = np.zeros(n_rows, dtype=np.uint64)
+                hashed[valid] = hash_column(field, vectors, index)
+            else:
+                hashed = hash_column(field, values, index)
+            with np.errstate(over="ignore"):
+                row_hash += hashed
+        with np.errstate(over="ignore"):
+            self.checksum += _mix64(row_hash).sum(dtype=np.uint64)
+
+    def _check_values(self, vectors):
+        finite = np.isfinite(vectors)
+        bad_rows = ~finite.all(axis=1)
+        self.nan_rows += int(np.isnan(vectors).any(axis=1).sum())
+        self.inf_rows += int(np.isinf(vectors).any(axis=1).sum())
+        norms = np.linalg.norm(vectors[~bad_rows], axis=1)
+        if len(norms):
+            self.norm_histogram += np.bincount(np.searchsorted(NORM_BIN_EDGES, norms, side="right") - 1,
+                                               minlength=len(NORM_BIN_EDGES))[:len(NORM_BIN_EDGES)]
+            self.norm_min = min(self.norm_min, float(norms.min()))
+            self.norm_max = max(self.norm_max, float(norms.max()))
+            self.norm_sum += float(norms.sum())
+
+    def finish(self):
+        """計算重複主鍵並釋放主鍵暫存"""
+        pks = np.concatenate(self._pk_blocks) if self._pk_blocks else np.empty(0, dtype=np.int64)
+        self._pk_blocks = []
+        if pks.dtype == object:
+            pks = pks.astype(str)
+        pks.sort()
+        self.duplicate_keys = int((pks[1:] == pks[:-1]).sum()) if len(pks) > 1 else 0
+        return self
+
+    def to_dict(self):
+        return {
+            "lo": self.lo,
+            "hi": self.hi,
+            "rows": self.rows,
+            "checksum": f"{int(self.checksum):016x}",
+            "duplicate_keys": self.duplicate_keys,
+            "dim_errors": self.dim_errors,
+            "nan_rows": self.nan_rows,
+            "inf_rows": self.inf_rows,
+        }
+
+
+# ==============================================
+# 主鍵範圍
+# ==============================================
+
+def range_expr(pk_name, lo, hi):
+    if lo is None:
+        return ""
+    return f"{pk_name} >= {lo} and {pk_name} < {hi}"
+
+
+def _count(collection, expr):
+    return collection.query(expr=expr, output_fields=["count(*)"])[0]["count(*)"]
+
+
+def find_pk_bounds(collection, pk_name):
+    """以 count(*) 二分搜尋主鍵最小與最大值，集合為空時回傳 None"""
+    if not _count(collection, f"{pk_name} >= {INT64_MIN}"):
+        return None
+    lo, hi = INT64_MIN, INT64_MAX
+    while lo < hi:  # 最小的 x 使 count(pk <= x) > 0
+        mid = (lo + hi) // 2
+        if _count(collection, f"{pk_name} <= {mid}"):
+            hi = mid
+        else:
+            lo = mid + 1
+    pk_min = lo
+    lo, hi = pk_min, INT64_MAX
+    while lo < hi:  # 最小的 x 使 count(pk > x) == 0
+        mid = (lo + hi) // 2
+        if _count(collection, f"{pk_name} > {mid}"):
+            lo = mid + 1
+        else:
+            hi = mid
+    return pk_min, lo
+
+
+def split_ranges(pk_min, pk_max, n_ranges):
+    """將 [pk_min, pk_max] 等寬切成 n_ranges 個半開區間"""
+    n_ranges = max(1, min(n_ranges, pk_max - pk_min + 1))
+    edges = [pk_min + (pk_max + 1 - pk_min) * i // n_ranges for i in range(n_ranges + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# ==============================================
+# 掃描
+# ==============================================
+
+def scan_range(collection, fields, lo, hi, batch_size=DEFAULT_BATCH_SIZE):
+    """以分頁迭代器掃描單一主鍵範圍"""
+    started = time.perf_counter()
+    pk_name = next(f.name for f in fields if f.is_primary)
+    stats = RangeStats(lo, hi)
+    iterator = collection.query_iterator(
+        batch_size=batch_size, expr=range_expr(pk_name, lo, hi), output_fields=[f.name for f in fields],
+    )
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            stats.add(fields, {f.name: [row[f.name] for row in rows] for f in fields})
+    finally:
+        iterator.close()
+    stats.elapsed_s = time.perf_counter() - started
+    return stats.finish()
+
+
+def scan_collection(collection, n_ranges=DEFAULT_RANGES, workers=DEFAULT_WORKERS,
+                    batch_size=DEFAULT_BATCH_SIZE, ranges=None):
+    """平行掃描整個集合，回傳報告 (可作為 manifest 項目)"""
+    started = time.perf_counter()
+    fields = collection.schema.fields
+    pk_field = next(f for f in fields if f.is_primary)
+
+    if ranges is None:
+        if pk_field.dtype == DataType.INT64:
+            bounds = find_pk_bounds(collection, pk_field.name)
+            ranges = split_ranges(*bounds, n_ranges) if bounds else []
+        else:
+            ranges = [(None, None)]  # VARCHAR 主鍵不切範圍
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda bounds: scan_range(collection, fields, *bounds, batch_size), ranges))
+    return build_report(collection.name, pk_field.name, results, time.perf_counter() - started, pk_field.auto_id)
+
+
+def build_report(name, pk_name, results, elapsed, auto_id=False):
+    """合併各範圍統計"""
+    rows = sum(stats.rows for stats in results)
+    with np.errstate(over="ignore"):
+        checksum = sum((stats.checksum for stats in results), np.uint64(0))
+    histogram = sum((stats.norm_histogram for stats in results), np.zeros(len(NORM_BIN_EDGES), dtype=np.int64))
+    norm_rows = int(histogram.sum())
+    return {
+        "name": name,
+        "pk_field": pk_name,
+        "auto_id": auto_id,
+        "rows": rows,
+        "checksum": f"{int(checksum):016x}",
+        "elapsed_s": elapsed,
+        "rows_per_s": rows / max(elapsed, 1e-9),
+        "ranges": [stats.to_dict() for stats in results],
+        "norms": {
+            "min": min((s.norm_min for s in results), default=0.0) if norm_rows else None,
+            "max": max((s.norm_max for s in results), default=0.0) if norm_rows else None,
+            "mean": sum(s.norm_sum for s in results) / norm_rows if norm_rows else None,
+            "bin_edges": NORM_BIN_EDGES.tolist(),
+            "histogram": histogram.tolist(),
+        },
+    }
+
+
+def manifest_from_snapshot(snapshot_dir, n_ranges=DEFAULT_RANGES, batch_size=DEFAULT_BATCH_SIZE,
+                           collection_names=None):
+    """由 milvus_snapshot.py 的匯出目錄計算各集合的範圍 checksum"""
+    import pyarrow.parquet as pq
+    from pymilvus import CollectionSchema
+
+    with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+        snapshot = json.load(f)
+
+    entries = []
+    for entry in snapshot["collections"]:
+        if collection_names and entry["name"] not in collection_names:
+            continue
+        started = time.perf_counter()
+        fields = CollectionSchema.construct_from_dict(entry["schema"]).fields
+        pk_field = next(f for f in fields if f.is_primary)
+        parquet_path = os.path.join(snapshot_dir, entry["scalar_file"])
+        vectors = {name: np.load(os.path.join(snapshot_dir, filename), mmap_mode="r")
+                   for name, filename in entry["vector_files"].items()}
+
+        if pk_field.dtype == DataType.INT64:
+            pks = pq.read_table(parquet_path, columns=[pk_field.name]).column(0).to_numpy()
+            ranges = split_ranges(int(pks.min()), int(pks.max()), n_ranges) if len(pks) else []
+            del pks
+        else:
+            ranges = [(None, None)]
+        stats = [RangeStats(lo, hi) for lo, hi in ranges]
+        starts = np.array([lo for lo, _ in ranges], dtype=np.int64) if ranges and ranges[0][0] is not None else None
+
+        offset = 0
+        for record_batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=batch_size):
+            n_rows = record_batch.num_rows
+            columns = {}
+            for field in fields:
+                if field.name in vectors:
+                    block = np.asarray(vectors[field.name][offset:offset + n_rows])
+                    columns[field.name] = [row.tobytes() for row in block] \
+                        if field.dtype == DataType.BINARY_VECTOR else block
+                else:
+                    values = record_batch.column(field.name).to_pylist()
+                    if field.dtype == DataType.JSON:
+                        values = [json.loads(value) for value in values]
+                    columns[field.name] = values
+            offset += n_rows
+
+            if starts is None:
+                stats[0].add(fields, columns)
+                continue
+            bucket = np.searchsorted(starts, np.asarray(columns[pk_field.name], dtype=np.int64), side="right") - 1
+            for index in np.unique(bucket):
+                rows = np.flatnonzero(bucket == index)
+                stats[index].add(fields, {
+                    name: (values[rows] if isinstance(values, np.ndarray) else [values[row] for row in rows])
+                    for name, values in columns.items()
+                })
+
+        entries.append(build_report(entry["name"], pk_field.name, [s.finish() for s in stats],
+                                    time.perf_counter() - started, pk_field.auto_id))
+    return entries
+
+
+def total_checksum(entry):
+    """整個集合的 checksum (各範圍 checksum 的和；相容未記錄總和的舊 manifest)"""
+    if "checksum" in entry:
+        return entry["checksum"]
+    total = sum(int(r["checksum"], 16) for r in entry["ranges"]) & 0xFFFFFFFFFFFFFFFF
+    return f"{total:016x}"
+
+
+def compare(report, source):
+    """比對掃描結果與來源 manifest 項目，回傳問題清單"""
+    problems = []
+    if report["rows"] != source["rows"]:
+        problems.append(f"總筆數 {report['rows']} ≠ 來源 {source['rows']}")
+    if report["auto_id"]:  # 主鍵不同，範圍無法對應，只比對整個集合
+        if report["rows"] == source["rows"] and report["checksum"] != total_checksum(source):
+            problems.append("整個集合 checksum 不符")
+        return problems
+    source_ranges = {(r["lo"], r["hi"]): r for r in source["ranges"]}
+    for current in report["ranges"]:
+        expected = source_ranges.get((current["lo"], current["hi"]))
+        if expected is None:
+            problems.append(f"範圍 [{current['lo']}, {current['hi']}) 不在來源 manifest")
+        elif current["rows"] != expected["rows"]:
+            problems.append(f"範圍 [{current['lo']}, {current['hi']}): 筆數 {current['rows']} ≠ {expected['rows']}")
+        elif current["checksum"] != expected["checksum"]:
+            problems.append(f"範圍 [{current['lo']}, {current['hi']}): checksum 不符")
+    return problems
+
+
+def data_problems(report):
+    """掃描結果本身的資料問題 (不需來源)"""
+    problems = []
+    for key, label in (("duplicate_keys", "重複主鍵"), ("dim_errors", "維度錯誤"),
+                       ("nan_rows", "含 NaN"), ("inf_rows", "含 Inf")):
+        total = sum(r[key] for r in report["ranges"])
+        if total:
+            problems.append(f"{label} {total} 筆")
+    return problems
+
+
+def print_report(report, problems):
+    """顯示單一集合的驗證結果"""
+    norms = report["norms"]
+    status = "✅" if not problems else "❌"
+    print(f"{status} {report['name']}: {report['rows']} 筆, {len(report['ranges'])} 個範圍, "
+          f"{report['elapsed_s']:.2f}s ({report['rows_per_s']:.0f} 筆/秒)")
+    if norms["mean"] is not None:
+        print(f"  向量長度 min {norms['min']:.4f} / mean {norms['mean']:.4f} / max {norms['max']:.4f}")
+    for problem in problems:
+        print(f"  - {problem}")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Milvus 集合資料完整性驗證")
+    parser.add_argument("--collections", nargs="*")
+    parser.add_argument("--ranges", type=int, default=DEFAULT_RANGES)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    manifest_parser = subparsers.add_parser("manifest", help="掃描目前連線的叢集產生來源 manifest")
+    manifest_parser.add_argument("output")
+    snapshot_parser = subparsers.add_parser("manifest-from-snapshot", help="由快照目錄產生來源 manifest")
+    snapshot_parser.add_argument("snapshot_dir")
+    snapshot_parser.add_argument("output")
+    verify_parser = subparsers.add_parser("verify", help="掃描並與來源 manifest 比對")
+    verify_parser.add_argument("manifest")
+    subparsers.add_parser("scan", help="只檢查資料問題")
+
+    args = parser.parse_args()
+
+    if args.command == "manifest-from-snapshot":
+        entries = manifest_from_snapshot(args.snapshot_dir, args.ranges, args.batch_size, args.collections)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"format_version": MANIFEST_FORMAT_VERSION, "collections": entries}, f, indent=2)
+        for entry in entries:
+            print_report(entry, data_problems(entry))
+        return
+
+    from pymilvus import connections, utility
+    from milvus_common import ECOMMERCE_COLLECTIONS, connect_to_milvus
+    from milvus_load_manager import CollectionLoadManager
+
+    if not connect_to_milvus():
+        sys.exit(1)
+
+    failed = False
+    try:
+        source = {}
+        if args.command == "verify":
+            with open(args.manifest, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["format_version"] != MANIFEST_FORMAT_VERSION:
+                raise ValueError(f"不支援的 manifest 版本: {manifest['format_version']}")
+            source = {entry["name"]: entry for entry in manifest["collections"]}
+
+        names = args.collections or (list(source) if source else [
+            name for name in ECOMMERCE_COLLECTIONS if utility.has_collection(name)
+        ])
+        load_manager = CollectionLoadManager()
+        load_manager.sync_loaded_collections()
+
+        reports = []
+        for name in names:
+            collection = load_manager.acquire(name)
+            expected = source.get(name)
+            ranges = None
+            auto_id = next(f for f in collection.schema.fields if f.is_primary).auto_id
+            if expected and not auto_id:
+                ranges = [(r["lo"], r["hi"]) for r in expected["ranges"]]
+            report = scan_collection(collection, args.ranges, args.workers, args.batch_size, ranges)
+            problems = data_problems(report)
+            if expected:
+                problems += compare(report, expected)
+            failed |= bool(problems)
+            print_report(report, problems)
+            reports.append(report)
+
+        if args.command == "manifest":
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"format_version": MANIFEST_FORMAT_VERSION, "collections": reports}, f, indent=2)
+            print(f"✅ 已寫入來源 manifest {args.output}")
+    except Exception as e:
+        print(f"❌ 驗證失敗: {e}")
+        failed = True
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Zipf 分布的推薦流量產生與重播
+依可設定的偏斜度從 Zipf 分布抽樣熱門商品與活躍用戶，
+依比例混合相似商品、用戶推薦與分類過濾搜尋，輸出可重播的 trace 檔 (JSON Lines)
+
+用法:
+    python3 milvus_workload.py generate trace.jsonl --events 100000 --products 25 --users 13
+    python3 milvus_workload.py replay trace.jsonl
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from milvus_common import collection_search_params
+
+# 流量設定
+DEFAULT_PRODUCT_SKEW = 1.1
+DEFAULT_USER_SKEW = 0.9
+DEFAULT_QPS = 200
+DEFAULT_LIMIT = 10
+DEFAULT_SEED = 7
+DEFAULT_MIX = {
+    "similar_product": 0.5,
+    "user_to_product": 0.3,
+    "category_search": 0.2,
+}
+TRACE_FORMAT_VERSION = 1
+
+
+class ZipfSampler:
+    """在有限母體上依 Zipf(s) 抽樣；名次與 ID 的對應以種子隨機打散"""
+
+    def __init__(self, ids, skew, rng):
+        self.ids = rng.permutation(np.asarray(ids))
+        weights = 1.0 / np.arange(1, len(self.ids) + 1) ** skew
+        self._cdf = np.cumsum(weights / weights.sum())
+
+    def sample(self, size, rng):
+        ranks = np.searchsorted(self._cdf, rng.random(size), side="right")
+        return self.ids[np.minimum(ranks, len(self.ids) - 1)]
+
+
+class WorkloadGenerator:
+    """產生 Zipf 偏斜的混合搜尋事件"""
+
+    def __init__(self, product_ids, user_ids, product_categories=None,
+                 product_skew=DEFAULT_PRODUCT_SKEW, user_skew=DEFAULT_USER_SKEW,
+                 mix=None, qps=DEFAULT_QPS, limit=DEFAULT_LIMIT, seed=DEFAULT_SEED):
+        self.mix = dict(mix or DEFAULT_MIX)
+        total = sum(self.mix.values())
+        if total <= 0:
+            raise ValueError("搜尋類型比例總和必須大於 0")
+
+        self.config = {
+            "product_skew": product_skew,
+            "user_skew": user_skew,
+            "mix": {name: weight / total for name, weight in self.mix.items()},
+            "qps": qps,
+            "limit": limit,
+            "seed": seed,
+            "n_products": len(product_ids),
+            "n_users": len(user_ids),
+        }
+        self._rng = np.random.default_rng(seed)
+        self._products = ZipfSampler(product_ids, product_skew, self._rng)
+        self._users = ZipfSampler(user_ids, user_skew, self._rng)
+        self._categories = dict(zip(product_ids, product_categories)) if product_categories is not None else {}
+
+    def generate(self, n_events):
+        """產生 n_events 筆事件，到達時間為指定 QPS 的 Poisson 過程"""
+        rng = self._rng
+        types = list(self.config["mix"])
+        type_index = rng.choice(len(types), size=n_events, p=list(self.config["mix"].values()))
+        offsets_ms = np.cumsum(rng.exponential(1000.0 / self.config["qps"], n_events))
+        product_ids = self._products.sample(n_events, rng)
+        user_ids = self._users.sample(n_events, rng)
+
+        events = []
+        for seq in range(n_events):
+            search_type = types[type_index[seq]]
+            event = {
+                "seq": seq,
+                "offset_ms": round(float(offsets_ms[seq]), 3),
+                "type": search_type,
+                "limit": self.config["limit"],
+            }
+            if search_type == "user_to_product":
+                event["user_id"] = int(user_ids[seq])
+            else:
+                event["product_id"] = int(product_ids[seq])
+                if search_type == "category_search" and self._categories:
+                    event["category_id"] = int(self._categories[product_ids[seq]])
+            events.append(event)
+        return events
+
+
+def save_trace(path, config, events):
+    """寫入 trace 檔: 第一行為設定，其後每行一個事件"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"format_version": TRACE_FORMAT_VERSION, "config": config}) + "\n")
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+def load_trace(path):
+    """讀取 trace 檔，回傳 (設定, 事件清單)"""
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format_version") != TRACE_FORMAT_VERSION:
+            raise ValueError(f"不支援的 trace 版本: {header.get('format_version')}")
+        events = [json.loads(line) for line in f if line.strip()]
+    return header["config"], events
+
+
+def summarize_skew(events, key):
+    """最熱門 1% / 10% 的 ID 佔總請求的比例"""
+    ids = np.array([event[key] for event in events if key in event])
+    if not len(ids):
+        return {}
+    _, counts = np.unique(ids, return_counts=True)
+    counts = np.sort(counts)[::-1]
+    share = lambda fraction: float(counts[:max(1, int(len(counts) * fraction))].sum() / counts.sum())
+    return {"distinct": len(counts), "top_1pct_share": share(0.01), "top_10pct_share": share(0.1)}
+
+
+# ==============================================
+# 重播
+# ==============================================
+
+def make_milvus_handlers(product_collection, recommendation_collection):
+    """以集合物件 (Milvus 或本地引擎) 建立各搜尋類型的處理函數"""
+    search_params = collection_search_params(product_collection.name)
+
+    def product_embedding(product_id):
+        rows = product_collection.query(
+            expr=f"product_id == {product_id}", output_fields=["embedding", "category_id"]
+        )
+        return rows[0] if rows else None
+
+    def similar_product(event):
+        row = product_embedding(event["product_id"])
+        if row is None:
+            return []
+        return product_collection.search(
+            data=[row["embedding"]], anns_field="embedding", param=search_params,
+            limit=event["limit"], expr=f"product_id != {event['product_id']}",
+            output_fields=["category_id", "brand"],
+        )[0]
+
+    def user_to_product(event):
+        # user_vectors (256 維) 與 product_vectors (512 維) 不同空間，改查預先計算的推薦結果
+        return recommendation_collection.query(
+            expr=f"user_id == {event['user_id']}", output_fields=["product_id", "score"],
+            limit=event["limit"],
+        )
+
+    def category_search(event):
+        row = product_embedding(event["product_id"])
+        if row is None:
+            return []
+        category_id = event.get("category_id", row["category_id"])
+        return product_collection.search(
+            data=[row["embedding"]], anns_field="embedding", param=search_params,
+            limit=event["limit"], expr=f"category_id == {category_id}",
+            output_fields=["category_id", "brand"],
+        )[0]
+
+    return {
+        "similar_product": similar_product,
+        "user_to_product": user_to_product,
+        "category_search": category_search,
+    }
+
+
+def replay(events, handlers, speed=None):
+    """依序重播事件並記錄各類型延遲
+
+    speed 為 None 時盡可能快速重播；否則依 offset_ms / speed 控制送出時間
+    """
+    latencies = {}
+    errors = {}
+    start = time.perf_counter()
+    for event in events:
+        if speed:
+            wait = event["offset_ms"] / 1000.0 / speed - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+        began = time.perf_counter()
+        try:
+            handlers[event["type"]](event)
+            latencies.setdefault(event["type"], []).append((time.perf_counter() - began) * 1000)
+        except Exception as e:
+            errors[event["type"]] = errors.get(event["type"], 0) + 1
+            if errors[event["type"]] == 1:
+                print(f"⚠️ {event['type']} 失敗: {e}")
+    elapsed = time.perf_counter() - start
+
+    report = {"events": len(events), "elapsed_s": elapsed,
+              "throughput_qps": len(events) / max(elapsed, 1e-9), "by_type": {}}
+    for search_type, values in latencies.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        report["by_type"][search_type] = {
+            "count": len(values), "errors": errors.get(search_type, 0),
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+        }
+    return report
+
+
+def print_report(report):
+    """顯示重播結果"""
+    print(f"重播 {report['events']} 筆事件, {report['elapsed_s']:.2f}s, "
+          f"{report['throughput_qps']:.0f} QPS")
+    for search_type, stats in report["by_type"].items():
+        print(f"  - {search_type}: {stats['count']} 筆 (錯誤 {stats['errors']}), "
+              f"p50 {stats['p50_ms']:.2f} / p95 {stats['p95_ms']:.2f} / p99 {stats['p99_ms']:.2f} ms")
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="Zipf 推薦流量產生與重播")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="產生 trace 檔")
+    generate_parser.add_argument("trace")
+    generate_parser.add_argument("--events", type=int, default=10_000)
+    generate_parser.add_argument("--products", type=int, default=25, help="商品 ID 1..N")
+    generate_parser.add_argument("--users", type=int, default=13, help="用戶 ID 1..N")
+    generate_parser.add_argument("--from-milvus", action="store_true",
+                                 help="由 product_vectors / user_vectors 讀取實際 ID")
+    generate_parser.add_argument("--product-skew", type=float, default=DEFAULT_PRODUCT_SKEW)
+    generate_parser.add_argument("--user-skew", type=float, default=DEFAULT_USER_SKEW)
+    generate_parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX,
+                                 help='例如 \'{"similar_product": 0.6, "category_search": 0.4}\'')
+    generate_parser.add_argument("--qps", type=float, default=DEFAULT_QPS)
+    generate_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    replay_parser = subparsers.add_parser("replay", help="對 Milvus 重播 trace 檔")
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument("--speed", type=float, default=None,
+                               help="依原始到達時間的倍速重播，省略則全速")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        product_categories = None
+        if args.from_milvus:
+            from pymilvus import Collection, connections
+            from milvus_common import connect_to_milvus
+            if not connect_to_milvus():
+                sys.exit(1)
+            try:
+                Collection("product_vectors").load()
+                Collection("user_vectors").load()
+                products = Collection("product_vectors").query(
+                    expr="product_id >= 0", output_fields=["category_id"])
+                users = Collection("user_vectors").query(expr="user_id >= 0")
+            finally:
+                connections.disconnect("default")
+            product_ids = [row["product_id"] for row in products]
+            product_categories = [row["category_id"] for row in products]
+            user_ids = [row["user_id"] for row in users]
+        else:
+            product_ids = list(range(1, args.products + 1))
+            user_ids = list(range(1, args.users + 1))
+
+        generator = WorkloadGenerator(
+            product_ids, user_ids, product_categories,
+            product_skew=args.product_skew, user_skew=args.user_skew,
+            mix=args.mix, qps=args.qps, seed=args.seed,
+        )
+        events = generator.generate(args.events)
+        save_trace(args.trace, generator.config, events)
+        print(f"✅ 已寫入 {len(events)} 筆事件到 {args.trace}")
+        print(f"商品分布: {summarize_skew(events, 'product_id')}")
+        print(f"用戶分布: {summarize_skew(events, 'user_id')}")
+        return
+
+    from pymilvus import Collection, connections
+    from milvus_common import connect_to_milvus
+    from milvus_load_manager import CollectionLoadManager
+
+    config, events = load_trace(args.trace)
+    print(f"trace 設定: {config}")
+    if not connect_to_milvus():
+        sys.exit(1)
+    try:
+        load_manager = CollectionLoadManager()
+        load_manager.sync_loaded_collections()
+        handlers = make_milvus_handlers(
+            load_manager.acquire("product_vectors"), load_manager.acquire("recommendations")
+        )
+        print_report(replay(events, handlers, speed=args.speed))
+    finally:
+        connections.disconnect("default")
+        print("🔌 Milvus 連線已關閉")
+
+
+if __name__ == "__main__":
+    main()
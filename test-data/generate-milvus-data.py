@@ -5,6 +5,7 @@ Milvus 測試資料生成腳本
 """
 
 import numpy as np
+import os
 import time
 import sys
 
@@ -14,6 +15,10 @@ except ImportError:
     print("❌ 請安裝 pymilvus: pip3 install pymilvus")
     sys.exit(1)
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database-init"))
+from milvus_text_featurizer import TextFeaturizer
+from milvus_hybrid_search import BM25Index, HybridSearcher
+
 def connect_to_milvus():
     """連接到 Milvus 服務"""
     try:
@@ -54,7 +59,7 @@ def create_test_collection():
     print(f"✅ 成功創建集合 {collection_name}")
     return collection
 
-def generate_test_vectors():
+def generate_test_vectors(featurizer):
     """生成測試向量資料"""
     # 模擬商品資料
     products = [
@@ -94,10 +99,10 @@ def generate_test_vectors():
         data["product_id"].append(int(product["product_id"]))
         data["product_name"].append(str(product["name"]))
         data["category"].append(str(product["category"]))
-        
-        # 生成隨機向量（實際應用中會使用真實的商品特徵向量）
-        vector = np.random.random(128).astype(np.float32)
-        data["embedding"].append(vector)
+    
+    # 以商品名稱與分類生成文字向量（實際應用中會使用真實的商品特徵向量）
+    texts = [f"{name} {category}" for name, category in zip(data["product_name"], data["category"])]
+    data["embedding"] = list(featurizer.fit_transform(texts))
     
     return data
 
@@ -126,11 +131,12 @@ def insert_test_data(collection, data):
         print(f"❌ 插入資料失敗: {e}")
         return False
 
-def test_search(collection):
+def test_search(collection, featurizer, query_text="Sony 降噪耳機 音響"):
     """測試向量搜尋"""
     try:
-        # 生成查詢向量
-        search_vector = np.random.random(128).astype(np.float32).tolist()
+        # 由查詢文字生成查詢向量
+        search_vector = featurizer.transform([query_text])[0].tolist()
+        print(f"查詢文字: {query_text}")
         
         search_params = {
             "metric_type": "L2",
@@ -154,6 +160,25 @@ def test_search(collection):
         print(f"❌ 搜尋測試失敗: {e}")
         return False
 
+def test_hybrid_search(collection, featurizer, query_text="Sony WH-1000XM5"):
+    """測試向量 + BM25 混合搜尋 (品牌型號查詢)"""
+    try:
+        bm25_index = BM25Index.from_collection(collection, "id", "product_name", ["category"])
+        searcher = HybridSearcher(collection, bm25_index, featurizer)
+        results, timings = searcher.search(query_text, limit=5, output_fields=["product_name", "category"])
+        
+        print(f"✅ 混合搜尋測試成功，查詢文字: {query_text}")
+        for i, result in enumerate(results):
+            entity = result["entity"] or {}
+            print(f"  {i+1}. {entity.get('product_name')} ({entity.get('category')}) - "
+                  f"RRF: {result['score']:.4f}, 向量排名: {result['dense_rank']}, 關鍵字排名: {result['sparse_rank']}")
+        print("  延遲: " + ", ".join(f"{stage} {ms:.2f}" for stage, ms in timings.items()))
+        
+        return True
+    except Exception as e:
+        print(f"❌ 混合搜尋測試失敗: {e}")
+        return False
+
 def main():
     """主函數"""
     print("🚀 開始生成 Milvus 測試資料...")
@@ -168,7 +193,8 @@ def main():
         
         # 生成測試資料
         print("📊 生成測試向量資料...")
-        test_data = generate_test_vectors()
+        featurizer = TextFeaturizer(dim=128)
+        test_data = generate_test_vectors(featurizer)
         
         # 插入測試資料
         print("💾 插入測試資料...")
@@ -177,7 +203,10 @@ def main():
         
         # 測試搜尋功能
         print("🔍 測試向量搜尋...")
-        if not test_search(collection):
+        if not test_search(collection, featurizer):
+            return False
+        
+        if not test_hybrid_search(collection, featurizer):
             return False
         
         print("✅ Milvus 測試資料生成完成！")
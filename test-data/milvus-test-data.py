@@ -4,6 +4,7 @@ Milvus 電商系統測試資料
 擴展現有初始化腳本的測試資料
 """
 
+import os
 import sys
 import json
 import numpy as np
@@ -16,6 +17,15 @@ from pymilvus import (
     utility
 )
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database-init"))
+from milvus_columnar import ColumnBatch, insert_batch
+from milvus_common import collection_search_params, consistency_level, metric_type, prepare_vectors
+from milvus_dedup import DuplicateDetector, print_clusters
+from milvus_load_manager import CollectionLoadManager
+from milvus_range_search import build_similarity_pairs
+from milvus_rerank import search_diverse
+from milvus_text_featurizer import TextFeaturizer
+
 # Milvus 連線設定
 MILVUS_HOST = "localhost"
 MILVUS_PORT = 19530
@@ -49,12 +59,13 @@ def insert_extended_product_data(collection):
     brands = ["SK-II", "Lancôme", "Estée Lauder", "MAC", "Dior", "日本直送", "台灣茶葉", "維他命", 
               "Royal Canin", "貓砂品牌", "魚缸品牌", "Garmin", "機油品牌", "登山品牌", "露營品牌",
               "Apple", "Apple", "Apple", "Nike", "Adidas"]
+    merchant_ids = [4, 4, 4, 4, 4, 5, 5, 5, 6, 6, 6, 7, 7, 8, 8, 1, 1, 1, 2, 3]  # 依類別對應的商家
     
     # 生成隨機向量 (512 維)
-    embeddings = []
+    embeddings = np.random.random((len(product_ids), 512)).astype(np.float32)
     for i in range(len(product_ids)):
         # 根據類別和品牌生成相似的向量
-        base_vector = np.random.random(512).astype(np.float32)
+        base_vector = embeddings[i]  # 直接修改批次陣列的列
         
         # 讓同類別的商品向量更相似
         if category_ids[i] == 6:  # 美妝保養
@@ -67,8 +78,6 @@ def insert_extended_product_data(collection):
             base_vector[300:400] += 0.6  # 增加汽車特徵
         elif category_ids[i] == 10:  # 戶外運動
             base_vector[400:512] += 0.6  # 增加戶外特徵
-        
-        embeddings.append(base_vector.tolist())
     
     # 準備插入資料
     data = [
@@ -77,14 +86,21 @@ def insert_extended_product_data(collection):
         category_ids,
         price_ranges,
         brands,
-        [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(product_ids)
+        [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(product_ids),
+        merchant_ids
     ]
     
-    # 插入資料
-    collection.insert(data)
+    # 插入資料 (先比對既有商品與批次內部，近重複者只保留代表列)
+    load_manager = CollectionLoadManager()
+    load_manager.sync_loaded_collections()
+    detector = DuplicateDetector(load_manager.acquire(collection.name))
+    result = detector.ingest(ColumnBatch(collection.schema.fields, data))
     collection.flush()
     
-    print(f"✅ 已插入 {len(product_ids)} 筆擴展商品向量資料")
+    print(f"✅ 已插入 {detector.totals['inserted']} 筆擴展商品向量資料")
+    if result["clusters"]:
+        print(f"⚠️ 略過 {detector.totals['duplicates']} 筆近重複商品:")
+        print_clusters(result)
 
 def insert_extended_user_data(collection):
     """插入擴展用戶向量資料"""
@@ -97,10 +113,10 @@ def insert_extended_user_data(collection):
     genders = ["F", "F", "F", "M", "F", "M", "F", "M", "F", "M"]
     
     # 生成隨機向量 (256 維)
-    embeddings = []
+    embeddings = np.random.random((len(user_ids), 256)).astype(np.float32)
     for i in range(len(user_ids)):
         # 根據偏好生成向量
-        base_vector = np.random.random(256).astype(np.float32)
+        base_vector = embeddings[i]  # 直接修改批次陣列的列
         
         if preference_categories[i] == 6:  # 偏好美妝保養
             base_vector[:50] += 0.4
@@ -112,8 +128,6 @@ def insert_extended_user_data(collection):
             base_vector[150:200] += 0.4
         elif preference_categories[i] == 10:  # 偏好戶外運動
             base_vector[200:256] += 0.4
-        
-        embeddings.append(base_vector.tolist())
     
     # 準備插入資料
     data = [
@@ -126,7 +140,7 @@ def insert_extended_user_data(collection):
     ]
     
     # 插入資料
-    collection.insert(data)
+    insert_batch(collection, ColumnBatch(collection.schema.fields, data))
     collection.flush()
     
     print(f"✅ 已插入 {len(user_ids)} 筆擴展用戶向量資料")
@@ -160,24 +174,9 @@ def insert_extended_search_data(collection):
         "藍牙耳機 推薦"
     ]
     
-    # 生成查詢向量 (256 維)
-    query_vectors = []
-    for i in range(len(user_ids)):
-        base_vector = np.random.random(256).astype(np.float32)
-        
-        # 根據查詢內容調整向量
-        if "SK-II" in query_texts[i] or "蘭蔻" in query_texts[i] or "MAC" in query_texts[i]:
-            base_vector[:50] += 0.5  # 美妝特徵
-        elif "日本零食" in query_texts[i] or "茶葉" in query_texts[i] or "維他命" in query_texts[i]:
-            base_vector[50:100] += 0.5  # 食品特徵
-        elif "狗糧" in query_texts[i] or "貓砂" in query_texts[i] or "魚缸" in query_texts[i]:
-            base_vector[100:150] += 0.5  # 寵物特徵
-        elif "汽車" in query_texts[i] or "機油" in query_texts[i]:
-            base_vector[150:200] += 0.5  # 汽車特徵
-        elif "登山" in query_texts[i] or "露營" in query_texts[i]:
-            base_vector[200:256] += 0.5  # 戶外特徵
-        
-        query_vectors.append(base_vector.tolist())
+    # 由查詢文字生成查詢向量 (256 維)
+    # 不做 fit，使各腳本對相同文字產生相同向量
+    query_vectors = TextFeaturizer(dim=256).transform(query_texts)
     
     results_counts = [5, 3, 8, 6, 12, 4, 7, 9, 5, 3, 6, 4, 8, 2, 10, 3, 15, 20, 12, 18]
     clicked_products = ["6", "7", "9", "10", "11", "12", "13", "14", "15", "16", "18", "19", "22", "23", "1", "2", "3", "4", "5", "3"]
@@ -192,9 +191,8 @@ def insert_extended_search_data(collection):
         [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(user_ids)
     ]
     
-    # 插入資料
-    collection.insert(data)
-    collection.flush()
+    # 插入資料 (集合為 Eventually 一致性，不需 flush)
+    insert_batch(collection, ColumnBatch(collection.schema.fields, data))
     
     print(f"✅ 已插入 {len(user_ids)} 筆擴展搜尋歷史資料")
 
@@ -255,12 +253,13 @@ def create_user_behavior_collection():
         name=collection_name,
         schema=schema,
         using='default',
-        shards_num=2
+        shards_num=2,
+        consistency_level=consistency_level(collection_name)
     )
     
     # 建立索引
     index_params = {
-        "metric_type": "L2",
+        "metric_type": metric_type(collection_name),
         "index_type": "IVF_SQ8",
         "params": {"nlist": 256}
     }
@@ -292,9 +291,9 @@ def insert_user_behavior_data(collection):
     durations = [120, 5, 30, 180, 10, 300, 90, 8, 45, 200, 12, 60, 150, 7, 40, 160, 9, 280, 140, 11, 50, 170, 6, 35, 130, 8, 55, 190, 10, 320]
     
     # 生成行為向量 (128 維)
-    behavior_vectors = []
+    behavior_vectors = np.random.random((len(user_ids), 128)).astype(np.float32)
     for i in range(len(user_ids)):
-        base_vector = np.random.random(128).astype(np.float32)
+        base_vector = behavior_vectors[i]  # 直接修改批次陣列的列
         
         # 根據行為類型調整向量
         if behavior_types[i] == "view":
@@ -308,8 +307,6 @@ def insert_user_behavior_data(collection):
         elif behavior_types[i] == "wishlist_add":
             base_vector[64:96] += 0.2
             base_vector[96:128] += 0.1
-        
-        behavior_vectors.append(base_vector.tolist())
     
     # 準備插入資料
     data = [
@@ -321,9 +318,8 @@ def insert_user_behavior_data(collection):
         [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(user_ids)
     ]
     
-    # 插入資料
-    collection.insert(data)
-    collection.flush()
+    # 插入資料 (集合為 Session 一致性，同一連線的後續搜尋即可讀到，不需 flush)
+    insert_batch(collection, ColumnBatch(collection.schema.fields, data))
     
     print(f"✅ 已插入 {len(user_ids)} 筆用戶行為資料")
 
@@ -358,7 +354,8 @@ def create_product_similarity_collection():
         name=collection_name,
         schema=schema,
         using='default',
-        shards_num=2
+        shards_num=2,
+        consistency_level=consistency_level(collection_name)
     )
     
     # 建立索引
@@ -376,54 +373,42 @@ def create_product_similarity_collection():
     return collection
 
 def insert_product_similarity_data(collection):
-    """插入商品相似度資料"""
+    """以門檻式相似度搜尋產生並插入商品相似度資料"""
     print("插入商品相似度資料...")
     
-    # 生成商品相似度資料
-    product_id_1s = [1, 1, 1, 2, 2, 2, 3, 3, 3, 6, 6, 6, 7, 7, 7, 8, 8, 8, 9, 9, 9, 11, 11, 11, 14, 14, 14, 18, 18, 18]
-    product_id_2s = [2, 3, 4, 1, 3, 5, 1, 2, 4, 7, 8, 9, 6, 8, 9, 6, 7, 9, 6, 7, 8, 12, 13, 14, 15, 16, 17, 19, 20, 21]
-    similarity_scores = [0.85, 0.78, 0.72, 0.85, 0.82, 0.75, 0.78, 0.82, 0.80, 0.90, 0.88, 0.85, 0.90, 0.88, 0.87, 0.88, 0.87, 0.86, 0.85, 0.87, 0.86, 0.92, 0.89, 0.85, 0.94, 0.91, 0.88, 0.93, 0.90, 0.87]
-    similarity_types = ["content_based", "collaborative_filtering", "hybrid"] * 10
-    
-    # 準備插入資料
-    data = [
-        product_id_1s,
-        product_id_2s,
-        similarity_scores,
-        similarity_types,
-        [int(np.datetime64('now').astype('datetime64[s]').astype(int))] * len(product_id_1s)
-    ]
+    # 只保留相似度達門檻的配對，筆數隨實際相似度而定
+    load_manager = CollectionLoadManager()
+    load_manager.sync_loaded_collections()
+    product_collection = load_manager.acquire("product_vectors")
+    data, stats = build_similarity_pairs(product_collection)
     
     # 插入資料
-    collection.insert(data)
-    collection.flush()
+    if stats["pairs"]:
+        collection.insert(data)
+        collection.flush()
     
-    print(f"✅ 已插入 {len(product_id_1s)} 筆商品相似度資料")
+    print(f"✅ 已插入 {stats['pairs']} 筆商品相似度資料 "
+          f"({stats['products']} 個商品, {stats['products_without_pairs']} 個無相似商品, "
+          f"{stats['capped_products']} 個達上限, {stats['elapsed_s']:.2f}s)")
 
 def test_extended_vector_search():
     """測試擴展向量搜尋功能"""
     print("測試擴展向量搜尋功能...")
     
-    # 載入集合
-    product_collection = Collection("product_vectors")
-    product_collection.load()
-    
-    user_collection = Collection("user_vectors")
-    user_collection.load()
+    # 在記憶體預算內載入集合
+    load_manager = CollectionLoadManager()
+    load_manager.sync_loaded_collections()
+    product_collection = load_manager.acquire("product_vectors")
+    user_collection = load_manager.acquire("user_vectors")
+    behavior_collection = load_manager.acquire("user_behavior")
     
-    behavior_collection = Collection("user_behavior")
-    behavior_collection.load()
-    
-    # 生成測試查詢向量
-    query_vector = np.random.random(512).astype(np.float32).tolist()
-    user_query_vector = np.random.random(256).astype(np.float32).tolist()
-    behavior_query_vector = np.random.random(128).astype(np.float32).tolist()
+    # 生成測試查詢向量 (依集合距離類型正規化)
+    query_vector = prepare_vectors("product_vectors", np.random.random(512))[0].tolist()
+    user_query_vector = prepare_vectors("user_vectors", np.random.random(256))[0].tolist()
+    behavior_query_vector = prepare_vectors("user_behavior", np.random.random(128))[0].tolist()
     
     # 執行商品搜尋
-    search_params = {
-        "metric_type": "L2",
-        "params": {"nprobe": 10}
-    }
+    search_params = collection_search_params("product_vectors")
     
     product_results = product_collection.search(
         data=[query_vector],
@@ -433,11 +418,21 @@ def test_extended_vector_search():
         output_fields=["product_id", "category_id", "brand"]
     )
     
+    # 超量取回後以 MMR 重排序，每個品牌最多 2 筆
+    diverse_results = search_diverse(
+        product_collection,
+        [query_vector],
+        limit=5,
+        search_params=search_params,
+        max_per_brand=2,
+        output_fields=["product_id"]
+    )
+    
     # 執行用戶搜尋
     user_results = user_collection.search(
         data=[user_query_vector],
         anns_field="embedding",
-        param=search_params,
+        param=collection_search_params("user_vectors"),
         limit=3,
         output_fields=["user_id", "age_group", "preference_category"]
     )
@@ -446,7 +441,7 @@ def test_extended_vector_search():
     behavior_results = behavior_collection.search(
         data=[behavior_query_vector],
         anns_field="behavior_vector",
-        param=search_params,
+        param=collection_search_params("user_behavior"),
         limit=5,
         output_fields=["user_id", "product_id", "behavior_type"]
     )
@@ -458,6 +453,10 @@ def test_extended_vector_search():
     
     for hit in product_results[0][:3]:
         print(f"  - 商品ID: {hit.entity.get('product_id')}, 距離: {hit.distance:.4f}")
+    
+    print(f"多樣化重排序品牌: {[hit.entity.get('brand') for hit in diverse_results[0]]}")
+    
+    load_manager.report()
 
 def show_extended_collection_info():
     """顯示擴展集合資訊"""
@@ -507,6 +506,10 @@ def main():
         insert_user_behavior_data(behavior_collection)
         insert_product_similarity_data(similarity_collection)
         
+        # 搜尋歷史與行為資料寫入時不逐批 flush；結束前 flush 一次，num_entities 只計入已 flush 的 segment
+        search_collection.flush()
+        behavior_collection.flush()
+        
         # 測試搜尋功能
         test_extended_vector_search()
         